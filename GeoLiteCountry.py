@@ -1,8 +1,8 @@
 import socket
 import csv
 import geoip2.database
-import requests
 import pandas as pd
+from src.analysis.ripestat import RipeStatClient
 
 # Paths to GeoIP databases (update with actual paths)
 GEOIP_COUNTRY_DB = "Path to GeoLite2-Country.mmdb file"
@@ -15,47 +15,54 @@ FILE2 = "Path to IP to SLD mapping file in .csv format"
 # Output file
 OUTPUT_FILE = "Path to output file in .csv format"
 
-# RIPE API URL
-RIPE_API_URL = "https://stat.ripe.net/data/prefix-overview/data.json?resource={}"
+# RIPEstat API (the RIPESTAT_URL environment variable overrides the base URL, e.g. for a local stub)
+RIPE_CACHE = "cache/ripestat.sqlite"
+RIPE_CONCURRENCY = 8
 
-def get_geoip_info(ip):
-    """Fetch country and ASN info for an IP using GeoIP databases."""
-    country, asn, org = None, None, None
+def get_geoip_info(ips):
+    """Fetch country and ASN info for a batch of IPs, opening each GeoIP database once (None for what they lack)."""
+    info = {ip: [None, None, None] for ip in ips}
 
     try:
         with geoip2.database.Reader(GEOIP_COUNTRY_DB) as country_reader:
-            country = country_reader.country(ip).country.name
-    except (geoip2.errors.AddressNotFoundError, FileNotFoundError):
-        country = None
+            for ip, values in info.items():
+                try:
+                    values[0] = country_reader.country(ip).country.name
+                except geoip2.errors.AddressNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
 
     try:
         with geoip2.database.Reader(GEOIP_ASN_DB) as asn_reader:
-            asn_data = asn_reader.asn(ip)
-            asn = asn_data.autonomous_system_number
-            org = asn_data.autonomous_system_organization
-    except (geoip2.errors.AddressNotFoundError, FileNotFoundError):
-        asn, org = None, None
-
-    # If local lookup fails, use RIPEstat API
-    if not country or not asn or not org:
-        country, asn, org = get_ripe_info(ip)
-
-    return country or "Unknown", asn or "Unknown", org or "Unknown"
-
-def get_ripe_info(ip):
-    """Fetch country, ASN, and organization using RIPEstat API."""
-    try:
-        response = requests.get(RIPE_API_URL.format(ip))
-        data = response.json()
-
-        asn = data["data"]["asns"][0]["asn"] if data["data"]["asns"] else None
-        org = data["data"]["asns"][0]["holder"] if data["data"]["asns"] else None
-        country = data["data"]["located_resources"][0]["location"]["country"] if "located_resources" in data["data"] else None
-
-        return country, asn, org
-    except Exception as e:
-        print(f"[!] RIPE API error for IP {ip}: {e}")
-        return None, None, None
+            for ip, values in info.items():
+                try:
+                    asn_data = asn_reader.asn(ip)
+                    values[1] = asn_data.autonomous_system_number
+                    values[2] = asn_data.autonomous_system_organization
+                except geoip2.errors.AddressNotFoundError:
+                    pass
+    except FileNotFoundError:
+        pass
+
+    return {ip: tuple(values) for ip, values in info.items()}
+
+def get_ip_info(ips):
+    """
+    Country, ASN and organization of a batch of IPs.
+
+    GeoIP databases first; IPs they don't fully cover are looked up
+    together through RIPEstat (pooled, concurrent, cached by prefix).
+    """
+    info = get_geoip_info(set(ips))
+    incomplete = [ip for ip, (country, asn, org) in info.items() if not country or not asn or not org]
+    if incomplete:
+        client = RipeStatClient(cache_path=RIPE_CACHE, concurrency=RIPE_CONCURRENCY)
+        ripe = client.lookup(incomplete)
+        client.close()
+        for ip in incomplete:
+            info[ip] = ripe.get(ip, (None, None, None))
+    return {ip: (country or "Unknown", asn or "Unknown", org or "Unknown") for ip, (country, asn, org) in info.items()}
 
 # Load both CSV files
 df1 = pd.read_csv(FILE1)
@@ -66,18 +73,18 @@ df1.columns = df1.columns.str.strip()
 df2.columns = df2.columns.str.strip()
 
 # Create a mapping from SLD to first IP Address
-ip_lookup = df2.groupby("SLD")["IP Address"].first().to_dict()
-
-# Update unknown values using IP lookup
-for index, row in df1.iterrows():
-    if row["Country"] == "Unknown" or row["ASN Number"] == "Unknown" or row["Organization"] == "Unknown":
-        sld = row["SLD"]
-        if sld in ip_lookup:
-            ip = ip_lookup[sld]
-            country, asn, org = get_geoip_info(ip)
-            df1.at[index, "Country"] = country
-            df1.at[index, "ASN Number"] = asn
-            df1.at[index, "Organization"] = org
+ip_lookup = df2.groupby("SLD")["IP Address"].first()
+
+# Update unknown values using IP lookup: one lookup per distinct IP, however many rows share it
+columns = ["Country", "ASN Number", "Organization"]
+unknown = (df1[columns] == "Unknown").any(axis=1)
+row_ips = df1.loc[unknown, "SLD"].map(ip_lookup).dropna()
+ip_info = get_ip_info(row_ips.unique())
+info = pd.DataFrame.from_dict(ip_info, orient="index", columns=columns)
+enriched = row_ips.to_frame("IP").join(info, on="IP")
+# Object columns take the numeric ASNs next to "Unknown" (pandas 3 reads them as str)
+df1[columns] = df1[columns].astype(object)
+df1.loc[enriched.index, columns] = enriched[columns]
 
 # Save the final CSV
 df1.to_csv(OUTPUT_FILE, index=False)
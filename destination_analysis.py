@@ -1,22 +1,40 @@
+import os
 import argparse
-import concurrent.futures
-from src.analysis.extract_domain import compute_unique_domains
-from src.analysis.ip_to_domain import compute_ip_to_domain
-from src.analysis.comparison import compare_domain_list
-from src.utils import *
+from src.utils import setup_logger
+from src.profiling import enable_profiling, finish_profiling
 
 
 
+def add_catalog_arguments(subparser):
+    subparser.add_argument("--catalog", help="PCAP catalog database (instead of --input_file)")
+    subparser.add_argument("--device", help="Device to take from the catalog")
+    subparser.add_argument("--month", help="Month to take from the catalog (YYYY-MM)")
+
+def catalog_input(args):
+    """Device -> PCAPs from the catalog, or None when --input_file is used."""
+    if not args.catalog:
+        return None
+    from src.analysis.catalog import catalog_pcaps
+    return catalog_pcaps(args.catalog, args.device, args.month)
+
+
 def main():
     parser = argparse.ArgumentParser(description="IoT Traffic Analysis Tool")
     subparsers = parser.add_subparsers(dest="command")
     
     # Subcommand: Compute unique domains
     domain_parser = subparsers.add_parser("domains", help="Compute unique domains")
-    domain_parser.add_argument("--input_file", required=True, help="File with path to input PCAP files")
+    domain_parser.add_argument("--input_file", help="File with path to input PCAP files")
     domain_parser.add_argument("--output_dir", required=True, help="Output dir for unique domains")
     # domain_parser.add_argument("--sld", action='store_const', default=False, const=True, help="output slds instead of full domain names")
     domain_parser.add_argument("--exp", help="Experiment name for logging")
+    add_catalog_arguments(domain_parser)
+    domain_parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR", help="Write per-stage profiles (pstats + collapsed stacks) under DIR")
+    domain_parser.add_argument("--extract_profile", choices=["full", "fast"], default="full", help="tshark profile: full dissection, or BPF prefilter + minimal dissectors")
+    domain_parser.add_argument("--max_memory", type=int, metavar="MB", help="Memory the concurrent tshark runs may use together (default: 80%% of the available memory)")
+    domain_parser.add_argument("--backend", choices=["tshark", "sharkd"], default="tshark", help="Field extraction: a tshark process per capture, or a pool of long-lived sharkd sessions (Wireshark 3.6+)")
+    domain_parser.add_argument("--chunk_size", type=int, metavar="MB", help="Split pcap files larger than two chunks of this size and extract the chunks in parallel")
+    domain_parser.add_argument("--chunk_workers", type=int, help="tshark runs over chunks at once (default: number of CPUs)")
 
     # Subcommand: Extract IPs from PCAP files
     ip_map_parser = subparsers.add_parser("map_ips", help="Extract IPs")
@@ -25,7 +43,135 @@ def main():
     ip_map_parser.add_argument("--output_dir", required=True, help="Output dir for IP mappings")
     # ip_map_parser.add_argument("--sld", action='store_const', default=False, const=True, help="output slds instead of full domain names")
     ip_map_parser.add_argument("--exp", help="Experiment name for logging")
+    add_catalog_arguments(ip_map_parser)
+    ip_map_parser.add_argument("--passive_dns", metavar="INDEX", help="Passive DNS index (see passive_dns) translating IPs this month's DNS/TLS data misses")
+    ip_map_parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR", help="Write per-stage profiles (pstats + collapsed stacks) under DIR")
+    ip_map_parser.add_argument("--extract_profile", choices=["full", "fast"], default="full", help="tshark profile: full dissection, or BPF prefilter + minimal dissectors")
+    ip_map_parser.add_argument("--max_memory", type=int, metavar="MB", help="Memory the concurrent tshark runs may use together (default: 80%% of the available memory)")
+    ip_map_parser.add_argument("--backend", choices=["tshark", "sharkd"], default="tshark", help="Field extraction: a tshark process per capture, or a pool of long-lived sharkd sessions (Wireshark 3.6+)")
+    ip_map_parser.add_argument("--chunk_size", type=int, metavar="MB", help="Split pcap files larger than two chunks of this size and extract the chunks in parallel")
+    ip_map_parser.add_argument("--chunk_workers", type=int, help="tshark runs over chunks at once (default: number of CPUs)")
+
+
+    # Subcommand: Run domains + map_ips for many months on one worker pool
+    schedule_parser = subparsers.add_parser("schedule", help="Extract many device-months at once, largest PCAPs first")
+    schedule_parser.add_argument("--input_lists", nargs="+", help="Per-month input lists inputs/<device>_longitudinal/YYYY-MM.txt")
+    schedule_parser.add_argument("--catalog", help="PCAP catalog database (instead of --input_lists)")
+    schedule_parser.add_argument("--devices", nargs="+", help="Devices to schedule from the catalog")
+    schedule_parser.add_argument("--years", nargs="+", help="Years to schedule from the catalog")
+    schedule_parser.add_argument("--base_dir", default="analysis_longitudinal", help="Base directory for longitudinal analysis")
+    schedule_parser.add_argument("--workers", type=int, help="Worker threads (default: number of CPUs)")
+    schedule_parser.add_argument("--sample", type=float, metavar="FRACTION", help="Only process this fraction of each month's PCAPs, spread across days and hours, and estimate what was missed")
+    schedule_parser.add_argument("--seed", help="Seed for --sample (default: random)")
+    schedule_parser.add_argument("--index", metavar="DB", help="Update this destination index as each month is written")
+    schedule_parser.add_argument("--rollups", action="store_true", help="Also write hourly, daily and monthly destination sets (rollups/) from the PCAP timestamps")
+    schedule_parser.add_argument("--passive_dns", metavar="INDEX", help="Passive DNS index (see passive_dns) translating IPs a month's DNS/TLS data misses")
+    schedule_parser.add_argument("--exp", help="Experiment name for logging")
+    schedule_parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR", help="Write per-stage profiles (pstats + collapsed stacks) under DIR")
+    schedule_parser.add_argument("--extract_profile", choices=["full", "fast"], default="full", help="tshark profile: full dissection, or BPF prefilter + minimal dissectors")
+    schedule_parser.add_argument("--max_memory", type=int, metavar="MB", help="Memory the concurrent tshark runs may use together (default: 80%% of the available memory)")
+    schedule_parser.add_argument("--backend", choices=["tshark", "sharkd"], default="tshark", help="Field extraction: a tshark process per capture, or a pool of long-lived sharkd sessions (Wireshark 3.6+)")
+    schedule_parser.add_argument("--chunk_size", type=int, metavar="MB", help="Split pcap files larger than two chunks of this size and extract the chunks in parallel")
+    schedule_parser.add_argument("--chunk_workers", type=int, help="tshark runs over chunks at once (default: number of CPUs)")
+
+    # Subcommand: Estimate a schedule run before starting it
+    plan_parser = subparsers.add_parser("plan", help="Estimate runtime, peak memory and output size of a schedule run, and suggest a worker count")
+    plan_parser.add_argument("--input_lists", nargs="+", help="Per-month input lists inputs/<device>_longitudinal/YYYY-MM.txt")
+    plan_parser.add_argument("--catalog", help="PCAP catalog database (instead of --input_lists)")
+    plan_parser.add_argument("--devices", nargs="+", help="Devices to plan from the catalog")
+    plan_parser.add_argument("--years", nargs="+", help="Years to plan from the catalog")
+    plan_parser.add_argument("--workers", type=int, help="Estimate for this worker count (default: the suggested one)")
+    plan_parser.add_argument("--extract_profile", choices=["full", "fast"], default="full", help="Profile the run will use (only matching history is used)")
+    plan_parser.add_argument("--history", help="Throughput history (default: logs/throughput_<host>.jsonl, written by schedule)")
+    plan_parser.add_argument("--output", help="Write the JSON plan to this file instead of stdout")
+    plan_parser.add_argument("--exp", help="Experiment name for logging")
+
+    # Subcommand: Fixed-memory destination summaries
+    summary_parser = subparsers.add_parser("summary", help="Distinct counts and top destinations per device-month from sketches, or merge sketches")
+    summary_parser.add_argument("--input_lists", nargs="+", help="Per-month input lists inputs/<device>_longitudinal/YYYY-MM.txt")
+    summary_parser.add_argument("--catalog", help="PCAP catalog database (instead of --input_lists)")
+    summary_parser.add_argument("--devices", nargs="+", help="Devices to summarize from the catalog")
+    summary_parser.add_argument("--years", nargs="+", help="Years to summarize from the catalog")
+    summary_parser.add_argument("--base_dir", default="analysis_longitudinal", help="Base directory for longitudinal analysis")
+    summary_parser.add_argument("--merge", nargs="+", metavar="SKETCH", help="Merge these destination_sketch.json files (across files, months or devices) instead")
+    summary_parser.add_argument("--output", help="Merged sketch path for --merge")
+    summary_parser.add_argument("--precision", type=int, default=12, help="HyperLogLog precision, 2**precision registers (default: 12, ~1.6%% error)")
+    summary_parser.add_argument("--top_k", type=int, default=100, help="Destinations tracked by each top-k sketch (default: 100)")
+    summary_parser.add_argument("--top", type=int, default=20, help="Top destinations listed in the report (default: 20)")
+    summary_parser.add_argument("--workers", type=int, help="Worker threads (default: number of CPUs)")
+    summary_parser.add_argument("--exp", help="Experiment name for logging")
+    summary_parser.add_argument("--extract_profile", choices=["full", "fast"], default="full", help="tshark profile: full dissection, or BPF prefilter + minimal dissectors")
+    summary_parser.add_argument("--max_memory", type=int, metavar="MB", help="Memory the concurrent tshark runs may use together (default: 80%% of the available memory)")
+    summary_parser.add_argument("--backend", choices=["tshark", "sharkd"], default="tshark", help="Field extraction: a tshark process per capture, or a pool of long-lived sharkd sessions (Wireshark 3.6+)")
+
+    # Subcommand: Follow a device's capture directory as new PCAPs arrive
+    follow_parser = subparsers.add_parser("follow", help="Watch a device's capture directory and update its monthly outputs as PCAPs complete")
+    follow_parser.add_argument("--device", required=True, help="Device folder under --root")
+    follow_parser.add_argument("--root", help="Directory with one folder per device (default: /data/disk1/traffic/by-name)")
+    follow_parser.add_argument("--base_dir", default="analysis_longitudinal", help="Base directory for longitudinal analysis")
+    follow_parser.add_argument("--interval", type=float, default=60, help="Seconds between polls (default: 60)")
+    follow_parser.add_argument("--settle", type=float, default=120, help="Seconds without modification before the newest PCAP is processed (default: 120)")
+    follow_parser.add_argument("--workers", type=int, help="Worker threads when several PCAPs are pending")
+    follow_parser.add_argument("--once", action="store_true", help="Process the PCAPs present now and exit")
+    follow_parser.add_argument("--index", metavar="DB", help="Update this destination index as the month's outputs change")
+    follow_parser.add_argument("--exp", help="Experiment name for logging")
+    follow_parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR", help="Write per-stage profiles (pstats + collapsed stacks) under DIR")
+    follow_parser.add_argument("--extract_profile", choices=["full", "fast"], default="full", help="tshark profile: full dissection, or BPF prefilter + minimal dissectors")
+    follow_parser.add_argument("--max_memory", type=int, metavar="MB", help="Memory the concurrent tshark runs may use together (default: 80%% of the available memory)")
+    follow_parser.add_argument("--backend", choices=["tshark", "sharkd"], default="tshark", help="Field extraction: a tshark process per capture, or a pool of long-lived sharkd sessions (Wireshark 3.6+)")
+
+    # Subcommand: Index the PCAP tree once
+    catalog_parser = subparsers.add_parser("catalog", help="Build/refresh the PCAP catalog or list PCAPs from it")
+    catalog_parser.add_argument("--db", required=True, help="Catalog database path")
+    catalog_parser.add_argument("--root", help="Directory with one folder per device (default: /data/disk1/traffic/by-name)")
+    catalog_parser.add_argument("--devices", nargs="+", help="Only refresh these devices")
+    catalog_parser.add_argument("--list", metavar="FILE", help="Write the PCAPs of --device/--month to FILE (an input list) instead of refreshing")
+    catalog_parser.add_argument("--device", help="Device to list")
+    catalog_parser.add_argument("--month", help="Month to list (YYYY-MM)")
+    catalog_parser.add_argument("--list_dir", metavar="DIR", help="Write the list of every --device month of --years to DIR/<YYYY-MM>.txt")
+    catalog_parser.add_argument("--years", nargs="+", help="Years to write with --list_dir")
+    catalog_parser.add_argument("--exp", help="Experiment name for logging")
+
+    # Subcommand: Offline ASN/organization attribution
+    attribute_parser = subparsers.add_parser("attribute", help="Attribute IPs and domains to ASN/organization offline")
+    attribute_parser.add_argument("--month_dirs", nargs="+", required=True, help="Month output dirs (with ip_list/ and domain_list/)")
+    attribute_parser.add_argument("--asn_db", help="GeoLite2-ASN.mmdb")
+    attribute_parser.add_argument("--asn_dump", help="Prefix->ASN/org dump (GeoLite2-ASN-Blocks CSV or 'prefix asn org' lines)")
+    attribute_parser.add_argument("--exp", help="Experiment name for logging")
+
+    # Subcommand: Cloud/CDN provider classification
+    providers_parser = subparsers.add_parser("providers", help="Classify IPs and domains by cloud/CDN provider IP ranges")
+    providers_parser.add_argument("--month_dirs", nargs="+", required=True, help="Month output dirs (with ip_list/ and domain_list/)")
+    providers_parser.add_argument("--ranges_dir", required=True, help="Provider range files, one folder per provider (e.g. AWS/ip-ranges.json, Cloudflare/ips-v4)")
+    providers_parser.add_argument("--exp", help="Experiment name for logging")
 
+    # Subcommand: Passive DNS index from all months and external DNS logs
+    pdns_parser = subparsers.add_parser("passive_dns", help="Build the passive DNS index (IP -> domains over time) used by map_ips/schedule --passive_dns")
+    pdns_parser.add_argument("--output", required=True, help="Index path, e.g. analysis_longitudinal/passive_dns.idx")
+    pdns_parser.add_argument("--base_dir", help="Take every month under this longitudinal base dir")
+    pdns_parser.add_argument("--month_dirs", nargs="+", help="Month output dirs (with domain_list/ip_domain_map.pkl)")
+    pdns_parser.add_argument("--dns_logs", nargs="+", help="External DNS logs: '<epoch ts> <domain> <ip>[,<ip>...]' per line (e.g. tshark fields output)")
+    pdns_parser.add_argument("--exp", help="Experiment name for logging")
+
+    # Subcommand: Inverted destination index
+    index_parser = subparsers.add_parser("index", help="Build/update the inverted destination index from month outputs")
+    index_parser.add_argument("--db", required=True, help="Index database path")
+    index_parser.add_argument("--base_dir", default="analysis_longitudinal", help="Base directory for longitudinal analysis")
+    index_parser.add_argument("--devices", nargs="+", help="Only index these devices")
+    index_parser.add_argument("--month_dirs", nargs="+", help="(Re)index only these month output dirs")
+    index_parser.add_argument("--exp", help="Experiment name for logging")
+
+    query_parser = subparsers.add_parser("query", help="Which devices contacted a destination, and in which months")
+    query_parser.add_argument("--db", required=True, help="Index database path")
+    query_group = query_parser.add_mutually_exclusive_group(required=True)
+    query_group.add_argument("--domain", help="Exact domain")
+    query_group.add_argument("--suffix", help="Domain suffix, e.g. '*.tuyaus.com'")
+    query_group.add_argument("--sld", help="Exact SLD")
+    query_group.add_argument("--ip", help="IP, CIDR (52.94.0.0/16) or textual prefix (52.94.)")
+    query_parser.add_argument("--device", help="Only this device")
+    query_parser.add_argument("--years", nargs="+", help="Only these years")
+    query_parser.add_argument("--output", help="Write the JSON result to this file instead of stdout")
+    query_parser.add_argument("--exp", help="Experiment name for logging")
 
     # Subcommand: Compare domain lists
     compare_parser = subparsers.add_parser("compare_domains", help="Compare SLD lists")
@@ -40,21 +186,155 @@ def main():
     else:
         exp_name = "destination"
     logger = setup_logger(log_file=f"logs/{args.command}_{exp_name}_analysis.log")
+    if getattr(args, "profile", None):
+        enable_profiling(os.path.join(args.profile, f"{args.command}_{exp_name}"))
+    if getattr(args, "extract_profile", "full") != "full":
+        from src.parsers.tshark import set_extract_profile
+        set_extract_profile(args.extract_profile)
+    if getattr(args, "chunk_size", None):
+        from src.parsers.chunks import set_chunking
+        set_chunking(args.chunk_size, args.chunk_workers)
+    if getattr(args, "max_memory", None):
+        from src.governor import set_memory_limit
+        set_memory_limit(args.max_memory)
+    if getattr(args, "backend", "tshark") != "tshark":
+        from src.parsers.tshark import set_extract_backend
+        set_extract_backend(args.backend)
 
+    # Each subcommand imports only the modules it needs
     if args.command == "domains":
-        compute_unique_domains(args.input_file, args.output_dir)
+        if args.input_file or args.catalog:
+            from src.analysis.extract_domain import compute_unique_domains
+            compute_unique_domains(args.input_file, args.output_dir, catalog_input(args))
+        else:
+            logger.error("Please provide either --input_file or --catalog")
     elif args.command == "map_ips":
         # extract IPs from PCAP files 
-        if args.input_file:
-            compute_ip_to_domain(args.input_file, args.output_dir)
+        if args.input_file or args.catalog:
+            from src.analysis.ip_to_domain import compute_ip_to_domain
+            passive_dns = None
+            if args.passive_dns:
+                from src.analysis.passive_dns import PassiveDns
+                passive_dns = PassiveDns(args.passive_dns)
+            compute_ip_to_domain(args.input_file, args.output_dir, catalog_input(args), passive_dns)
         # elif args.ip_file_dir:
         #     compute_ip_to_domain(args.ip_file_dir, args.output_dir, args.sld, ip_files=True)
         else:
-            logger.error("Please provide either --input_file ")
+            logger.error("Please provide either --input_file or --catalog")
+    elif args.command == "schedule":
+        from src.analysis.scheduler import jobs_from_input_lists, jobs_from_catalog, sample_jobs, run_schedule
+        jobs = None
+        if args.sample is not None and not 0 < args.sample <= 1:
+            logger.error("--sample must be a fraction in (0, 1]")
+        elif args.catalog and args.devices:
+            jobs = jobs_from_catalog(args.catalog, args.devices, args.years, args.base_dir)
+        elif args.input_lists:
+            jobs = jobs_from_input_lists(args.input_lists, args.base_dir)
+        else:
+            logger.error("Please provide either --input_lists or --catalog with --devices")
+        if jobs is not None:
+            if args.sample is not None:
+                jobs = sample_jobs(jobs, args.sample, args.seed)
+            passive_dns = None
+            if args.passive_dns:
+                from src.analysis.passive_dns import PassiveDns
+                passive_dns = PassiveDns(args.passive_dns)
+            run_schedule(jobs, args.workers, args.index, args.rollups, passive_dns)
+    elif args.command == "plan":
+        import json
+        import datetime
+        from src.analysis.planner import plan_run, job_sizes, catalog_sizes
+        month_sizes = None
+        if args.catalog and args.devices:
+            month_sizes = catalog_sizes(args.catalog, args.devices, args.years)
+        elif args.input_lists:
+            from src.analysis.scheduler import jobs_from_input_lists
+            month_sizes = job_sizes(jobs_from_input_lists(args.input_lists, "analysis_longitudinal"))
+        else:
+            logger.error("Please provide either --input_lists or --catalog with --devices")
+        if month_sizes is not None:
+            plan = plan_run(month_sizes, args.workers, args.extract_profile, args.history)
+            estimate = plan["estimate"]
+            logger.info(f"{plan['inputs']['pcaps']} PCAPs ({plan['inputs']['bytes'] / 1e9:.2f} GB) in {plan['inputs']['months']} months, "
+                        f"{plan['model']['runs']} recorded runs: ~{datetime.timedelta(seconds=round(estimate['runtime_s']))} with {estimate['workers']} workers, "
+                        f"~{estimate['peak_memory_mb']} MB peak, ~{estimate['output_bytes'] / 1e6:.0f} MB of outputs "
+                        f"(suggested workers: {plan['suggested_workers']})")
+            if args.output:
+                with open(args.output, 'w') as f:
+                    json.dump(plan, f, indent=4)
+            else:
+                print(json.dumps(plan, indent=4))
+    elif args.command == "summary":
+        from src.analysis.summary import run_summary, merge_summaries
+        from src.analysis.scheduler import jobs_from_input_lists, jobs_from_catalog
+        if args.merge:
+            if args.output:
+                merge_summaries(args.merge, args.output, args.top)
+            else:
+                logger.error("Please provide --output with --merge")
+        elif args.catalog and args.devices:
+            run_summary(jobs_from_catalog(args.catalog, args.devices, args.years, args.base_dir),
+                        args.workers, args.precision, args.top_k, args.top)
+        elif args.input_lists:
+            run_summary(jobs_from_input_lists(args.input_lists, args.base_dir),
+                        args.workers, args.precision, args.top_k, args.top)
+        else:
+            logger.error("Please provide --input_lists, --catalog with --devices, or --merge")
+    elif args.command == "follow":
+        from src.analysis.follow import follow_device
+        from src.analysis.catalog import PCAP_ROOT
+        follow_device(args.device, args.base_dir, args.root or PCAP_ROOT, interval=args.interval,
+                      settle=args.settle, workers=args.workers, once=args.once, index_db=args.index)
+    elif args.command == "catalog":
+        from src.analysis.catalog import refresh_catalog, catalog_pcaps, write_month_lists, PCAP_ROOT
+        if args.root or not (args.list or args.list_dir):
+            refresh_catalog(args.db, args.root or PCAP_ROOT, args.devices)
+        if args.list_dir:
+            write_month_lists(args.db, args.device, args.years, args.list_dir)
+        if args.list:
+            with open(args.list, 'w') as f:
+                for files in catalog_pcaps(args.db, args.device, args.month).values():
+                    f.writelines(f"{path}\n" for path in files)
+    elif args.command == "attribute":
+        if args.asn_db or args.asn_dump:
+            from src.analysis.asn_attribution import compute_attribution
+            compute_attribution(args.month_dirs, args.asn_db, args.asn_dump)
+        else:
+            logger.error("Please provide either --asn_db or --asn_dump")
+    elif args.command == "providers":
+        from src.analysis.cloud_ranges import compute_provider_classification
+        compute_provider_classification(args.month_dirs, args.ranges_dir)
+    elif args.command == "passive_dns":
+        if args.base_dir or args.month_dirs or args.dns_logs:
+            from src.analysis.passive_dns import build_passive_dns
+            build_passive_dns(args.output, args.month_dirs, args.base_dir, args.dns_logs)
+        else:
+            logger.error("Please provide --base_dir, --month_dirs or --dns_logs")
+    elif args.command == "index":
+        from src.analysis.destination_index import update_index, index_month
+        if args.month_dirs:
+            for month_dir in args.month_dirs:
+                index_month(args.db, month_dir)
+        else:
+            update_index(args.db, args.base_dir, args.devices)
+    elif args.command == "query":
+        import json
+        import time
+        from src.analysis.destination_index import query_index
+        start = time.perf_counter()
+        results = query_index(args.db, args.domain, args.suffix, args.sld, args.ip, args.device, args.years)
+        logger.info(f"{len(results)} destinations found in {(time.perf_counter() - start) * 1000:.1f} ms")
+        if args.output:
+            with open(args.output, 'w') as f:
+                json.dump(results, f, indent=4)
+        else:
+            print(json.dumps(results, indent=4))
     elif args.command == "compare_domains":
+        from src.analysis.comparison import compare_domain_list
         compare_domain_list(args.file1, args.file2, args.output_dir)
     else:
         parser.print_help()
+    finish_profiling()
 
 if __name__ == "__main__":
     main()
@@ -2,11 +2,13 @@ import os
 import json
 import pickle
 import csv
-import subprocess
 import ipaddress
-import tldextract
 import argparse
-from collections import defaultdict
+from src.profiling import enable_profiling, finish_profiling, profile_stage
+from src.analysis.party_memo import ClassificationMemo, DEFAULT_MEMO
+
+# Organizations whose name contains one of these are Support-party
+SUPPORT_PARTY_LIST = ['aws', 'cloudflare', 'akamai', 'fastly', 'cdn', 'dns', 'digicert']
 
 
 def load_json(file_path):
@@ -20,6 +22,7 @@ def load_pickle(file_path):
 
 
 def get_whois_data(domain):
+    import subprocess
     try:
         result = subprocess.run(
             ['whois', domain],
@@ -43,6 +46,14 @@ def extract_organization(whois_data):
     return "Unknown"
 
 
+def whois_organization(domain):
+    """Organization from WHOIS ("Unknown" if the answer names none, even an empty one), or None when the lookup failed (timeout, no whois client)."""
+    whois_data = get_whois_data(domain)
+    if whois_data is None:
+        return None
+    return extract_organization(whois_data)
+
+
 def is_local_address(ip_str):
     try:
         ip = ipaddress.ip_address(ip_str)
@@ -52,11 +63,38 @@ def is_local_address(ip_str):
 
 
 def extract_sld_tld(domain):
+    # Imported on first use: loading tldextract and its suffix list is the
+    # bulk of party.py's start-up time
+    import tldextract
     ext = tldextract.extract(domain)
     return ext.domain, ext.suffix
 
 
-def categorize_domains(contacted_domains, unique_domains, ip_map, first_party_suffixes=None):
+def load_cert_orgs(cert_info, ip_domain_map):
+    """
+    Map domains to the organization named in their TLS server certificates.
+
+    cert_info: device -> {"domains": {sni: info}, "ips": {ip: info}} (cert_info.pkl)
+    ip_domain_map: device -> {ip: domain} (ip_domain_map.pkl); a certificate seen
+                   for an IP is credited to the domain the IP maps to, unless
+                   the domain has a certificate of its own
+    """
+    cert_orgs = {}
+    for device, info in cert_info.items():
+        for domain, cert in info.get("domains", {}).items():
+            if cert.get("organization"):
+                cert_orgs[domain] = cert["organization"]
+    for device, info in cert_info.items():
+        device_map = ip_domain_map.get(device, {})
+        for ip, cert in info.get("ips", {}).items():
+            domain = device_map.get(ip)
+            if domain and cert.get("organization") and domain not in cert_orgs:
+                cert_orgs[domain] = cert["organization"]
+    return cert_orgs
+
+
+def categorize_domains(contacted_domains, unique_domains, ip_map, first_party_suffixes=None, org_map=None,
+                       provider_map=None, cert_orgs=None, ads_domains=None, memo=None):
     """
     contacted_domains: list of domains contacted in that month
     unique_domains: list of domains considered first-party in the original pipeline
@@ -64,8 +102,19 @@ def categorize_domains(contacted_domains, unique_domains, ip_map, first_party_su
     ip_map: domain -> {organization, query_type, ...}
     first_party_suffixes: optional list of domain suffixes from first_party_domains.txt
                           e.g. ['sonos.com', 'sonos.net', 'vesync.com']
+    org_map: optional domain -> {organization, asn} from the offline ASN attribution
+             (domain_org_map.json); consulted before WHOIS
+    provider_map: optional domain -> cloud/CDN provider from the provider IP ranges
+                  (domain_provider_map.json); such domains are Support-party without WHOIS
+    cert_orgs: optional domain -> organization from the TLS server certificates in the
+               capture (see load_cert_orgs); consulted before any other lookup
+    ads_domains: optional set of domains flagged by the ads/tracker blocklists
+                 (AdsMatcher.tag); without it the Ads/Tracking column is left empty
+    memo: optional ClassificationMemo of the device, built with the same first-party
+          suffixes; a domain seen with the same evidence before is not classified
+          again, and WHOIS answers come from its cache
     """
-    support_party_list = ['aws', 'cloudflare', 'akamai', 'fastly', 'cdn', 'dns', 'digicert']
+    support_party_list = SUPPORT_PARTY_LIST
 
     unique_set = set(unique_domains) 
     
@@ -80,6 +129,29 @@ def categorize_domains(contacted_domains, unique_domains, ip_map, first_party_su
     categorized_data = []
 
     for domain in contacted_domains:
+        org = ip_map.get(domain, {}).get("organization", "Unknown")
+        query_type = ip_map.get(domain, {}).get("query_type", "Unknown")
+
+        # Subject organization of the certificate the server presented
+        if org == "Unknown" and cert_orgs and cert_orgs.get(domain):
+            org = cert_orgs[domain]
+
+        # Offline attribution through the IPs the domain resolved to
+        if org == "Unknown" and org_map and org_map.get(domain, {}).get("organization"):
+            org = org_map[domain]["organization"]
+
+        provider = provider_map.get(domain) if provider_map else None
+
+        ads_flag = "" if ads_domains is None else ("Yes" if domain in ads_domains else "No")
+
+        # Everything the month says about the domain; the rest only depends on the rules
+        evidence = json.dumps([domain in unique_set, org, provider])
+        memoized = memo.get(domain, evidence) if memo else None
+        if memoized:
+            sld, tld, category, org = memoized
+            categorized_data.append([domain, sld, tld, category, org, query_type, ads_flag])
+            continue
+
         sld, tld = extract_sld_tld(domain)
         d_lower = domain.lower()
 
@@ -93,13 +165,19 @@ def categorize_domains(contacted_domains, unique_domains, ip_map, first_party_su
 
         category = "First-party" if is_first else "Third-party"
 
-        org = ip_map.get(domain, {}).get("organization", "Unknown")
-        query_type = ip_map.get(domain, {}).get("query_type", "Unknown")
+        # Domains served from cloud/CDN ranges are Support-party and the provider stands in for WHOIS,
+        # but a first-party match wins (the vendor's own endpoints are often hosted on a cloud)
+        if provider and not is_first:
+            category = "Support-party"
+            if org == "Unknown":
+                org = provider
 
         # If organization is unknown, try WHOIS
         if org == "Unknown":
-            whois_data = get_whois_data(domain)
-            extracted_org = extract_organization(whois_data)
+            if memo:
+                extracted_org = memo.whois_organization(domain, whois_organization)
+            else:
+                extracted_org = extract_organization(get_whois_data(domain))
             if extracted_org != "Unknown":
                 org = extracted_org
 
@@ -109,7 +187,10 @@ def categorize_domains(contacted_domains, unique_domains, ip_map, first_party_su
                 category = "Support-party"
                 break
 
-        categorized_data.append([domain, sld, tld, category, org, query_type])
+        if memo:
+            memo.put(domain, evidence, sld, tld, category, org)
+
+        categorized_data.append([domain, sld, tld, category, org, query_type, ads_flag])
 
     return categorized_data
 
@@ -118,7 +199,7 @@ def save_to_csv(data, output_path):
     os.makedirs(os.path.dirname(output_path), exist_ok=True)
     with open(output_path, 'w', newline='') as f:
         writer = csv.writer(f)
-        writer.writerow(["Month-Year", "Domain", "SLD", "TLD", "Category", "Organization", "Query Type"])
+        writer.writerow(["Month-Year", "Domain", "SLD", "TLD", "Category", "Organization", "Query Type", "Ads/Tracking"])
         writer.writerows(data)
 
 
@@ -132,8 +213,25 @@ def main():
                         help="Base directory for longitudinal analysis (default: analysis_longitudinal)")
     parser.add_argument("--years", nargs="+", default=["2023", "2024", "2025"],
                         help="Years to process, e.g. --years 2024 2025")
+    parser.add_argument("--profile", nargs="?", const="profiles", metavar="DIR",
+                        help="Write per-stage profiles (pstats + collapsed stacks) under DIR")
+    parser.add_argument("--blocklists", metavar="DIR",
+                        help="Ads/tracker blocklists (hosts files, domain lists, EasyList filters) to fill the Ads/Tracking column")
+    parser.add_argument("--memo", default=DEFAULT_MEMO, metavar="PATH",
+                        help=f"Classification memo and WHOIS cache reused across months and runs (default: {DEFAULT_MEMO})")
+    parser.add_argument("--no_memo", action="store_true",
+                        help="Classify every domain from scratch, without reading or updating the memo")
     args = parser.parse_args()
 
+    if args.profile:
+        enable_profiling(os.path.join(args.profile, f"party_{args.device}"))
+
+    # Compiled once (and cached in the directory), then every month is tagged in one batch
+    ads_matcher = None
+    if args.blocklists:
+        from src.parsers.ads_domain_check import AdsMatcher
+        ads_matcher = AdsMatcher.from_dir(args.blocklists)
+
     # Base path for this device's longitudinal results
     base_path = os.path.join(os.path.expanduser(args.base_dir), args.device)
     output_base_path = base_path  # CSVs go alongside analysis
@@ -152,6 +250,12 @@ def main():
     else:
         print(f"No first-party domain file found at {first_party_file}; using unique_domains only")
 
+    memo = None
+    if not args.no_memo:
+        memo = ClassificationMemo(args.device, first_party_suffixes, SUPPORT_PARTY_LIST, args.memo)
+        if memo.invalidated is not None:
+            print(f"Classification rules changed: {memo.invalidated} memoized domains will be classified again")
+
     years = args.years
     months = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
               "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
@@ -170,6 +274,9 @@ def main():
             contacted_domains_file = os.path.join(domain_list_path, "contacted_domains.json")
             unique_domains_file = os.path.join(domain_list_path, "unique_domains.json")
             ip_map_file = os.path.join(domain_list_path, "ip_domain_map.pkl")
+            org_map_file = os.path.join(domain_list_path, "domain_org_map.json")
+            provider_map_file = os.path.join(domain_list_path, "domain_provider_map.json")
+            cert_info_file = os.path.join(domain_list_path, "cert_info.pkl")
 
             if not (os.path.exists(contacted_domains_file)
                     and os.path.exists(unique_domains_file)
@@ -180,6 +287,9 @@ def main():
             contacted_raw = load_json(contacted_domains_file)
             unique_raw = load_json(unique_domains_file)
             ip_map = load_pickle(ip_map_file)
+            org_map = load_json(org_map_file) if os.path.exists(org_map_file) else None
+            provider_map = load_json(provider_map_file) if os.path.exists(provider_map_file) else None
+            cert_orgs = load_cert_orgs(load_pickle(cert_info_file), ip_map) if os.path.exists(cert_info_file) else None
 
             # Normalise contacted_domains: list or dict {"..": [list]}
             if isinstance(contacted_raw, dict):
@@ -203,19 +313,36 @@ def main():
                 unique_domains = unique_raw
 
 
-            categorized_data = categorize_domains(
-                contacted_domains,
-                unique_domains,
-                ip_map,
-                first_party_suffixes=first_party_suffixes
-            )
+            ads_domains = ads_matcher.tag(contacted_domains) if ads_matcher else None
+
+            with profile_stage("classification"):
+                categorized_data = categorize_domains(
+                    contacted_domains,
+                    unique_domains,
+                    ip_map,
+                    first_party_suffixes=first_party_suffixes,
+                    org_map=org_map,
+                    provider_map=provider_map,
+                    cert_orgs=cert_orgs,
+                    ads_domains=ads_domains,
+                    memo=memo
+                )
+            if memo:
+                memo.flush()
+                print(f"{month}-{year}: {memo.hits} domains reused from the memo, {memo.misses} classified")
+                memo.hits = memo.misses = 0
 
             for entry in categorized_data:
                 entry.insert(0, f"{month}-{year}")
 
-            save_to_csv(categorized_data, output_csv)
+            with profile_stage("save"):
+                save_to_csv(categorized_data, output_csv)
             print(f"Categorized domain data saved to {output_csv}")
 
+    if memo:
+        memo.close()
+    finish_profiling()
+
 
 if __name__ == "__main__":
     main()
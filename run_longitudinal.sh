@@ -11,8 +11,14 @@ DEVICE_NAME="sonos_speaker"      # e.g. "tplink_plug", "camera1", etc.
 # Years you want to process (space-separated)
 YEARS="2023 2024 2025"
 
-# Where the PCAPs live for this device
-PCAP_ROOT="/data/disk1/traffic/by-name/${DEVICE_NAME}/ctrl2"
+# Where the PCAPs live: one folder per device, captures under <device>/ctrl2
+PCAP_ROOT="/data/disk1/traffic/by-name"
+
+# Indexed PCAP catalog (refreshed incrementally on every run)
+CATALOG_DB="inputs/pcap_catalog.sqlite"
+
+# Inverted destination index, updated once after all months (see `query`)
+INDEX_DB="analysis_longitudinal/destination_index.sqlite"
 
 # Where to store longitudinal analysis for this device
 MAC_BASE="analysis_longitudinal/${DEVICE_NAME}"
@@ -27,6 +33,20 @@ INPUT_BASE="inputs/${DEVICE_NAME}_longitudinal"
 mkdir -p "${MAC_BASE}"
 mkdir -p "${INPUT_BASE}"
 
+# Months processed by this run, indexed together after the loop
+MONTH_DIRS=()
+
+# Scan the device's capture folder once instead of running find per month,
+# and write every month's PCAP list (captures named YYYY-MM-*.pcap) in the same call
+python3 destination_analysis.py catalog \
+  --db "${CATALOG_DB}" \
+  --root "${PCAP_ROOT}" \
+  --devices "${DEVICE_NAME}" \
+  --device "${DEVICE_NAME}" \
+  --years ${YEARS} \
+  --list_dir "${INPUT_BASE}" \
+  --exp "${DEVICE_NAME}_catalog"
+
 for YEAR in ${YEARS}; do
   for MONTH_NUM in 01 02 03 04 05 06 07 08 09 10 11 12; do
 
@@ -37,9 +57,8 @@ for YEAR in ${YEARS}; do
     OUT_DIR="${MAC_BASE}/${YEAR}/${MONTH_FOLDER}"
     mkdir -p "${OUT_DIR}"
 
-    # Per-month PCAP list (pattern matches: YYYY-MM-*.pcap)
+    # Per-month PCAP list, written by the catalog call above
     LIST_FILE="${INPUT_BASE}/${YEAR}-${MONTH_NUM}.txt"
-    find "${PCAP_ROOT}" -type f -name "${YEAR}-${MONTH_NUM}-*.pcap" > "${LIST_FILE}"
 
     # If no PCAPs, skip this month
     if [ ! -s "${LIST_FILE}" ]; then
@@ -55,15 +74,24 @@ for YEAR in ${YEARS}; do
 
     # 1. Domains (DNS/TLS → domain_list/)
     python3 destination_analysis.py domains \
-      --input_file "${LIST_FILE}" \
+      --catalog "${CATALOG_DB}" --device "${DEVICE_NAME}" --month "${YEAR}-${MONTH_NUM}" \
       --output_dir "${OUT_DIR}" \
       --exp "${DEVICE_NAME}_${YEAR}_${MONTH_NUM}_domains"
 
     # 2. IPs (PCAPs → ip_list/ + IP→domain mapping)
     python3 destination_analysis.py map_ips \
-      --input_file "${LIST_FILE}" \
+      --catalog "${CATALOG_DB}" --device "${DEVICE_NAME}" --month "${YEAR}-${MONTH_NUM}" \
       --output_dir "${OUT_DIR}" \
       --exp "${DEVICE_NAME}_${YEAR}_${MONTH_NUM}_ips"
 
+    MONTH_DIRS+=("${OUT_DIR}")
+
   done
 done
+
+# 3. Destination index (domain/SLD/IP → device, month), one call for all months
+if [ ${#MONTH_DIRS[@]} -gt 0 ]; then
+  python3 destination_analysis.py index \
+    --db "${INDEX_DB}" --month_dirs "${MONTH_DIRS[@]}" \
+    --exp "${DEVICE_NAME}_index" > /dev/null
+fi
@@ -11,5 +11,8 @@ python3 destination_analysis.py domains --input_file path/input_2019idle.txt --o
 python3 destination_analysis.py map_ips --input_file path/input_2019idle.txt --output_dir path/2019idle  --exp 2019idle
 
 ## Third step mapping ip to domain using DNS/TLS data from uncontrolled dataset
-python3 scripts/ip_to_domain/ip_to_domain_with_uncontrolled_dns.py
+# Export the DNS answers of the uncontrolled dataset, build a passive DNS index with them, then translate again
+tshark -r path/uncontrolled.pcap -Y "dns.flags.response==1" -T fields -e frame.time_epoch -e dns.qry.name -e dns.a -e dns.aaaa > path/uncontrolled_dns.log
+python3 destination_analysis.py passive_dns --output path/passive_dns.idx --month_dirs path/2019idle --dns_logs path/uncontrolled_dns.log --exp 2019idle
+python3 destination_analysis.py map_ips --input_file path/input_2019idle.txt --output_dir path/2019idle --passive_dns path/passive_dns.idx --exp 2019idle
 
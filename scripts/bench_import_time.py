@@ -0,0 +1,96 @@
+"""
+Import-time benchmark for the CLI entry points.
+
+run_longitudinal.sh starts the interpreter twice per month, so start-up cost
+is paid dozens of times per device. This script measures, in a fresh
+interpreter, what each subcommand imports before doing any work and fails if
+a budget is exceeded or if a module that should be loaded lazily shows up.
+
+Usage:
+    python3 scripts/bench_import_time.py [--repeat 5] [--budget_ms 150]
+"""
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+REPO_ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# What each subcommand imports before it starts working
+TARGETS = {
+    "cli": "import destination_analysis",
+    "domains": "import destination_analysis, src.analysis.extract_domain",
+    "map_ips": "import destination_analysis, src.analysis.ip_to_domain",
+    "compare_domains": "import destination_analysis, src.analysis.comparison",
+    "party": "import party",
+}
+
+# Modules that must only be imported on first use
+LAZY_MODULES = ["tldextract", "multiprocessing", "subprocess", "requests", "pandas", "geoip2"]
+
+PROBE = """
+import sys, time
+start = time.perf_counter()
+{statement}
+elapsed = time.perf_counter() - start
+import json
+print(json.dumps({{"seconds": elapsed, "modules": sorted(sys.modules)}}))
+"""
+
+
+def run_probe(statement: str) -> dict:
+    """Time one import statement in a fresh interpreter."""
+    result = subprocess.run(
+        [sys.executable, "-c", PROBE.format(statement=statement)],
+        cwd=REPO_ROOT, stdout=subprocess.PIPE, stderr=subprocess.PIPE, text=True, check=True
+    )
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def top_imports(statement: str, limit: int) -> list:
+    """Return the slowest top-level imports according to -X importtime."""
+    result = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", statement],
+        cwd=REPO_ROOT, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True, check=True
+    )
+    rows = []
+    for line in result.stderr.splitlines():
+        if not line.startswith("import time:") or "cumulative" in line:
+            continue
+        _, cumulative_us, name = line[len("import time:"):].split("|")
+        # Nested imports are indented below their parent; keep top-level ones
+        if name.startswith("  "):
+            continue
+        rows.append((int(cumulative_us), name.strip()))
+    return sorted(rows, reverse=True)[:limit]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark CLI import time")
+    parser.add_argument("--repeat", type=int, default=5, help="Runs per target; the fastest is reported")
+    parser.add_argument("--budget_ms", type=float, default=None, help="Fail if any target exceeds this many ms")
+    parser.add_argument("--top", type=int, default=5, help="Show the N slowest imports per target")
+    args = parser.parse_args()
+
+    failed = False
+    for target, statement in TARGETS.items():
+        runs = [run_probe(statement) for _ in range(args.repeat)]
+        best_ms = min(r["seconds"] for r in runs) * 1000
+        eager = [m for m in LAZY_MODULES if m in runs[0]["modules"]]
+        status = "ok"
+        if eager:
+            status = f"EAGER IMPORTS: {', '.join(eager)}"
+            failed = True
+        if args.budget_ms is not None and best_ms > args.budget_ms:
+            status = f"OVER BUDGET ({args.budget_ms:.0f} ms)"
+            failed = True
+        print(f"{target:<16} {best_ms:8.1f} ms  {len(runs[0]['modules']):4d} modules  {status}")
+        for cumulative_us, name in top_imports(statement, args.top):
+            print(f"    {cumulative_us / 1000:8.1f} ms  {name}")
+
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
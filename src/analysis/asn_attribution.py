@@ -0,0 +1,136 @@
+import os
+import csv
+import json
+import time
+import pickle
+import logging
+from collections import Counter
+from src.analysis.prefix_index import PrefixIndex
+
+logger = logging.getLogger(__name__)
+
+
+def load_asn_mmdb(mmdb_path: str):
+    """
+    Yield (network, (asn, organization)) for every network of a GeoLite2-ASN mmdb.
+
+    Args:
+        mmdb_path (str): Path to GeoLite2-ASN.mmdb.
+    """
+    import maxminddb
+    with maxminddb.open_database(mmdb_path) as reader:
+        for network, record in reader:
+            if not record:
+                continue
+            yield network, (record.get("autonomous_system_number"), record.get("autonomous_system_organization"))
+
+
+def load_asn_dump(dump_path: str):
+    """
+    Yield (prefix, (asn, organization)) from a prefix->ASN/org dump.
+
+    Accepts the GeoLite2-ASN-Blocks CSV (network,autonomous_system_number,
+    autonomous_system_organization) or plain lines "prefix asn [organization]"
+    separated by tabs, commas or spaces, e.g. a routeviews/pyasn dump.
+
+    Args:
+        dump_path (str): Path to the dump file.
+    """
+    with open(dump_path, 'r', newline='') as f:
+        first = f.readline()
+        f.seek(0)
+        if first.startswith("network,"):
+            for row in csv.DictReader(f):
+                asn = row.get("autonomous_system_number")
+                yield row["network"], (int(asn) if asn else None, row.get("autonomous_system_organization") or None)
+            return
+        for line in f:
+            line = line.strip()
+            if not line or line.startswith("#") or line.startswith(";"):
+                continue
+            sep = "\t" if "\t" in line else ("," if "," in line else None)
+            parts = [p.strip() for p in line.split(sep, 2)]
+            if len(parts) < 2:
+                continue
+            asn = parts[1].upper().removeprefix("AS")
+            yield parts[0], (int(asn) if asn.isdigit() else None, parts[2] if len(parts) > 2 else None)
+
+
+def build_asn_index(asn_db: str = None, asn_dump: str = None) -> PrefixIndex:
+    """Build the prefix index from an ASN mmdb or a prefix dump."""
+    start = time.perf_counter()
+    if asn_db:
+        index = PrefixIndex(load_asn_mmdb(asn_db))
+    else:
+        index = PrefixIndex(load_asn_dump(asn_dump))
+    logger.info(f"ASN index built: {len(index)} ranges in {time.perf_counter() - start:.2f}s")
+    return index
+
+
+def _device_lists(data) -> list:
+    """Flatten {device: [..]} (or a plain list) into one list."""
+    if isinstance(data, dict):
+        return [item for items in data.values() for item in items]
+    return list(data)
+
+
+def attribute_month(index: PrefixIndex, output_dir: str):
+    """
+    Attribute every IP of one month to an ASN/organization and carry it to domains.
+
+    Reads <output_dir>/ip_list/all_ips.json and <output_dir>/domain_list/ip_domain_map.pkl,
+    writes ip_list/ip_asn_map.json ({ip: {asn, organization}}) and
+    domain_list/domain_org_map.json ({domain: {organization, asn, ips}}), where a
+    domain gets the organization announcing most of its IPs.
+
+    Args:
+        index (PrefixIndex): Prefix -> (asn, organization) index.
+        output_dir (str): Month output directory.
+    """
+    ip_file = os.path.join(output_dir, "ip_list", "all_ips.json")
+    map_file = os.path.join(output_dir, "domain_list", "ip_domain_map.pkl")
+    ips = []
+    if os.path.exists(ip_file):
+        with open(ip_file, 'r') as f:
+            ips = _device_lists(json.load(f))
+    ip_domain_map = {}
+    if os.path.exists(map_file):
+        with open(map_file, 'rb') as f:
+            for device_map in pickle.load(f).values():
+                ip_domain_map.update(device_map)
+
+    attributed = index.lookup_many(list(ips) + list(ip_domain_map.keys()))
+    ip_asn_map = {ip: {"asn": asn, "organization": org} for ip, (asn, org) in attributed.items()}
+
+    domain_orgs = {}
+    for ip, domain in ip_domain_map.items():
+        if ip in attributed and attributed[ip][1]:
+            domain_orgs.setdefault(domain, Counter())[attributed[ip]] += 1
+    domain_org_map = {}
+    for domain, counts in domain_orgs.items():
+        (asn, org), _ = counts.most_common(1)[0]
+        domain_org_map[domain] = {"organization": org, "asn": asn, "ips": sum(counts.values())}
+
+    os.makedirs(os.path.join(output_dir, "ip_list"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "domain_list"), exist_ok=True)
+    with open(os.path.join(output_dir, "ip_list", "ip_asn_map.json"), 'w') as f:
+        json.dump(ip_asn_map, f, indent=4)
+    with open(os.path.join(output_dir, "domain_list", "domain_org_map.json"), 'w') as f:
+        json.dump(domain_org_map, f, indent=4)
+    unique_ips = set(ips) | set(ip_domain_map)
+    logger.info(f"{output_dir}: {len(attributed)}/{len(unique_ips)} IPs attributed, "
+                f"{len(domain_org_map)}/{len(set(ip_domain_map.values()))} domains with an organization")
+
+
+def compute_attribution(month_dirs: list, asn_db: str = None, asn_dump: str = None):
+    """
+    Build the ASN index once and attribute every given month.
+
+    Args:
+        month_dirs (list): Month output directories.
+        asn_db (str): GeoLite2-ASN.mmdb path.
+        asn_dump (str): Prefix -> ASN/org dump path (used when asn_db is not given).
+    """
+    index = build_asn_index(asn_db, asn_dump)
+    for month_dir in month_dirs:
+        attribute_month(index, month_dir)
@@ -0,0 +1,257 @@
+import os
+import time
+import sqlite3
+import logging
+import calendar
+from collections import defaultdict
+from src.utils import parse_pcap_name, get_device_name, dataset_root_path
+
+logger = logging.getLogger(__name__)
+
+# Default location of the captures: <pcap_root>/<device>/ctrl2/*.pcap
+PCAP_ROOT = "/data/disk1/traffic/by-name"
+PCAP_SUBDIR = "ctrl2"
+# Appending to a capture does not change its directory's mtime: captures
+# modified this recently (and the newest of each directory) are re-stat'ed
+# even in unchanged directories
+RECENT_SECONDS = 6 * 3600
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pcaps (
+    path TEXT PRIMARY KEY,
+    device TEXT NOT NULL,
+    dataset_device TEXT NOT NULL,
+    ts INTEGER NOT NULL,
+    device_ip TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    mtime REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS pcaps_device_ts ON pcaps (device, ts);
+CREATE TABLE IF NOT EXISTS dirs (
+    path TEXT PRIMARY KEY,
+    mtime REAL NOT NULL
+);
+"""
+
+
+def open_catalog(db_path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the PCAP catalog database."""
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def month_range(month: str) -> tuple[int, int]:
+    """Return [start, end) epoch seconds for a YYYY-MM month."""
+    year, month_num = (int(x) for x in month.split("-"))
+    start = calendar.timegm((year, month_num, 1, 0, 0, 0))
+    if month_num == 12:
+        end = calendar.timegm((year + 1, 1, 1, 0, 0, 0))
+    else:
+        end = calendar.timegm((year, month_num + 1, 1, 0, 0, 0))
+    return start, end
+
+
+def _under(prefix: str) -> tuple[str, str]:
+    """SQL range (path >= ? AND path < ?) of the paths under a directory."""
+    return prefix, prefix + "\uffff"
+
+
+def _scan_dir(conn: sqlite3.Connection, device: str, pcap_dir: str, dir_mtimes: dict) -> tuple[int, list]:
+    """
+    Index the captures directly in one directory.
+
+    Returns:
+        tuple: Number of new or changed files, and the subdirectories found.
+    """
+    prefix = os.path.join(pcap_dir, "")
+    known = {path: (size, mtime) for path, size, mtime in
+             conn.execute("SELECT path, size, mtime FROM pcaps WHERE path >= ? AND path < ?", _under(prefix))
+             if os.path.dirname(path) == pcap_dir}
+    seen, rows, subdirs = set(), [], []
+    with os.scandir(pcap_dir) as entries:
+        for entry in entries:
+            if entry.is_dir():
+                subdirs.append(entry.path)
+                continue
+            parsed = parse_pcap_name(entry.name)
+            if parsed is None or not entry.is_file():
+                continue
+            st = entry.stat()
+            seen.add(entry.path)
+            if known.get(entry.path) == (st.st_size, st.st_mtime):
+                continue
+            ts, device_ip = parsed
+            try:
+                dataset_device = get_device_name(entry.path, dataset_root_path)
+            except ValueError:
+                dataset_device = device
+            rows.append((entry.path, device, dataset_device, ts, device_ip, st.st_size, st.st_mtime))
+    conn.executemany("INSERT OR REPLACE INTO pcaps VALUES (?, ?, ?, ?, ?, ?, ?)", rows)
+    gone = [(path,) for path in known if path not in seen]
+    conn.executemany("DELETE FROM pcaps WHERE path = ?", gone)
+    # Subdirectories removed since the last scan, with their captures
+    for old in [d for d in dir_mtimes if os.path.dirname(d) == pcap_dir and d not in subdirs]:
+        old_prefix = os.path.join(old, "")
+        conn.execute("DELETE FROM pcaps WHERE path >= ? AND path < ?", _under(old_prefix))
+        conn.execute("DELETE FROM dirs WHERE path = ? OR (path >= ? AND path < ?)", (old, *_under(old_prefix)))
+    return len(rows), subdirs
+
+
+def _restat_recent(conn: sqlite3.Connection, pcap_dir: str, since: float) -> int:
+    """Re-stat the newest capture directly in a directory and those modified since `since`; returns the number changed."""
+    prefix = os.path.join(pcap_dir, "")
+    rows = [row for row in conn.execute("SELECT path, ts, size, mtime FROM pcaps WHERE path >= ? AND path < ?",
+                                        _under(prefix))
+            if os.path.dirname(row[0]) == pcap_dir]
+    newest = max(rows, key=lambda row: row[1])[0] if rows else None
+    updates = []
+    for path, _, size, mtime in rows:
+        if mtime < since and path != newest:
+            continue
+        try:
+            st = os.stat(path)
+        except FileNotFoundError:
+            continue
+        if (st.st_size, st.st_mtime) != (size, mtime):
+            updates.append((st.st_size, st.st_mtime, path))
+    conn.executemany("UPDATE pcaps SET size = ?, mtime = ? WHERE path = ?", updates)
+    return len(updates)
+
+
+def _refresh_dir(conn: sqlite3.Connection, device: str, pcap_dir: str, dir_mtimes: dict, since: float) -> tuple[int, int]:
+    """Refresh a capture directory and its subdirectories; returns (new or changed files, unchanged dirs skipped)."""
+    mtime = os.stat(pcap_dir).st_mtime
+    if dir_mtimes.get(pcap_dir) == mtime:
+        changed, skipped = _restat_recent(conn, pcap_dir, since), 1
+        # Adding or removing a subdirectory changes the mtime: the known ones are all there is
+        subdirs = [d for d in dir_mtimes if os.path.dirname(d) == pcap_dir]
+    else:
+        (changed, subdirs), skipped = _scan_dir(conn, device, pcap_dir, dir_mtimes), 0
+        conn.execute("INSERT OR REPLACE INTO dirs VALUES (?, ?)", (pcap_dir, mtime))
+    for subdir in subdirs:
+        try:
+            sub_changed, sub_skipped = _refresh_dir(conn, device, subdir, dir_mtimes, since)
+        except FileNotFoundError:
+            continue
+        changed += sub_changed
+        skipped += sub_skipped
+    return changed, skipped
+
+
+def refresh_catalog(db_path: str, pcap_root: str = PCAP_ROOT, devices: list = None, subdir: str = PCAP_SUBDIR):
+    """
+    Scan <pcap_root>/<device>/<subdir> (and its subfolders) once and update the catalog incrementally.
+
+    A directory whose mtime has not changed since the last refresh is not
+    listed: only its newest capture and the captures modified in the last
+    RECENT_SECONDS are re-stat'ed, as they may still be growing, and its
+    known subfolders are visited. In changed directories only new or
+    modified files are (re)inserted and deleted files and folders are
+    dropped.
+
+    Args:
+        db_path (str): Catalog database path.
+        pcap_root (str): Directory holding one folder per device.
+        devices (list): Only refresh these devices (default: all).
+        subdir (str): Capture folder inside each device folder.
+    """
+    start = time.perf_counter()
+    pcap_root = os.path.abspath(pcap_root)
+    conn = open_catalog(db_path)
+    dir_mtimes = dict(conn.execute("SELECT path, mtime FROM dirs"))
+    if devices is None:
+        with os.scandir(pcap_root) as entries:
+            devices = sorted(entry.name for entry in entries if entry.is_dir())
+    changed_files, skipped_dirs = 0, 0
+    since = time.time() - RECENT_SECONDS
+    for device in devices:
+        pcap_dir = os.path.join(pcap_root, device, subdir)
+        try:
+            changed, skipped = _refresh_dir(conn, device, pcap_dir, dir_mtimes, since)
+        except FileNotFoundError:
+            logger.warning(f"[{device}] no capture directory {pcap_dir}")
+            continue
+        changed_files += changed
+        skipped_dirs += skipped
+        conn.commit()
+    total = conn.execute("SELECT COUNT(*) FROM pcaps").fetchone()[0]
+    conn.close()
+    logger.info(f"Catalog {db_path}: {changed_files} new/changed PCAPs, {skipped_dirs} unchanged dirs skipped, "
+                f"{total} PCAPs indexed ({time.perf_counter() - start:.2f}s)")
+
+
+def query_catalog(db_path: str, device: str = None, start: int = None, end: int = None) -> list[tuple]:
+    """
+    Query catalogued PCAPs by device and [start, end) time range.
+
+    Returns:
+        list: (path, device, dataset_device, ts, device_ip, size, mtime) rows ordered by device and timestamp.
+    """
+    sql, params = "SELECT path, device, dataset_device, ts, device_ip, size, mtime FROM pcaps WHERE 1", []
+    if device is not None:
+        sql += " AND device = ?"
+        params.append(device)
+    if start is not None:
+        sql += " AND ts >= ?"
+        params.append(start)
+    if end is not None:
+        sql += " AND ts < ?"
+        params.append(end)
+    conn = open_catalog(db_path)
+    rows = conn.execute(sql + " ORDER BY device, ts, path", params).fetchall()
+    conn.close()
+    return rows
+
+
+def catalog_pcaps(db_path: str, device: str = None, month: str = None) -> dict[str, list[str]]:
+    """
+    Catalog counterpart of read_pcap_list: PCAPs of a device-month grouped like an input list.
+
+    Args:
+        db_path (str): Catalog database path.
+        device (str): Device folder name.
+        month (str): YYYY-MM.
+
+    Returns:
+        dict: Device name (as get_device_name would give) -> PCAP paths in time order.
+    """
+    start, end = month_range(month) if month else (None, None)
+    device_pcap = defaultdict(list)
+    for path, _, dataset_device, *_ in query_catalog(db_path, device, start, end):
+        device_pcap[dataset_device].append(path)
+    return device_pcap
+
+
+def catalog_months(db_path: str, device: str, years: list = None) -> dict[str, list]:
+    """Return {YYYY-MM: rows} for one device, optionally restricted to some years."""
+    months = defaultdict(list)
+    for row in query_catalog(db_path, device):
+        month = time.strftime("%Y-%m", time.gmtime(row[3]))
+        if years is None or month[:4] in years:
+            months[month].append(row)
+    return months
+
+
+def write_month_lists(db_path: str, device: str, years: list, list_dir: str):
+    """
+    Write the input list of every month of `years` as <list_dir>/<YYYY-MM>.txt, in one catalog query.
+
+    Months without captures get an empty list, so callers can skip them
+    without querying the catalog again.
+
+    Args:
+        db_path (str): Catalog database path.
+        device (str): Device folder name.
+        years (list): Years (YYYY) to write.
+        list_dir (str): Directory of the per-month lists.
+    """
+    os.makedirs(list_dir, exist_ok=True)
+    months = catalog_months(db_path, device, years)
+    for year in years:
+        for month_num in range(1, 13):
+            month = f"{year}-{month_num:02d}"
+            with open(os.path.join(list_dir, f"{month}.txt"), "w") as f:
+                f.writelines(f"{row[0]}\n" for row in months.get(month, []))
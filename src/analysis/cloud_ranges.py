@@ -0,0 +1,217 @@
+import os
+import json
+import pickle
+import hashlib
+import logging
+import ipaddress
+from collections import Counter
+from src.analysis.prefix_index import PrefixIndex
+
+logger = logging.getLogger(__name__)
+
+# Compiled interval arrays are cached next to the range files
+COMPILED_FILE = "compiled_ranges.npz"
+
+
+def _json_prefixes(data):
+    """Collect every CIDR string from a provider JSON (AWS, GCP, Azure, Fastly, ...)."""
+    if isinstance(data, dict):
+        for value in data.values():
+            yield from _json_prefixes(value)
+    elif isinstance(data, list):
+        for value in data:
+            yield from _json_prefixes(value)
+    elif isinstance(data, str) and "/" in data:
+        try:
+            yield str(ipaddress.ip_network(data, strict=False))
+        except ValueError:
+            pass
+
+
+def load_range_file(path: str) -> list[str]:
+    """
+    Load the prefixes of one provider range file.
+
+    JSON files (AWS ip-ranges.json, GCP cloud.json, Azure ServiceTags, Fastly
+    public-ip-list) are searched for CIDR strings; other files (Cloudflare
+    ips-v4/ips-v6, Akamai lists) are read as one prefix per line.
+    """
+    with open(path, 'r') as f:
+        text = f.read()
+    if text.lstrip().startswith(("{", "[")):
+        return list(_json_prefixes(json.loads(text)))
+    prefixes = []
+    for line in text.splitlines():
+        line = line.split("#", 1)[0].strip()
+        if not line:
+            continue
+        try:
+            prefixes.append(str(ipaddress.ip_network(line, strict=False)))
+        except ValueError:
+            continue
+    return prefixes
+
+
+def range_files(ranges_dir: str) -> dict[str, list[str]]:
+    """
+    Map provider -> range files.
+
+    Layout: <ranges_dir>/<Provider>/<files> (e.g. AWS/ip-ranges.json,
+    Cloudflare/ips-v4), or <ranges_dir>/<Provider>.<ext> for a single file.
+    """
+    providers = {}
+    for entry in sorted(os.scandir(ranges_dir), key=lambda e: e.name):
+        if entry.name == COMPILED_FILE or entry.name.startswith("."):
+            continue
+        if entry.is_dir():
+            providers[entry.name] = sorted(os.path.join(entry.path, f) for f in os.listdir(entry.path)
+                                           if not f.startswith("."))
+        else:
+            providers[entry.name.split(".")[0]] = [entry.path]
+    return providers
+
+
+def _fingerprint(files: dict) -> str:
+    """Hash of the range files' providers, names, sizes and mtimes: changes whenever a file is added, removed or updated."""
+    stats = [f"{provider}/{os.path.basename(p)}:{os.path.getsize(p)}:{os.path.getmtime(p)}"
+             for provider, paths in sorted(files.items()) for p in paths]
+    return hashlib.blake2b("\n".join(stats).encode(), digest_size=8).hexdigest()
+
+
+class CloudRanges:
+    """
+    Provider IP ranges compiled into sorted integer interval arrays.
+
+    Each address family is a (starts, ends, codes) triple of numpy arrays of
+    disjoint ranges. IPv4 ranges use 32-bit keys. IPv6 ranges are keyed on
+    the upper 64 bits, so prefixes longer than /64 are widened to their /64.
+    classify() matches a whole batch of IPs with one searchsorted per family.
+    """
+
+    def __init__(self, providers: list, arrays: dict):
+        self.providers = providers
+        self.arrays = arrays
+
+    @classmethod
+    def from_dir(cls, ranges_dir: str) -> "CloudRanges":
+        """Compile the range files of a directory, reusing the cached arrays if they are current."""
+        import numpy as np
+        files = range_files(ranges_dir)
+        fingerprint = _fingerprint(files)
+        compiled = os.path.join(ranges_dir, COMPILED_FILE)
+        if os.path.exists(compiled):
+            data = np.load(compiled, allow_pickle=False)
+            if "fingerprint" in data.files and str(data["fingerprint"]) == fingerprint:
+                providers = [str(provider) for provider in data["providers"]]
+                arrays = {v: (data[f"starts{v}"], data[f"ends{v}"], data[f"codes{v}"]) for v in (4, 6)}
+                return cls(providers, arrays)
+
+        providers = sorted(files)
+        pairs = []
+        for code, provider in enumerate(providers):
+            count = 0
+            for path in files[provider]:
+                prefixes = load_range_file(path)
+                count += len(prefixes)
+                for prefix in prefixes:
+                    network = ipaddress.ip_network(prefix)
+                    if network.version == 6 and network.prefixlen > 64:
+                        network = network.supernet(new_prefix=64)
+                    pairs.append((network, code))
+            logger.info(f"{provider}: {count} prefixes")
+        index = PrefixIndex(pairs)
+        arrays = {}
+        for version, (starts, ends, codes) in index.ranges.items():
+            shift = 64 if version == 6 else 0
+            arrays[version] = (np.array([s >> shift for s in starts], dtype=np.uint64),
+                               np.array([e >> shift for e in ends], dtype=np.uint64),
+                               np.array(codes, dtype=np.int32))
+        np.savez(compiled, providers=np.array(providers), fingerprint=np.array(fingerprint),
+                 **{f"{name}{v}": arr for v, arrs in arrays.items() for name, arr in zip(("starts", "ends", "codes"), arrs)})
+        return cls(providers, arrays)
+
+    def classify(self, ips) -> dict:
+        """
+        Classify a batch of IPs in one vectorized pass per address family.
+
+        Returns:
+            dict: ip -> provider for every IP inside a provider range.
+        """
+        import numpy as np
+        keyed = {4: ([], []), 6: ([], [])}
+        for ip in set(ips):
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            keys, names = keyed[address.version]
+            keys.append(int(address) >> (64 if address.version == 6 else 0))
+            names.append(ip)
+        results = {}
+        for version, (keys, names) in keyed.items():
+            starts, ends, codes = self.arrays[version]
+            if not keys or not len(starts):
+                continue
+            keys = np.array(keys, dtype=np.uint64)
+            idx = np.searchsorted(starts, keys, side="right") - 1
+            valid = idx >= 0
+            hit = np.zeros(len(keys), dtype=bool)
+            hit[valid] = keys[valid] <= ends[idx[valid]]
+            for i in np.nonzero(hit)[0]:
+                results[names[i]] = self.providers[codes[idx[i]]]
+        return results
+
+
+def classify_month(ranges: CloudRanges, output_dir: str):
+    """
+    Classify every IP of one month by provider and pass the verdict to domains.
+
+    Reads <output_dir>/ip_list/all_ips.json and <output_dir>/domain_list/ip_domain_map.pkl,
+    writes ip_list/ip_provider_map.json ({ip: provider}) and
+    domain_list/domain_provider_map.json ({domain: provider of most of its IPs}; domains
+    with at most half of their IPs in any one provider's ranges are left out).
+
+    Args:
+        ranges (CloudRanges): Compiled provider ranges.
+        output_dir (str): Month output directory.
+    """
+    ip_file = os.path.join(output_dir, "ip_list", "all_ips.json")
+    map_file = os.path.join(output_dir, "domain_list", "ip_domain_map.pkl")
+    ips = set()
+    if os.path.exists(ip_file):
+        with open(ip_file, 'r') as f:
+            data = json.load(f)
+        for device_ips in (data.values() if isinstance(data, dict) else [data]):
+            ips.update(device_ips)
+    ip_domain_map = {}
+    if os.path.exists(map_file):
+        with open(map_file, 'rb') as f:
+            for device_map in pickle.load(f).values():
+                ip_domain_map.update(device_map)
+
+    ip_provider_map = ranges.classify(ips | set(ip_domain_map))
+    votes, domain_ips = {}, Counter(ip_domain_map.values())
+    for ip, domain in ip_domain_map.items():
+        if ip in ip_provider_map:
+            votes.setdefault(domain, Counter())[ip_provider_map[ip]] += 1
+    # A real majority of all the domain's IPs, not just of those inside some provider's ranges
+    domain_provider_map = {}
+    for domain, counts in votes.items():
+        provider, count = counts.most_common(1)[0]
+        if 2 * count > domain_ips[domain]:
+            domain_provider_map[domain] = provider
+
+    os.makedirs(os.path.join(output_dir, "ip_list"), exist_ok=True)
+    os.makedirs(os.path.join(output_dir, "domain_list"), exist_ok=True)
+    with open(os.path.join(output_dir, "ip_list", "ip_provider_map.json"), 'w') as f:
+        json.dump(ip_provider_map, f, indent=4)
+    with open(os.path.join(output_dir, "domain_list", "domain_provider_map.json"), 'w') as f:
+        json.dump(domain_provider_map, f, indent=4)
+    logger.info(f"{output_dir}: {len(ip_provider_map)} IPs and {len(domain_provider_map)} domains in provider ranges")
+
+
+def compute_provider_classification(month_dirs: list, ranges_dir: str):
+    """Compile the provider ranges once and classify every given month."""
+    ranges = CloudRanges.from_dir(ranges_dir)
+    for month_dir in month_dirs:
+        classify_month(ranges, month_dir)
@@ -1,4 +1,6 @@
-from src.utils import *
+import os
+import json
+import logging
 
 logger = logging.getLogger(__name__)
 
@@ -0,0 +1,258 @@
+import os
+import json
+import time
+import pickle
+import sqlite3
+import logging
+import ipaddress
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Files of a month output dir the index is built from
+SOURCES = [
+    os.path.join("domain_list", "contacted_domains.json"),
+    os.path.join("domain_list", "contacted_slds.json"),
+    os.path.join("domain_list", "ip_domain_map.pkl"),
+    os.path.join("domain_list", "ip_sld_map.pkl"),
+    os.path.join("ip_list", "all_ips.json"),
+]
+
+# kind is 'domain', 'sld' or 'ip'. rkey is the reversed name for domains and
+# SLDs (suffix queries become range scans) and a fixed-width hex address for
+# IPs (CIDR queries become range scans).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS postings (
+    kind TEXT NOT NULL,
+    key TEXT NOT NULL,
+    rkey TEXT NOT NULL,
+    device TEXT NOT NULL,
+    month TEXT NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (kind, key, device, month)
+);
+CREATE INDEX IF NOT EXISTS postings_rkey ON postings (kind, rkey);
+CREATE INDEX IF NOT EXISTS postings_month ON postings (device, month);
+CREATE TABLE IF NOT EXISTS months (
+    device TEXT NOT NULL,
+    month TEXT NOT NULL,
+    path TEXT NOT NULL,
+    mtime REAL NOT NULL,
+    PRIMARY KEY (device, month)
+);
+"""
+
+
+def open_index(db_path: str) -> sqlite3.Connection:
+    """Open (and create if needed) the destination index database."""
+    if os.path.dirname(db_path):
+        os.makedirs(os.path.dirname(db_path), exist_ok=True)
+    conn = sqlite3.connect(db_path)
+    conn.executescript(SCHEMA)
+    return conn
+
+
+def ip_key(ip: str):
+    """Fixed-width sortable key of an IP ('4:0a000001', '6:2001...'), or None if invalid."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    width = 8 if address.version == 4 else 32
+    return f"{address.version}:{int(address):0{width}x}"
+
+
+def month_of_dir(output_dir: str):
+    """(device, YYYY-MM) of analysis_longitudinal/<device>/<year>/<Mon_Year>, or None."""
+    parts = os.path.normpath(os.path.abspath(output_dir)).split(os.sep)
+    month_name, _, year = parts[-1].partition("_")
+    if month_name not in MONTHS or not year.isdigit():
+        return None
+    return parts[-3], f"{year}-{MONTHS.index(month_name) + 1:02d}"
+
+
+def _flatten(data) -> list:
+    """Flatten {device: [..]} (or a plain list) into one list."""
+    if isinstance(data, dict):
+        return [item for items in data.values() for item in items]
+    return list(data)
+
+
+def _month_postings(output_dir: str) -> list[tuple]:
+    """
+    (kind, key, rkey, count) postings of one month output dir.
+
+    A domain or SLD counts the IPs of the month that resolved to it, an IP counts 1.
+    """
+    paths = [os.path.join(output_dir, source) for source in SOURCES]
+    domains, slds, ips, ip_domain_map, ip_sld_map = [], [], [], {}, {}
+    if os.path.exists(paths[0]):
+        with open(paths[0], 'r') as f:
+            domains = _flatten(json.load(f))
+    if os.path.exists(paths[1]):
+        with open(paths[1], 'r') as f:
+            slds = _flatten(json.load(f))
+    for path, ip_map in ((paths[2], ip_domain_map), (paths[3], ip_sld_map)):
+        if os.path.exists(path):
+            with open(path, 'rb') as f:
+                for device_map in pickle.load(f).values():
+                    ip_map.update(device_map)
+    if os.path.exists(paths[4]):
+        with open(paths[4], 'r') as f:
+            ips = set(_flatten(json.load(f)))
+
+    domain_ips = Counter(ip_domain_map[ip] for ip in ips if ip in ip_domain_map)
+    sld_ips = Counter(ip_sld_map[ip] for ip in ips if ip in ip_sld_map)
+    postings = []
+    for domain in set(domains):
+        if domain:
+            postings.append(("domain", domain, domain[::-1], domain_ips.get(domain, 0)))
+    for sld in set(slds):
+        if sld:
+            postings.append(("sld", sld, sld[::-1], sld_ips.get(sld, 0)))
+    for ip in ips:
+        key = ip_key(ip)
+        if key:
+            postings.append(("ip", ip, key, 1))
+    return postings
+
+
+def _sources_mtime(output_dir: str) -> float:
+    mtimes = [os.path.getmtime(os.path.join(output_dir, source)) for source in SOURCES
+              if os.path.exists(os.path.join(output_dir, source))]
+    return max(mtimes, default=0.0)
+
+
+def index_month(db_path: str, output_dir: str, conn: sqlite3.Connection = None, force: bool = True) -> bool:
+    """
+    (Re)index one month output dir, replacing its previous postings.
+
+    Args:
+        db_path (str): Index database path.
+        output_dir (str): analysis_longitudinal/<device>/<year>/<Mon_Year>.
+        conn (sqlite3.Connection): Open index connection to reuse.
+        force (bool): Reindex even if the month's outputs have not changed since the last indexing.
+
+    Returns:
+        bool: Whether the month was (re)indexed.
+    """
+    parsed = month_of_dir(output_dir)
+    if parsed is None:
+        logger.warning(f"{output_dir}: not a <device>/<year>/<Mon_Year> output dir, not indexed")
+        return False
+    device, month = parsed
+    own_conn = conn is None
+    conn = conn or open_index(db_path)
+    mtime = _sources_mtime(output_dir)
+    known = conn.execute("SELECT mtime FROM months WHERE device = ? AND month = ?", (device, month)).fetchone()
+    if not force and known and known[0] == mtime:
+        if own_conn:
+            conn.close()
+        return False
+    postings = _month_postings(output_dir)
+    with conn:
+        conn.execute("DELETE FROM postings WHERE device = ? AND month = ?", (device, month))
+        conn.executemany("INSERT INTO postings VALUES (?, ?, ?, ?, ?, ?)",
+                         [(kind, key, rkey, device, month, count) for kind, key, rkey, count in postings])
+        conn.execute("INSERT OR REPLACE INTO months VALUES (?, ?, ?, ?)", (device, month, os.path.abspath(output_dir), mtime))
+    if own_conn:
+        conn.close()
+    logger.info(f"[{device} {month}] indexed {len(postings)} postings")
+    return True
+
+
+def update_index(db_path: str, base_dir: str, devices: list = None):
+    """
+    Index every month under base_dir/<device>/<year>/<Mon_Year> whose outputs changed.
+
+    Months are compared by the mtime of their output files, so only new or
+    reprocessed months are reindexed.
+
+    Args:
+        db_path (str): Index database path.
+        base_dir (str): Base directory for longitudinal analysis outputs.
+        devices (list): Only these devices (default: all).
+    """
+    start = time.perf_counter()
+    conn = open_index(db_path)
+    if devices is None:
+        devices = sorted(d for d in os.listdir(base_dir) if os.path.isdir(os.path.join(base_dir, d)))
+    updated = skipped = 0
+    for device in devices:
+        device_dir = os.path.join(base_dir, device)
+        if not os.path.isdir(device_dir):
+            continue
+        for year in sorted(os.listdir(device_dir)):
+            year_dir = os.path.join(device_dir, year)
+            if not year.isdigit() or not os.path.isdir(year_dir):
+                continue
+            for month_dir in sorted(os.listdir(year_dir)):
+                output_dir = os.path.join(year_dir, month_dir)
+                if month_of_dir(output_dir) is None:
+                    continue
+                if index_month(db_path, output_dir, conn, force=False):
+                    updated += 1
+                else:
+                    skipped += 1
+    conn.close()
+    logger.info(f"Index {db_path}: {updated} months (re)indexed, {skipped} unchanged ({time.perf_counter() - start:.2f}s)")
+
+
+def query_index(db_path: str, domain: str = None, suffix: str = None, sld: str = None, ip: str = None,
+                device: str = None, years: list = None) -> dict:
+    """
+    Look destinations up in the index.
+
+    Args:
+        db_path (str): Index database path.
+        domain (str): Exact domain.
+        suffix (str): Domain suffix, e.g. '*.tuyaus.com' or 'tuyaus.com' (the domain itself and its subdomains).
+        sld (str): Exact SLD.
+        ip (str): Exact IP, CIDR (e.g. '52.94.0.0/16') or textual prefix (e.g. '52.94.').
+        device (str): Only this device.
+        years (list): Only these years.
+
+    Returns:
+        dict: key -> {"devices": {device: [months]}, "months": n, "count": total count}.
+    """
+    if domain is not None:
+        where, params = "kind = 'domain' AND key = ?", [domain.lower().rstrip(".")]
+    elif suffix is not None:
+        suffix = suffix.lower().rstrip(".").removeprefix("*.")
+        rsuffix = ("." + suffix)[::-1]
+        where = "kind = 'domain' AND (key = ? OR (rkey >= ? AND rkey < ?))"
+        params = [suffix, rsuffix, rsuffix + "\uffff"]
+    elif sld is not None:
+        where, params = "kind = 'sld' AND key = ?", [sld.lower().rstrip(".")]
+    elif ip is not None and "/" in ip:
+        network = ipaddress.ip_network(ip, strict=False)
+        where = "kind = 'ip' AND rkey >= ? AND rkey <= ?"
+        params = [ip_key(str(network.network_address)), ip_key(str(network.broadcast_address))]
+    elif ip is not None and ip_key(ip):
+        where, params = "kind = 'ip' AND rkey = ?", [ip_key(ip)]
+    elif ip is not None:
+        # Textual prefix, e.g. '52.94.'
+        where, params = "kind = 'ip' AND key >= ? AND key < ?", [ip, ip + "\uffff"]
+    else:
+        raise ValueError("Give one of domain, suffix, sld or ip")
+    if device is not None:
+        where += " AND device = ?"
+        params.append(device)
+    if years:
+        where += f" AND substr(month, 1, 4) IN ({', '.join('?' for _ in years)})"
+        params.extend(str(year) for year in years)
+
+    conn = open_index(db_path)
+    rows = conn.execute(f"SELECT key, device, month, count FROM postings WHERE {where} ORDER BY key, device, month", params).fetchall()
+    conn.close()
+    results = defaultdict(lambda: {"devices": defaultdict(list), "months": 0, "count": 0})
+    for key, row_device, month, count in rows:
+        result = results[key]
+        result["devices"][row_device].append(month)
+        result["months"] += 1
+        result["count"] += count
+    return {key: {"devices": dict(result["devices"]), "months": result["months"], "count": result["count"]}
+            for key, result in results.items()}
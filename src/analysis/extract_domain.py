@@ -1,71 +1,97 @@
-from multiprocessing import Pool
+import os
+import json
+import pickle
+import logging
+import concurrent.futures
 from src.parsers.dns_tls_extractor import extract_domains, extract_sld
-from src.utils import *
+from src.utils import read_pcap_list
+from src.profiling import profile_stage, profiled
 
 logger = logging.getLogger(__name__)
 logging.getLogger("tldextract").setLevel(logging.CRITICAL)
 logging.getLogger("filelock").setLevel(logging.WARNING)
 
-def process_pcap(device:str, pcap_files:list)->set[str]:
-    """Process a single PCAP file to extract domains."""
-    unique_slds, domain_list, ip_sld_map, ip_domain_map = set(), set(), {}, {}
+def merge_domain_results(results, merged=None)->tuple[set[str], set[str], dict[str, str], dict[str, str], dict[str, dict]]:
+    """
+    Merge per-PCAP extraction results, in capture order, into one device result.
+
+    Args:
+        results (iterable): (domain_list, ip_domain_map, cert_info) as returned by extract_domains.
+        merged (tuple): A previous merge result to continue from (updated in place), so
+            later PCAPs can be added incrementally with the same outcome as one merge.
+
+    Returns:
+        tuple: unique SLDs, domains, IP->SLD map, IP->domain map and certificate
+            info (later PCAPs win).
+    """
+    unique_slds, domain_list, ip_sld_map, ip_domain_map, cert_info = merged or (set(), set(), {}, {}, {"domains": {}, "ips": {}})
     domain_sld_map = {}
-    logger.info(f"Processing device: {device} with {len(pcap_files)} PCAP files.")
-    for pcap_file in pcap_files:
-        domain_list_cur, ip_domain_map_cur = extract_domains(pcap_file)
+    for domain_list_cur, ip_domain_map_cur, cert_info_cur in results:
         for domain in domain_list_cur:
             tmp_sld = extract_sld(domain)
             unique_slds.add(tmp_sld)
             domain_sld_map[domain] = tmp_sld
         domain_list.update(domain_list_cur)
         for ip, domain in ip_domain_map_cur.items():
+            if domain not in domain_sld_map and domain in domain_list:
+                # Seen in an earlier merge
+                domain_sld_map[domain] = extract_sld(domain)
             ip_domain_map[ip] = domain
             ip_sld_map[ip] = domain_sld_map.get(domain, None)
-    return unique_slds, domain_list, ip_sld_map, ip_domain_map
+        cert_info["domains"].update(cert_info_cur["domains"])
+        cert_info["ips"].update(cert_info_cur["ips"])
+    return unique_slds, domain_list, ip_sld_map, ip_domain_map, cert_info
+
+def process_pcap(device:str, pcap_files:list)->set[str]:
+    """Process a single PCAP file to extract domains."""
+    logger.info(f"Processing device: {device} with {len(pcap_files)} PCAP files.")
+    return merge_domain_results(extract_domains(pcap_file) for pcap_file in pcap_files)
 
 
-def compute_unique_domains(input_file, output_dir):
+def compute_unique_domains(input_file, output_dir, device_pcap=None):
     """Compute unique domains for all PCAPs in a directory using multiprocessing."""
-    dict_dec = defaultdict(list)
-    with open(input_file, 'r') as f:
-        f = f.readlines()
-        for line in f:
-            line = line.strip()
-            if line.startswith("#") or not line.endswith(".pcap"):
-                continue
-            if not os.access(line, os.R_OK):
-                logger.error(f"{line}: No read permission")
-                continue
-            
-            # Extract the device name from the pcap file name
-            device_name = get_device_name(line, dataset_root_path)
-            dict_dec[device_name].append(line)
-            
-    all_slds, ip_sld_map_all, all_domains, ip_domain_map_all = {}, {}, {}, {}
+    dict_dec = device_pcap if device_pcap is not None else read_pcap_list(input_file)
     
     # print(dict_dec)
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        future_to_dev = {executor.submit(process_pcap, device_name, dict_dec[device_name]): device_name for device_name in dict_dec.keys()}
-        for future in concurrent.futures.as_completed(future_to_dev):
-            device_name = future_to_dev[future]
-            result = future.result()
+    results = {}
+    with profile_stage("extraction"):
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            future_to_dev = {executor.submit(profiled(process_pcap), device_name, dict_dec[device_name]): device_name for device_name in dict_dec.keys()}
+            for future in concurrent.futures.as_completed(future_to_dev):
+                results[future_to_dev[future]] = future.result()
+    save_domain_results(results, output_dir)
+
+def save_domain_results(results:dict, output_dir:str):
+    """
+    Save per-device domain results to <output_dir>/domain_list.
+
+    Args:
+        results (dict): Device name -> result of process_pcap / merge_domain_results.
+        output_dir (str): Month output directory.
+    """
+    all_slds, ip_sld_map_all, all_domains, ip_domain_map_all, cert_info_all = {}, {}, {}, {}, {}
+    with profile_stage("merge"):
+        for device_name, result in results.items():
             if result == None:
                 continue
             try:
-                unique_slds, domain_list, sld_ip_map, domain_ip_map = result
+                unique_slds, domain_list, sld_ip_map, domain_ip_map, cert_info = result
                 all_slds[device_name] = list(unique_slds)
                 ip_sld_map_all[device_name] = sld_ip_map
                 all_domains[device_name] = list(domain_list)
                 ip_domain_map_all[device_name] = domain_ip_map
+                cert_info_all[device_name] = cert_info
             except Exception as e:
                 logger.error(f"Error processing device {device_name}: {e}")
     logger.info("IP-Domain Mapping Extracted... Saving results")
     # Save the results
-    domain_output_dir = os.path.join(output_dir, 'domain_list')
-    save_domains(all_slds, domain_output_dir, "unique_slds")
-    save_domains(all_domains, domain_output_dir, "unique_domains")
-    save_domains(ip_sld_map_all, domain_output_dir, "ip_sld_map", pickle_flag=True)
-    save_domains(ip_domain_map_all, domain_output_dir, "ip_domain_map", pickle_flag=True)
+    with profile_stage("save"):
+        domain_output_dir = os.path.join(output_dir, 'domain_list')
+        save_domains(all_slds, domain_output_dir, "unique_slds")
+        save_domains(all_domains, domain_output_dir, "unique_domains")
+        save_domains(ip_sld_map_all, domain_output_dir, "ip_sld_map", pickle_flag=True)
+        save_domains(ip_domain_map_all, domain_output_dir, "ip_domain_map", pickle_flag=True)
+        save_domains(cert_info_all, domain_output_dir, "cert_info", pickle_flag=True)
     logger.info("Unique domains computed and saved.")
 
 def save_domains(results:dict, output_dir:str, file_name:str, pickle_flag=False):
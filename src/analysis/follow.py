@@ -0,0 +1,209 @@
+import os
+import time
+import pickle
+import logging
+import concurrent.futures
+from src.analysis.catalog import PCAP_ROOT, PCAP_SUBDIR
+from src.analysis.extract_domain import merge_domain_results, save_domain_results
+from src.analysis.ip_to_domain import save_ip_results
+from src.analysis.scheduler import extract_pcap, month_output_dir
+from src.analysis.destination_index import index_month
+from src.utils import parse_pcap_name, get_device_name, dataset_root_path
+from src.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+# Per-month follow state, kept next to the month's outputs
+STATE_FILE = "follow_state.pkl"
+# Polls a failing capture is retried on before it is skipped, as a batch run skips it
+MAX_ATTEMPTS = 3
+
+
+def _empty_state() -> dict:
+    return {"pcaps": {}, "domains": {}, "ips": {}}
+
+
+def load_state(output_dir: str) -> dict:
+    """
+    Load the follow state of one month.
+
+    Returns:
+        dict: {"pcaps": {path: (size, mtime)}, "domains": {device: merge result},
+               "ips": {device: set of IPs}}
+    """
+    state_file = os.path.join(output_dir, STATE_FILE)
+    if os.path.exists(state_file):
+        with open(state_file, 'rb') as f:
+            return pickle.load(f)
+    return _empty_state()
+
+
+def save_state(output_dir: str, state: dict):
+    """Write the follow state atomically, so an interrupted write never loses processed PCAPs."""
+    os.makedirs(output_dir, exist_ok=True)
+    state_file = os.path.join(output_dir, STATE_FILE)
+    with open(state_file + ".tmp", 'wb') as f:
+        pickle.dump(state, f)
+    os.replace(state_file + ".tmp", state_file)
+
+
+def completed_pcaps(pcap_dir: str, seen: dict, settle: float) -> list[tuple]:
+    """
+    List the captures of a directory that are finished being written.
+
+    A capture is complete once a capture with a later timestamp exists (the
+    box has rotated to the next file), or when its size and mtime have not
+    changed since the previous poll and it is at least `settle` seconds old.
+
+    Args:
+        pcap_dir (str): Capture directory.
+        seen (dict): path -> (size, mtime) from the previous poll; updated in place.
+        settle (float): Seconds without modification before the newest capture counts as complete
+            (0: every capture is complete).
+
+    Returns:
+        list: (ts, path, size, mtime) of complete captures, oldest first.
+    """
+    captures = []
+    with os.scandir(pcap_dir) as entries:
+        for entry in entries:
+            parsed = parse_pcap_name(entry.name)
+            if parsed is None or not entry.is_file():
+                continue
+            st = entry.stat()
+            captures.append((parsed[0], entry.path, st.st_size, st.st_mtime))
+    captures.sort()
+    now = time.time()
+    complete = []
+    for i, (ts, path, size, mtime) in enumerate(captures):
+        stable = (settle == 0 or seen.get(path) == (size, mtime)) and now - mtime >= settle
+        if i < len(captures) - 1 or stable:
+            complete.append((ts, path, size, mtime))
+        seen[path] = (size, mtime)
+    return complete
+
+
+def update_month(output_dir: str, state: dict, device: str, results: list):
+    """
+    Add the results of new captures to a month and rewrite its outputs.
+
+    Args:
+        output_dir (str): Month output directory.
+        state (dict): Month follow state (updated in place).
+        device (str): Device key used in the outputs.
+        results (list): ((extract_domains result, extract_ips result), path, size, mtime) in capture order;
+            the result is None for a capture that was given up on (recorded, not merged).
+    """
+    merged = state["domains"].get(device)
+    state["domains"][device] = merge_domain_results((result[0] for result, *_ in results if result is not None), merged)
+    ips = state["ips"].setdefault(device, set())
+    for result, path, size, mtime in results:
+        if result is not None:
+            ips.update(result[1])
+        state["pcaps"][path] = (size, mtime)
+    save_domain_results(state["domains"], output_dir)
+    save_ip_results(state["ips"], output_dir)
+    save_state(output_dir, state)
+
+
+def follow_device(device: str, base_dir: str, pcap_root: str = PCAP_ROOT, subdir: str = PCAP_SUBDIR,
+                  interval: float = 60, settle: float = 120, workers: int = None, once: bool = False,
+                  index_db: str = None):
+    """
+    Watch a device's capture directory and keep its monthly outputs up to date.
+
+    Every poll, captures that are complete and not yet processed are
+    extracted (once), then the unique_domains, ip_domain_map, all_ips and
+    contacted_domains outputs of their month are updated incrementally.
+    Captures are merged in timestamp order, so the outputs match a batch run
+    over the same captures: a capture that fails holds back the later ones
+    of its month until it succeeds or has failed MAX_ATTEMPTS polls (then
+    it is skipped, as a batch run skips it), and a capture that appears
+    after later ones were merged makes its month be rebuilt. Processed
+    captures are recorded per month in follow_state.pkl, so following can be
+    stopped and resumed; only the paths of past months stay in memory, and
+    the full state of the latest month.
+
+    Args:
+        device (str): Device folder name under pcap_root.
+        base_dir (str): Base directory for longitudinal analysis outputs.
+        pcap_root (str): Directory holding one folder per device.
+        subdir (str): Capture folder inside the device folder.
+        interval (float): Seconds between polls.
+        settle (float): Seconds without modification before the newest capture is processed.
+        workers (int): Extraction threads when several captures are pending.
+        once (bool): Process what is complete now and return instead of polling.
+        index_db (str): Destination index to update whenever a month's outputs change.
+    """
+    pcap_dir = os.path.join(os.path.abspath(pcap_root), device, subdir)
+    # month -> {processed path: capture ts}; full states only for months being updated
+    processed, states, seen, failures = {}, {}, {}, {}
+    attempts = 1 if once else MAX_ATTEMPTS
+    task = profiled(extract_pcap, "extraction")
+    logger.info(f"[{device}] following {pcap_dir} every {interval}s")
+    while True:
+        captures = {}
+        for ts, path, size, mtime in completed_pcaps(pcap_dir, seen, 0 if once else settle):
+            captures.setdefault(time.strftime("%Y-%m", time.gmtime(ts)), []).append((ts, path, size, mtime))
+        pending, held = [], set()
+        for month, month_captures in captures.items():
+            year, month_num = month.split("-")
+            output_dir = month_output_dir(base_dir, device, year, month_num)
+            state = None
+            if month not in processed:
+                state = load_state(output_dir)
+                processed[month] = {path: parse_pcap_name(os.path.basename(path))[0] for path in state["pcaps"]}
+            done = processed[month]
+            new = [capture for capture in month_captures if capture[1] not in done]
+            if not new:
+                continue
+            if done and new[0][0] < max(done.values()):
+                logger.warning(f"[{device} {month}] {os.path.basename(new[0][1])} appeared after later captures "
+                               f"were merged: rebuilding the month")
+                done.clear()
+                states[month] = (output_dir, _empty_state())
+                new = month_captures
+            elif month not in states:
+                states[month] = (output_dir, state if state is not None else load_state(output_dir))
+            pending.extend((month, path, size, mtime) for _, path, size, mtime in new)
+
+        if pending:
+            logger.info(f"[{device}] {len(pending)} new PCAPs")
+            with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = [executor.submit(task, path) for _, path, _, _ in pending]
+            by_month = {}
+            for (month, path, size, mtime), future in zip(pending, futures):
+                if month in held:
+                    continue
+                try:
+                    result = future.result()
+                except Exception as e:
+                    failures[path] = failures.get(path, 0) + 1
+                    if failures[path] < attempts:
+                        # Not recorded: it and the later captures of its month are retried on the next poll
+                        logger.error(f"Error processing {path}: {e}; retrying, later captures of {month} wait")
+                        held.add(month)
+                        continue
+                    logger.error(f"Error processing {path}: {e}; skipped after {failures[path]} attempts")
+                    result = None
+                by_month.setdefault(month, []).append((result, path, size, mtime))
+            for month, results in by_month.items():
+                output_dir, state = states[month]
+                try:
+                    dataset_device = get_device_name(results[0][1], dataset_root_path)
+                except ValueError:
+                    dataset_device = device
+                update_month(output_dir, state, dataset_device, results)
+                if index_db:
+                    index_month(index_db, output_dir)
+                for _, path, _, _ in results:
+                    processed[month][path] = parse_pcap_name(os.path.basename(path))[0]
+                logger.info(f"[{device} {month}] {len(state['pcaps'])} PCAPs processed, outputs updated in {output_dir}")
+        # Keep only the current month's state in memory, and that of months waiting on a retry
+        if states:
+            latest = max(states)
+            states = {month: states[month] for month in states if month == latest or month in held}
+
+        if once:
+            return
+        time.sleep(interval)
@@ -1,5 +1,18 @@
-from src.utils import *
+import os
+import csv
+import json
+import pickle
+import logging
+import concurrent.futures
+from operator import is_not, not_
+from itertools import compress, repeat
+from collections import defaultdict
+from src.utils import read_pcap_list
 from src.parsers.ip_extractor import process_pcap_ips
+from src.parsers.dns_tls_extractor import extract_sld
+from src.analysis.destination_index import month_of_dir
+from src.analysis.passive_dns import month_range
+from src.profiling import profile_stage, profiled
 logger = logging.getLogger(__name__)
 
 def detect_iot_platforms(contacted_domains, ip_to_domain_map):
@@ -10,48 +23,81 @@ def detect_iot_platforms(contacted_domains, ip_to_domain_map):
     return {}
 
 
-def translate_ip_to_domain(device_name: str, ips: set, ip_to_domain_map: dict) -> dict:
+# Marks a lookup miss (None is a valid mapping value)
+_MISSING = object()
+
+
+def translate_ips(device_name: str, ips: list, ip_domain_map: dict, ip_sld_map: dict, fallback=None) -> tuple[set, set, tuple]:
     """
-    Translate IPs into domains using the IP-to-domain mappings.
+    Translate IPs into domains and SLDs in one join against the device's mappings.
+
+    The join is one C-level pass (map/compress) over the IPs: it resolves
+    their domains and splits them into hits, whose SLDs are then looked up
+    the same way, and misses. Misses are visited one by one only when the
+    fallback may still translate them.
 
     Args:
         device_name (str): The name of the device.
-        ips (set): Set of IPs to translate.
-        ip_to_domain_map (dict): Preloaded IP-to-domain mappings.
+        ips (list): IPs to translate.
+        ip_domain_map (dict): The device's IP-to-domain mappings.
+        ip_sld_map (dict): The device's IP-to-SLD mappings.
+        fallback (callable): ip -> domain or None, for IPs the mappings miss (e.g. a passive DNS lookup).
 
     Returns:
-        dict: Translated IP-to-domain mapping for the device.
-        float: Percentage of untranslated IPs.
+        set: Contacted domains.
+        set: Contacted SLDs.
+        tuple: Percentage of untranslated IPs, untranslated IPs, total IPs, and IPs translated by the fallback.
     """
-    translated_map = {}
-    untranslated_ips = 0
-
-    for ip in ips:
-        if ip in ip_to_domain_map:
-            translated_map[ip] = ip_to_domain_map[ip]
-        else:
-            untranslated_ips += 1
+    domains = list(map(ip_domain_map.get, ips, repeat(_MISSING)))
+    translated = list(map(is_not, domains, repeat(_MISSING)))
+    missed = list(compress(ips, map(not_, translated)))
+    contacted_domains = set(domains)
+    contacted_slds = set(map(ip_sld_map.get, compress(ips, translated), repeat(_MISSING)))
+
+    fallback_ips = 0
+    if fallback:
+        for ip in missed:
+            domain = fallback(ip)
+            if domain:
+                contacted_domains.add(domain)
+                fallback_ips += 1
+            # IPs translated by the fallback take the SLD of their domain
+            sld = ip_sld_map.get(ip, _MISSING)
+            if sld is _MISSING and domain:
+                sld = extract_sld(domain)
+            contacted_slds.add(sld)
+    else:
+        contacted_slds.update(map(ip_sld_map.get, missed, repeat(_MISSING)))
+    contacted_domains.discard(_MISSING)
+    contacted_slds.discard(_MISSING)
 
+    untranslated_ips = len(missed) - fallback_ips
     percentage_untranslated = (untranslated_ips / len(ips)) * 100 if ips else 0
     # logger.info(f"Device {device_name}: {percentage_untranslated:.2f}% IPs could not be translated.")
-    return translated_map, (percentage_untranslated, untranslated_ips, len(ips))
-
-def compute_ip_to_domain(input_data:str, output_dir: str): #  sld:bool=False, ip_files:bool=False
+    return contacted_domains, contacted_slds, (percentage_untranslated, untranslated_ips, len(ips), fallback_ips)
+
+def passive_dns_fallback(passive_dns, output_dir: str, month: str = None):
+    """ip -> domain lookup in a PassiveDns index, preferring mappings seen during `month` (default: the output dir's month)."""
+    if passive_dns is None:
+        return None
+    if month is None:
+        parsed = month_of_dir(output_dir)
+        month = parsed[1] if parsed else None
+    start, end = month_range(month) if month else (None, None)
+    return lambda ip: passive_dns.lookup(ip, start, end)
+
+def compute_ip_to_domain(input_data:str, output_dir: str, device_pcap: dict = None, passive_dns=None): #  sld:bool=False, ip_files:bool=False
     """
     Extract IPs from PCAP files
 
     Args:
         input_data (str): Either a file path with PCAP file paths
         output_dir (str): Directory to save the ip list results.
+        device_pcap (dict): Device -> PCAP paths (e.g. from the catalog); overrides input_data.
+        passive_dns (PassiveDns): Index to translate the IPs the month's own DNS/TLS data misses.
     """
    
 
-    device_ips = defaultdict(list)
-    device_pcap = defaultdict(list)
-    ip_output_dir = os.path.join(output_dir, "ip_list")
-    # os.makedirs(output_dir, exist_ok=True)
-    os.makedirs(ip_output_dir, exist_ok=True)
-    
     """
     # Parse input data
     if ip_files:   
@@ -68,76 +114,90 @@ def compute_ip_to_domain(input_data:str, output_dir: str): #  sld:bool=False, ip
     else:
     """
     # if input data is a file with path to pcap files, extract IPs from them and convert to domains
-    with open(input_data, 'r') as f:
-        for line in f:
-            line = line.strip()
-            if line.startswith("#") or not line.endswith(".pcap"):
-                continue
-            if not os.access(line, os.R_OK):
-                logger.error(f"{line}: No read permission")
-                continue
-
-            device_name = get_device_name(line, dataset_root_path)
-            device_pcap[device_name].append(line)
+    if device_pcap is None:
+        device_pcap = read_pcap_list(input_data)
     
     # Extract IPs from PCAP files
-    with concurrent.futures.ThreadPoolExecutor() as executor:
-        futures = {executor.submit(process_pcap_ips, device_name, files): device_name for device_name, files in device_pcap.items()}
-        for future in concurrent.futures.as_completed(futures):
-            device_name = futures[future]
-            try:
-                ips = future.result()
-                device_ips[device_name] = list(ips)
-            except Exception as e:
-                logger.error(f"Error processing device {device_name}: {e}")
+    results = {}
+    with profile_stage("extraction"):
+        with concurrent.futures.ThreadPoolExecutor() as executor:
+            futures = {executor.submit(profiled(process_pcap_ips), device_name, files): device_name for device_name, files in device_pcap.items()}
+            for future in concurrent.futures.as_completed(futures):
+                device_name = futures[future]
+                try:
+                    results[device_name] = future.result()
+                except Exception as e:
+                    logger.error(f"Error processing device {device_name}: {e}")
+    save_ip_results(results, output_dir, passive_dns)
+
+def save_ip_results(results: dict, output_dir: str, passive_dns=None, month: str = None):
+    """
+    Save per-device IP sets and translate them to contacted domains.
+
+    Needs <output_dir>/domain_list/ip_domain_map.pkl and ip_sld_map.pkl from the domains step.
+
+    Args:
+        results (dict): Device name -> set of IPs, as returned by process_pcap_ips.
+        output_dir (str): Month output directory.
+        passive_dns (PassiveDns): Index to translate the IPs the month's own mappings miss.
+        month (str): YYYY-MM of the results, when output_dir is not a <Mon_Year> dir (e.g. a sample/ subfolder).
+    """
+    device_ips = defaultdict(list)
+    ip_output_dir = os.path.join(output_dir, "ip_list")
+    # os.makedirs(output_dir, exist_ok=True)
+    os.makedirs(ip_output_dir, exist_ok=True)
+
+    with profile_stage("merge"):
+        for device_name, ips in results.items():
+            device_ips[device_name] = list(ips)
     # IoT Platform Detection - NEW
     logger.info("Skipping IoT platform detection (temporarily disabled due to bug)")
     platform_results = {}
 
-    platform_output_dir = os.path.join(output_dir, "platform_analysis")
-    os.makedirs(platform_output_dir, exist_ok=True)
-    
-    with open(os.path.join(platform_output_dir, "platforms_detected.json"), 'w') as f:
-        json.dump(platform_results, f, indent=4)
-    logger.info(f"IoT platform detection completed. Results saved.")
-    # Save intermediate IP results
-    ip_file_path = os.path.join(ip_output_dir, "all_ips.json")
-    with open(ip_file_path, 'w') as f:
-        json.dump(device_ips, f, indent=4)
-    logger.info(f"Extracted IPs from PCAP files and saved to {ip_file_path}")
+    with profile_stage("save"):
+        platform_output_dir = os.path.join(output_dir, "platform_analysis")
+        os.makedirs(platform_output_dir, exist_ok=True)
+        
+        with open(os.path.join(platform_output_dir, "platforms_detected.json"), 'w') as f:
+            json.dump(platform_results, f, indent=4)
+        logger.info(f"IoT platform detection completed. Results saved.")
+        # Save intermediate IP results
+        ip_file_path = os.path.join(ip_output_dir, "all_ips.json")
+        with open(ip_file_path, 'w') as f:
+            json.dump(device_ips, f, indent=4)
+        logger.info(f"Extracted IPs from PCAP files and saved to {ip_file_path}")
     
     
     # all_translation_results = {}
     contacted_domains = {}
+    contacted_domains_sld = {}
     all_untranslated_stats = {}
 
-     # # Load IP-to-domain mappings
-    ip_to_domain_dir = os.path.join(output_dir, 'domain_list')
-    ip_to_domain_file = os.path.join(ip_to_domain_dir, "ip_domain_map.pkl")
-    with open(ip_to_domain_file, 'rb') as f:
-        ip_to_domain_map = pickle.load(f)
-        
-    # translate IPs to domains
-    for device_name, ips in device_ips.items():
-        translated_map, untranslated = translate_ip_to_domain(device_name, ips, ip_to_domain_map[device_name])
-        # all_translation_results[device_name] = translated_map
-        contacted_domains[device_name] = list(set(translated_map.values()))
-        all_untranslated_stats[device_name] = list(untranslated)
+    with profile_stage("translation"):
+        # # Load IP-to-domain mappings
+        ip_to_domain_dir = os.path.join(output_dir, 'domain_list')
+        ip_to_domain_file = os.path.join(ip_to_domain_dir, "ip_domain_map.pkl")
+        with open(ip_to_domain_file, 'rb') as f:
+            ip_to_domain_map = pickle.load(f)
+        ip_to_domain_file_sld = os.path.join(ip_to_domain_dir, "ip_sld_map.pkl")
+        with open(ip_to_domain_file_sld, 'rb') as f:
+            ip_to_domain_map_sld = pickle.load(f)
+
+        # translate IPs to domains and slds
+        fallback = passive_dns_fallback(passive_dns, output_dir, month)
+        for device_name, ips in device_ips.items():
+            domains, slds, untranslated = translate_ips(device_name, ips, ip_to_domain_map[device_name],
+                                                        ip_to_domain_map_sld[device_name], fallback)
+            contacted_domains[device_name] = list(domains)
+            contacted_domains_sld[device_name] = list(slds)
+            all_untranslated_stats[device_name] = list(untranslated)
     
     # Save results
-    domain_output_dir = os.path.join(output_dir, "domain_list")
-    save_contacted_domain(contacted_domains, domain_output_dir, False)
-    save_untranslated_stats(all_untranslated_stats, ip_output_dir)
-    
-    # slds:
-    ip_to_domain_file_sld = os.path.join(ip_to_domain_dir, "ip_sld_map.pkl")
-    with open(ip_to_domain_file_sld, 'rb') as f:
-        ip_to_domain_map_sld = pickle.load(f)
-    contacted_domains_sld = {}
-    for device_name, ips in device_ips.items():
-        translated_map, untranslated = translate_ip_to_domain(device_name, ips, ip_to_domain_map_sld[device_name])
-        contacted_domains_sld[device_name] = list(set(translated_map.values()))
-    save_contacted_domain(contacted_domains_sld, domain_output_dir, True)
+    with profile_stage("save"):
+        domain_output_dir = os.path.join(output_dir, "domain_list")
+        save_contacted_domain(contacted_domains, domain_output_dir, False)
+        save_untranslated_stats(all_untranslated_stats, ip_output_dir)
+        save_contacted_domain(contacted_domains_sld, domain_output_dir, True)
     
     logger.info("IP-to-domain translation completed and saved.")
     
@@ -170,13 +230,15 @@ def save_untranslated_stats(results: dict[list], output_dir: str):
     # save as csv file
     with open(os.path.join(output_dir, "_untranslated_ip_stats.csv"), 'w') as f:
         writer = csv.writer(f)
-        writer.writerow(["Device", "Percentage Untranslated", "Untranslated IPs", "Total IPs"])
+        writer.writerow(["Device", "Percentage Untranslated", "Untranslated IPs", "Total IPs", "Passive DNS IPs"])
         total_ip = 0
         total_untranslated = 0
+        total_passive = 0
         for device, stats in results.items():
             writer.writerow([device] + stats)
             total_untranslated += stats[1]
             total_ip += stats[2]
-        writer.writerow(["Total", (total_untranslated / total_ip) * 100, total_untranslated, total_ip])
+            total_passive += stats[3]
+        writer.writerow(["Total", (total_untranslated / total_ip) * 100, total_untranslated, total_ip, total_passive])
         
     # logger.info(f"Untranslated IP statistics saved to {output_dir}")
@@ -0,0 +1,170 @@
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import logging
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_MEMO = os.path.join("cache", "party_memo.sqlite")
+# WHOIS answers change rarely and cost a subprocess (up to 10s) each
+DEFAULT_WHOIS_TTL = 180 * 86400
+# Bump when the order or kind of organization sources in categorize_domains
+# changes: every memoized classification is dropped
+ORG_SOURCE_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS rules (
+    device TEXT PRIMARY KEY,
+    fingerprint TEXT NOT NULL,
+    first_party TEXT NOT NULL,
+    support_party TEXT NOT NULL,
+    org_source INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS classified (
+    device TEXT NOT NULL,
+    domain TEXT NOT NULL,
+    rules TEXT NOT NULL,
+    evidence TEXT NOT NULL,
+    sld TEXT,
+    tld TEXT,
+    category TEXT NOT NULL,
+    organization TEXT NOT NULL,
+    whois_fetched REAL,
+    PRIMARY KEY (device, domain)
+);
+CREATE TABLE IF NOT EXISTS whois (
+    domain TEXT PRIMARY KEY,
+    organization TEXT NOT NULL,
+    fetched REAL NOT NULL
+);
+"""
+
+
+def rules_fingerprint(first_party_suffixes: list, support_party_list: list) -> str:
+    """Fingerprint of the classification rules: first-party suffixes, support-party keywords, organization sources."""
+    rules = [sorted(set(first_party_suffixes)), sorted(set(support_party_list)), ORG_SOURCE_VERSION]
+    return hashlib.blake2b(json.dumps(rules).encode(), digest_size=8).hexdigest()
+
+
+class ClassificationMemo:
+    """
+    Persistent per-device memo of categorize_domains results.
+
+    A domain's classification is reused when the month gives it the same
+    evidence (first-party listing, organization found before WHOIS,
+    cloud/CDN provider) under the same rules. When the rules of a device
+    change, only the memoized domains they can affect are dropped: those
+    ending with an added or removed first-party suffix, and those whose
+    organization contains an added or removed support-party keyword. WHOIS
+    answers are cached separately, by domain, for every device, and a
+    classification that used one expires with it. A failed WHOIS lookup is
+    not cached, and the classification it left "Unknown" is not memoized.
+    """
+
+    def __init__(self, device: str, first_party_suffixes: list, support_party_list: list,
+                 path: str = DEFAULT_MEMO, whois_ttl: float = DEFAULT_WHOIS_TTL):
+        self.device = device
+        self.whois_ttl = whois_ttl
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.db = sqlite3.connect(path)
+        self.db.executescript(SCHEMA)
+        if "whois_fetched" not in [row[1] for row in self.db.execute("PRAGMA table_info(classified)")]:
+            # A memo from before WHOIS expiry may hold the "Unknown" of failed lookups
+            with self.db:
+                self.db.execute("DROP TABLE classified")
+                self.db.execute("DELETE FROM whois WHERE organization = 'Unknown'")
+            self.db.executescript(SCHEMA)
+        self.rules = rules_fingerprint(first_party_suffixes, support_party_list)
+        # Entries dropped because the rules changed since the last run (None if they did not)
+        self.invalidated = None
+        self._sync_rules(sorted(set(first_party_suffixes)), sorted(set(support_party_list)))
+        self.rows = {domain: row for domain, *row in self.db.execute(
+            "SELECT domain, evidence, sld, tld, category, organization FROM classified WHERE device = ? AND rules = ? "
+            "AND (whois_fetched IS NULL OR whois_fetched >= ?)", (device, self.rules, time.time() - whois_ttl))}
+        self.pending = []
+        # domain -> fetch time of the WHOIS answer its classification used (None if the lookup failed)
+        self._whois_fetched = {}
+        self.hits = self.misses = 0
+
+    def _sync_rules(self, first_party: list, support_party: list):
+        """Carry the device's memo over to the current rules, dropping only the entries they change."""
+        stored = self.db.execute("SELECT fingerprint, first_party, support_party, org_source FROM rules WHERE device = ?",
+                                 (self.device,)).fetchone()
+        if stored is not None and stored[0] == self.rules:
+            return
+        with self.db:
+            if stored is not None:
+                old_rules, old_first, old_support, org_source = stored[0], json.loads(stored[1]), json.loads(stored[2]), stored[3]
+                if org_source != ORG_SOURCE_VERSION:
+                    dropped = self.db.execute("DELETE FROM classified WHERE device = ?", (self.device,)).rowcount
+                else:
+                    suffixes = tuple(set(first_party) ^ set(old_first))
+                    keywords = set(support_party) ^ set(old_support)
+                    affected = [(self.device, domain) for domain, organization in self.db.execute(
+                        "SELECT domain, organization FROM classified WHERE device = ? AND rules = ?", (self.device, old_rules))
+                        if (suffixes and domain.lower().endswith(suffixes))
+                        or any(keyword in organization.lower() for keyword in keywords)]
+                    self.db.executemany("DELETE FROM classified WHERE device = ? AND domain = ?", affected)
+                    self.db.execute("UPDATE classified SET rules = ? WHERE device = ? AND rules = ?",
+                                    (self.rules, self.device, old_rules))
+                    dropped = len(affected)
+                self.invalidated = dropped
+                logger.info(f"Classification rules of {self.device} changed: {dropped} memoized domains invalidated")
+            self.db.execute("INSERT OR REPLACE INTO rules VALUES (?, ?, ?, ?, ?)",
+                            (self.device, self.rules, json.dumps(first_party), json.dumps(support_party),
+                             ORG_SOURCE_VERSION))
+
+    def get(self, domain: str, evidence: str):
+        """(sld, tld, category, organization) memoized for this evidence, or None."""
+        row = self.rows.get(domain)
+        if row is None or row[0] != evidence:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[1:]
+
+    def put(self, domain: str, evidence: str, sld: str, tld: str, category: str, organization: str):
+        """Memoize a classification, unless a failed WHOIS lookup left it "Unknown" (it is classified again next time)."""
+        consulted = domain in self._whois_fetched
+        whois_fetched = self._whois_fetched.pop(domain, None)
+        if consulted and whois_fetched is None:
+            return
+        self.rows[domain] = (evidence, sld, tld, category, organization)
+        self.pending.append((self.device, domain, self.rules, evidence, sld, tld, category, organization, whois_fetched))
+
+    def whois_organization(self, domain: str, lookup) -> str:
+        """
+        Organization of a domain from the WHOIS cache, calling lookup(domain) when missing or expired.
+
+        lookup returns None when the lookup failed (timeout, no whois
+        client): "Unknown" is returned then, and nothing is cached. An answer
+        naming no organization, even an empty one, is cached as "Unknown".
+        """
+        row = self.db.execute("SELECT organization, fetched FROM whois WHERE domain = ? AND fetched >= ?",
+                              (domain, time.time() - self.whois_ttl)).fetchone()
+        if row is not None:
+            self._whois_fetched[domain] = row[1]
+            return row[0]
+        organization = lookup(domain)
+        if organization is None:
+            self._whois_fetched[domain] = None
+            return "Unknown"
+        fetched = time.time()
+        with self.db:
+            self.db.execute("INSERT OR REPLACE INTO whois VALUES (?, ?, ?)", (domain, organization, fetched))
+        self._whois_fetched[domain] = fetched
+        return organization
+
+    def flush(self):
+        """Write the classifications made since the last flush."""
+        if self.pending:
+            with self.db:
+                self.db.executemany("INSERT OR REPLACE INTO classified VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", self.pending)
+            self.pending = []
+
+    def close(self):
+        self.flush()
+        self.db.close()
@@ -0,0 +1,228 @@
+import os
+import mmap
+import time
+import pickle
+import struct
+import bisect
+import calendar
+import logging
+import ipaddress
+from src.analysis.destination_index import month_of_dir
+
+logger = logging.getLogger(__name__)
+
+# Layout: header, then fixed-size records sorted by (IP, first seen), then the
+# domain table (n + 1 offsets into a UTF-8 blob). IPv4 addresses are stored
+# IPv4-mapped, so every key is 16 big-endian bytes and byte order is IP order.
+MAGIC = b"IOTPDNS1"
+HEADER = struct.Struct("<8sQQ")        # magic, records, domains
+RECORD = struct.Struct(">16sIIII")     # ip, first seen, last seen, domain id, sightings
+OFFSET = struct.Struct("<Q")
+
+# Time range of mappings whose month is unknown
+ALWAYS = (0, 0xFFFFFFFF)
+
+
+def ip_bytes(ip: str):
+    """16-byte sortable key of an IP (IPv4-mapped for IPv4), or None if invalid."""
+    try:
+        address = ipaddress.ip_address(ip)
+    except ValueError:
+        return None
+    if address.version == 4:
+        address = ipaddress.IPv6Address(b"\x00" * 10 + b"\xff\xff" + address.packed)
+    return address.packed
+
+
+def month_range(month: str) -> tuple[int, int]:
+    """[start, end] epoch seconds (UTC) of a YYYY-MM month."""
+    year, month_num = int(month[:4]), int(month[5:7])
+    start = calendar.timegm((year, month_num, 1, 0, 0, 0))
+    days = calendar.monthrange(year, month_num)[1]
+    return start, start + days * 86400 - 1
+
+
+def _month_dirs(base_dir: str) -> list[str]:
+    """Every <device>/<year>/<Mon_Year> dir under base_dir."""
+    dirs = []
+    for device in sorted(os.listdir(base_dir)):
+        device_dir = os.path.join(base_dir, device)
+        if not os.path.isdir(device_dir):
+            continue
+        for year in sorted(os.listdir(device_dir)):
+            year_dir = os.path.join(device_dir, year)
+            if year.isdigit() and os.path.isdir(year_dir):
+                dirs.extend(os.path.join(year_dir, month) for month in sorted(os.listdir(year_dir))
+                            if month_of_dir(os.path.join(year_dir, month)))
+    return dirs
+
+
+def read_dns_log(path: str):
+    """
+    Yield (ts, domain, ips) from an external DNS log.
+
+    One answer per line: '<epoch ts> <domain> <ip>[,<ip>...]', tab or space
+    separated, as written by `tshark -T fields -e frame.time_epoch -e
+    dns.qry.name -e dns.a -e dns.aaaa`. Fields that are not IPs are ignored.
+    """
+    with open(path, 'r', errors="replace") as f:
+        for line in f:
+            fields = line.rstrip("\n").split("\t") if "\t" in line else line.split()
+            if len(fields) < 3:
+                continue
+            try:
+                ts = int(float(fields[0]))
+            except ValueError:
+                continue
+            domain = fields[1].lower().rstrip(".")
+            ips = [ip for field in fields[2:] for ip in field.split(",") if ip_bytes(ip)]
+            if domain and ips:
+                yield ts, domain, ips
+
+
+def build_passive_dns(output_file: str, month_dirs: list = None, base_dir: str = None, dns_logs: list = None):
+    """
+    Build the passive-DNS index from month outputs and external DNS logs.
+
+    Every (IP, domain) pair gets one record with the first and last time it
+    was seen and the number of sightings (months or log lines). Pairs from a
+    month's ip_domain_map.pkl span that month; pairs from a directory that is
+    not a <device>/<year>/<Mon_Year> output span all time.
+
+    Args:
+        output_file (str): Index path.
+        month_dirs (list): Month output dirs (with domain_list/ip_domain_map.pkl).
+        base_dir (str): Also take every month under this longitudinal base dir.
+        dns_logs (list): External DNS logs (see read_dns_log).
+    """
+    start = time.perf_counter()
+    pairs = {}
+
+    def add(ip, domain, first, last):
+        key = ip_bytes(ip)
+        if key is None or not domain:
+            return
+        seen = pairs.get((key, domain))
+        if seen is None:
+            pairs[(key, domain)] = [first, last, 1]
+        else:
+            seen[0], seen[1], seen[2] = min(seen[0], first), max(seen[1], last), seen[2] + 1
+
+    month_dirs = list(month_dirs or []) + (_month_dirs(base_dir) if base_dir else [])
+    for month_dir in month_dirs:
+        map_file = os.path.join(month_dir, "domain_list", "ip_domain_map.pkl")
+        if not os.path.exists(map_file):
+            continue
+        parsed = month_of_dir(month_dir)
+        first, last = month_range(parsed[1]) if parsed else ALWAYS
+        with open(map_file, 'rb') as f:
+            for device_map in pickle.load(f).values():
+                for ip, domain in device_map.items():
+                    add(ip, domain, first, last)
+    for dns_log in dns_logs or []:
+        for ts, domain, ips in read_dns_log(dns_log):
+            for ip in ips:
+                add(ip, domain, ts, ts)
+
+    domains = sorted({domain for _, domain in pairs})
+    domain_ids = {domain: i for i, domain in enumerate(domains)}
+    if os.path.dirname(output_file):
+        os.makedirs(os.path.dirname(output_file), exist_ok=True)
+    tmp = output_file + ".tmp"
+    with open(tmp, 'wb') as f:
+        f.write(HEADER.pack(MAGIC, len(pairs), len(domains)))
+        for (key, domain), (first, last, count) in sorted(pairs.items(), key=lambda item: (item[0][0], item[1][0])):
+            f.write(RECORD.pack(key, first, last, domain_ids[domain], min(count, 0xFFFFFFFF)))
+        offset = 0
+        encoded = [domain.encode() for domain in domains]
+        for data in encoded:
+            f.write(OFFSET.pack(offset))
+            offset += len(data)
+        f.write(OFFSET.pack(offset))
+        for data in encoded:
+            f.write(data)
+    os.replace(tmp, output_file)
+    logger.info(f"Passive DNS {output_file}: {len(pairs)} IP-domain pairs, {len(domains)} domains from "
+                f"{len(month_dirs)} month dirs and {len(dns_logs or [])} DNS logs ({time.perf_counter() - start:.2f}s)")
+
+
+class _IpKeys:
+    """The IP keys of the records, as a sequence for bisect (read from the mapping on access)."""
+
+    def __init__(self, data, count: int):
+        self.data = data
+        self.count = count
+
+    def __len__(self):
+        return self.count
+
+    def __getitem__(self, i):
+        start = HEADER.size + i * RECORD.size
+        return self.data[start:start + 16]
+
+
+class PassiveDns:
+    """
+    Read-only, memory-mapped passive-DNS index (see build_passive_dns).
+
+    Lookups binary-search the records, so they cost O(log n) page reads and
+    the index is never loaded into memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        with open(path, 'rb') as f:
+            self.data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        magic, self.records, self.domains = HEADER.unpack_from(self.data, 0)
+        if magic != MAGIC:
+            raise ValueError(f"{path} is not a passive DNS index")
+        self.keys = _IpKeys(self.data, self.records)
+        self.offsets_start = HEADER.size + self.records * RECORD.size
+        self.blob_start = self.offsets_start + (self.domains + 1) * OFFSET.size
+
+    def _domain(self, domain_id: int) -> str:
+        start, = OFFSET.unpack_from(self.data, self.offsets_start + domain_id * OFFSET.size)
+        end, = OFFSET.unpack_from(self.data, self.offsets_start + (domain_id + 1) * OFFSET.size)
+        return self.data[self.blob_start + start:self.blob_start + end].decode()
+
+    def records_for(self, ip: str) -> list[tuple]:
+        """(domain, first seen, last seen, sightings) of every domain the IP resolved to, by first seen."""
+        key = ip_bytes(ip)
+        if key is None:
+            return []
+        i = bisect.bisect_left(self.keys, key)
+        found = []
+        while i < self.records:
+            record_key, first, last, domain_id, count = RECORD.unpack_from(self.data, HEADER.size + i * RECORD.size)
+            if record_key != key:
+                break
+            found.append((self._domain(domain_id), first, last, count))
+            i += 1
+        return found
+
+    def lookup(self, ip: str, start: int = None, end: int = None):
+        """
+        The domain an IP most likely stood for in [start, end].
+
+        Mappings overlapping the period win (the most sighted first), then
+        the one closest in time. Without a period, the most recently seen
+        mapping is returned.
+
+        Returns:
+            str: Domain, or None if the IP is not in the index.
+        """
+        found = self.records_for(ip)
+        if not found:
+            return None
+        if start is None:
+            return max(found, key=lambda r: (r[2], r[3]))[0]
+        end = start if end is None else end
+
+        def rank(record):
+            _, first, last, count = record
+            gap = max(0, first - end, start - last)
+            return gap, -count
+        return min(found, key=rank)[0]
+
+    def close(self):
+        self.data.close()
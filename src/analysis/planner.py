@@ -0,0 +1,227 @@
+import os
+import json
+import time
+import socket
+import logging
+import statistics
+from src.analysis.catalog import catalog_months
+from src.governor import available_memory_mb
+
+logger = logging.getLogger(__name__)
+
+# Runs kept from the history when estimating (the most recent ones)
+HISTORY_RUNS = 20
+
+# Used until this host has a recorded run
+DEFAULT_EXTRACT_MBPS = 20.0           # MB/s per worker, domains + IPs passes
+DEFAULT_ASSEMBLE_S_PER_GB = 2.0       # merge + save, per GB of input
+DEFAULT_TSHARK_RSS_RATIO = 2.0        # tshark RSS / PCAP size, beyond the largest recorded PCAP
+DEFAULT_PYTHON_RSS_MB = 300.0
+DEFAULT_OUTPUT_RATIO = 0.005          # output bytes / input bytes
+
+# tshark keeps per-frame state, so its memory grows with the file; never plan for less than this
+MIN_TSHARK_RSS_MB = 100.0
+# Share of the available memory a run may plan to use
+MEMORY_HEADROOM = 0.8
+
+
+def throughput_file(log_dir: str = "logs") -> str:
+    """logs/throughput_<host>.jsonl: one line per recorded run on this host."""
+    return os.path.join(log_dir, f"throughput_{socket.gethostname()}.jsonl")
+
+
+def dir_size(path: str, since: float = None) -> int:
+    """Total size of the files under path (only those modified at or after `since`, epoch seconds, if given)."""
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                st = os.stat(os.path.join(root, name))
+            except OSError:
+                continue
+            if since is None or st.st_mtime >= since:
+                total += st.st_size
+    return total
+
+
+def peak_rss_mb() -> tuple[float, float]:
+    """(peak RSS of this process, largest peak RSS of a finished child such as tshark), in MB."""
+    try:
+        import resource
+    except ImportError:
+        return 0.0, 0.0
+    # ru_maxrss is in KB on Linux
+    return (resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+            resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024)
+
+
+def record_throughput(command: str, sizes: list, workers: int, stages: dict, output_bytes: int,
+                      extract_profile: str = "full", history_file: str = None):
+    """
+    Append one run's throughput to this host's history, for `plan`.
+
+    Args:
+        command (str): Subcommand that ran (e.g. 'schedule').
+        sizes (list): Size in bytes of every PCAP processed.
+        workers (int): Worker threads of the run.
+        stages (dict): Stage name -> wall-clock seconds.
+        output_bytes (int): Size of the outputs written.
+        extract_profile (str): tshark extraction profile of the run.
+        history_file (str): History path (default: throughput_file()).
+    """
+    if not sizes:
+        return
+    history_file = history_file or throughput_file()
+    self_rss, tshark_rss = peak_rss_mb()
+    record = {
+        "time": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "command": command,
+        "extract_profile": extract_profile,
+        "cores": os.cpu_count(),
+        "workers": workers,
+        "pcaps": len(sizes),
+        "bytes": sum(sizes),
+        "largest_pcap": max(sizes),
+        "stages": {stage: round(seconds, 3) for stage, seconds in stages.items()},
+        "peak_rss_mb": round(self_rss, 1),
+        "tshark_rss_mb": round(tshark_rss, 1),
+        "output_bytes": output_bytes,
+    }
+    if os.path.dirname(history_file):
+        os.makedirs(os.path.dirname(history_file), exist_ok=True)
+    with open(history_file, 'a') as f:
+        f.write(json.dumps(record) + "\n")
+    logger.info(f"Throughput recorded to {history_file}")
+
+
+def load_history(history_file: str = None, extract_profile: str = "full") -> list[dict]:
+    """The most recent recorded runs with this extraction profile (oldest first)."""
+    history_file = history_file or throughput_file()
+    if not os.path.exists(history_file):
+        return []
+    runs = []
+    with open(history_file, 'r') as f:
+        for line in f:
+            try:
+                run = json.loads(line)
+            except ValueError:
+                continue
+            if run.get("extract_profile", "full") == extract_profile and run.get("bytes"):
+                runs.append(run)
+    return runs[-HISTORY_RUNS:]
+
+
+def _parallelism(workers: int, pcaps: int, cores: int) -> int:
+    """Workers that can actually make progress at once."""
+    return max(1, min(workers, pcaps, cores or 1))
+
+
+def tshark_memory_mb(model: dict, pcap_bytes: int) -> float:
+    """Expected tshark peak RSS for a PCAP: the recorded peak, grown by DEFAULT_TSHARK_RSS_RATIO beyond the largest recorded PCAP."""
+    extra_mb = max(0, pcap_bytes - model["tshark_largest_pcap"]) / 1e6
+    return max(MIN_TSHARK_RSS_MB, model["tshark_rss_mb"] + DEFAULT_TSHARK_RSS_RATIO * extra_mb)
+
+
+def throughput_model(runs: list[dict]) -> dict:
+    """
+    Per-stage rates from recorded runs, or the defaults without history.
+
+    Extraction is measured in MB/s per busy worker, so runs with different
+    worker counts combine; assembly in seconds per GB of input. The largest
+    tshark peak is kept with the largest PCAP seen, since tshark memory
+    grows with the file it reads.
+    """
+    if not runs:
+        return {"runs": 0, "extract_mbps": DEFAULT_EXTRACT_MBPS, "assemble_s_per_gb": DEFAULT_ASSEMBLE_S_PER_GB,
+                "tshark_rss_mb": MIN_TSHARK_RSS_MB, "tshark_largest_pcap": 0, "python_rss_mb": DEFAULT_PYTHON_RSS_MB,
+                "output_ratio": DEFAULT_OUTPUT_RATIO}
+    extract_mb = sum(run["bytes"] for run in runs) / 1e6
+    extract_worker_s = sum(run["stages"].get("extraction", 0) * _parallelism(run["workers"], run["pcaps"], run["cores"])
+                           for run in runs)
+    assemble_gb = sum(run["bytes"] for run in runs) / 1e9
+    assemble_s = sum(run["stages"].get("assemble", 0) for run in runs)
+    return {
+        "runs": len(runs),
+        "extract_mbps": extract_mb / extract_worker_s if extract_worker_s else DEFAULT_EXTRACT_MBPS,
+        "assemble_s_per_gb": assemble_s / assemble_gb if assemble_gb else DEFAULT_ASSEMBLE_S_PER_GB,
+        "tshark_rss_mb": max(run["tshark_rss_mb"] for run in runs),
+        "tshark_largest_pcap": max(run["largest_pcap"] for run in runs),
+        "python_rss_mb": max(run["peak_rss_mb"] for run in runs),
+        "output_ratio": statistics.median(run["output_bytes"] / run["bytes"] for run in runs),
+    }
+
+
+def job_sizes(jobs: list) -> dict[str, list[int]]:
+    """Month name -> sizes of its PCAPs, for month jobs (unreadable files count as 0)."""
+    sizes = {}
+    for job in jobs:
+        month_sizes = []
+        for files in job.device_pcap.values():
+            for pcap_file in files:
+                try:
+                    month_sizes.append(os.path.getsize(pcap_file))
+                except OSError:
+                    month_sizes.append(0)
+        sizes[job.name] = month_sizes
+    return sizes
+
+
+def catalog_sizes(db_path: str, devices: list, years: list = None) -> dict[str, list[int]]:
+    """Month name -> sizes of its PCAPs, from the sizes recorded in the catalog (no file access)."""
+    return {f"{device} {month}": [row[5] for row in rows]
+            for device in devices for month, rows in sorted(catalog_months(db_path, device, years).items())}
+
+
+def plan_run(month_sizes: dict, workers: int = None, extract_profile: str = "full", history_file: str = None) -> dict:
+    """
+    Estimate the runtime, peak memory and output size of a `schedule` run, and suggest a worker count.
+
+    The suggestion is the largest count that fits the cores, the PCAPs and
+    the available memory: the Python process plus one tshark per worker,
+    sized for the largest PCAP.
+
+    Args:
+        month_sizes (dict): Month name -> sizes in bytes of its PCAPs (see job_sizes, catalog_sizes).
+        workers (int): Worker count to estimate for (default: the suggested one).
+        extract_profile (str): Extraction profile of the run; only history with the same profile is used.
+        history_file (str): Throughput history (default: throughput_file()).
+
+    Returns:
+        dict: Inputs, throughput model, machine, suggested workers and estimates.
+    """
+    sizes = [size for month in month_sizes.values() for size in month]
+    total_bytes, largest = sum(sizes), max(sizes, default=0)
+    model = throughput_model(load_history(history_file, extract_profile))
+    cores, memory_mb = os.cpu_count() or 1, available_memory_mb()
+
+    tshark_mb = tshark_memory_mb(model, largest)
+    memory_workers = int((memory_mb * MEMORY_HEADROOM - model["python_rss_mb"]) // tshark_mb)
+    suggested = max(1, min(cores, len(sizes) or 1, memory_workers))
+    workers = workers or suggested
+
+    parallel = _parallelism(workers, len(sizes), cores)
+    # Every worker holds a tshark, even when there are more workers than cores
+    concurrent = max(1, min(workers, len(sizes)))
+    per_worker_bps = model["extract_mbps"] * 1e6
+    # The largest PCAP is read by a single worker, however many there are
+    extraction_s = max(total_bytes / (per_worker_bps * parallel), largest / per_worker_bps) if sizes else 0.0
+    assemble_s = total_bytes / 1e9 * model["assemble_s_per_gb"]
+    peak_mb = model["python_rss_mb"] + concurrent * tshark_mb
+
+    if memory_workers < 1:
+        logger.warning(f"Even one worker may not fit in {memory_mb:.0f} MB available: the largest PCAP is {largest / 1e6:.0f} MB")
+    elif concurrent > memory_workers:
+        logger.warning(f"{workers} workers may need {peak_mb:.0f} MB, more than the {memory_mb:.0f} MB available")
+    return {
+        "inputs": {"months": len(month_sizes), "pcaps": len(sizes), "bytes": total_bytes, "largest_pcap": largest},
+        "model": model,
+        "machine": {"host": socket.gethostname(), "cores": cores, "available_memory_mb": round(memory_mb)},
+        "suggested_workers": suggested,
+        "estimate": {
+            "workers": workers,
+            "stages_s": {"extraction": round(extraction_s, 1), "assemble": round(assemble_s, 1)},
+            "runtime_s": round(extraction_s + assemble_s, 1),
+            "peak_memory_mb": round(peak_mb),
+            "output_bytes": round(total_bytes * model["output_ratio"]),
+        },
+    }
@@ -0,0 +1,105 @@
+import bisect
+import ipaddress
+
+
+class PrefixIndex:
+    """
+    Longest-prefix-match index over IP prefixes.
+
+    Prefixes are nested or disjoint, so the radix tree they form can be
+    flattened into sorted, non-overlapping integer ranges in which every
+    address maps to its most specific prefix. A lookup is one bisect, and a
+    batch of addresses is resolved in a single merge-style sweep. IPv4 and
+    IPv6 are kept in separate ranges.
+    """
+
+    def __init__(self, prefixes):
+        """
+        Args:
+            prefixes (iterable): (prefix, value) pairs; prefix is a string
+                or ipaddress network. For duplicate prefixes the last value wins.
+        """
+        intervals = {4: [], 6: []}
+        for order, (prefix, value) in enumerate(prefixes):
+            network = ipaddress.ip_network(prefix, strict=False)
+            first = int(network.network_address)
+            intervals[network.version].append((first, -(first + network.num_addresses - 1), order, value))
+        self.ranges = {version: self._flatten(items) for version, items in intervals.items()}
+
+    @staticmethod
+    def _flatten(items):
+        """Turn nested ranges into sorted disjoint (starts, ends, values), most specific value first."""
+        starts, ends, values = [], [], []
+
+        def emit(first, last, value):
+            if first > last:
+                return
+            if ends and ends[-1] == first - 1 and values[-1] == value:
+                ends[-1] = last
+            else:
+                starts.append(first)
+                ends.append(last)
+                values.append(value)
+
+        # Outer ranges sort before the ranges nested in them
+        items.sort()
+        stack, cursor = [], 0
+        for first, neg_last, _, value in items:
+            last = -neg_last
+            while stack and stack[-1][0] < first:
+                end, outer = stack.pop()
+                emit(cursor, end, outer)
+                cursor = max(cursor, end + 1)
+            if stack:
+                emit(cursor, first - 1, stack[-1][1])
+            stack.append((last, value))
+            cursor = first
+        while stack:
+            end, outer = stack.pop()
+            emit(cursor, end, outer)
+            cursor = max(cursor, end + 1)
+        return starts, ends, values
+
+    def __len__(self):
+        return sum(len(starts) for starts, _, _ in self.ranges.values())
+
+    def lookup(self, ip):
+        """Return the value of the most specific prefix containing ip, or None."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        starts, ends, values = self.ranges[address.version]
+        key = int(address)
+        i = bisect.bisect_right(starts, key) - 1
+        if i >= 0 and key <= ends[i]:
+            return values[i]
+        return None
+
+    def lookup_many(self, ips) -> dict:
+        """
+        Resolve many IPs in one sorted sweep.
+
+        Returns:
+            dict: ip -> value for every IP covered by a prefix.
+        """
+        keyed = {4: [], 6: []}
+        for ip in set(ips):
+            try:
+                address = ipaddress.ip_address(ip)
+            except ValueError:
+                continue
+            keyed[address.version].append((int(address), ip))
+        results = {}
+        for version, addresses in keyed.items():
+            starts, ends, values = self.ranges[version]
+            addresses.sort()
+            i = 0
+            for key, ip in addresses:
+                while i < len(starts) and ends[i] < key:
+                    i += 1
+                if i == len(starts):
+                    break
+                if starts[i] <= key:
+                    results[ip] = values[i]
+        return results
@@ -0,0 +1,209 @@
+import os
+import time
+import random
+import sqlite3
+import asyncio
+import logging
+import ipaddress
+
+logger = logging.getLogger(__name__)
+
+# Point RIPESTAT_URL at a local stub server to test without the real API
+DEFAULT_BASE_URL = os.environ.get("RIPESTAT_URL", "https://stat.ripe.net")
+PREFIX_OVERVIEW = "/data/prefix-overview/data.json"
+DEFAULT_CACHE = os.path.join("cache", "ripestat.sqlite")
+DEFAULT_TTL = 7 * 86400
+
+# One address per /24 (/48) is looked up before the rest: its answer usually
+# covers the others, which are then answered from the cache
+PROBE_PREFIXLEN = {4: 24, 6: 48}
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS prefixes (
+    prefix TEXT PRIMARY KEY,
+    version INTEGER NOT NULL,
+    start TEXT NOT NULL,
+    end TEXT NOT NULL,
+    prefixlen INTEGER NOT NULL,
+    country TEXT,
+    asn INTEGER,
+    holder TEXT,
+    fetched REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS prefixes_start ON prefixes (version, start, prefixlen);
+"""
+
+
+class _Retry(Exception):
+    """A response worth retrying (429 or 5xx), with the server's Retry-After if any."""
+
+    def __init__(self, status: int, retry_after: float = None):
+        super().__init__(f"HTTP {status}")
+        self.retry_after = retry_after
+
+
+def _key(address) -> tuple[int, str]:
+    """(version, fixed-width hex) sort key of an address, as in the destination index."""
+    width = 8 if address.version == 4 else 32
+    return address.version, f"{int(address):0{width}x}"
+
+
+def parse_prefix_overview(ip: str, data: dict):
+    """
+    Read a prefix-overview answer.
+
+    Returns:
+        tuple: Covering prefix (the IP's host prefix when RIPEstat has none),
+            and (country, asn, org) with None for what the answer lacks.
+    """
+    data = data.get("data") or {}
+    asns = data.get("asns") or []
+    asn = asns[0].get("asn") if asns else None
+    org = asns[0].get("holder") if asns else None
+    located = data.get("located_resources") or []
+    country = located[0].get("location", {}).get("country") if located else None
+    prefix = data.get("resource") or ip
+    try:
+        network = ipaddress.ip_network(prefix, strict=False)
+        if ipaddress.ip_address(ip) not in network:
+            network = ipaddress.ip_network(ip)
+    except ValueError:
+        network = ipaddress.ip_network(ip)
+    return str(network), (country, asn, org)
+
+
+class RipeStatClient:
+    """
+    Asynchronous RIPEstat prefix-overview client.
+
+    Lookups share one pooled aiohttp session, at most `concurrency`
+    requests are in flight, and 429/5xx answers and network errors are
+    retried with exponential backoff (honouring Retry-After). Answers are
+    cached on disk by covering prefix with a TTL, so every other address of
+    a prefix already looked up is answered without a request, across runs.
+    """
+
+    def __init__(self, base_url: str = None, cache_path: str = DEFAULT_CACHE, ttl: float = DEFAULT_TTL,
+                 concurrency: int = 8, retries: int = 4, timeout: float = 30, backoff: float = 1.0,
+                 sourceapp: str = None):
+        self.base_url = (base_url or DEFAULT_BASE_URL).rstrip("/")
+        self.ttl = ttl
+        self.concurrency = concurrency
+        self.retries = retries
+        self.timeout = timeout
+        self.backoff = backoff
+        self.sourceapp = sourceapp
+        if os.path.dirname(cache_path):
+            os.makedirs(os.path.dirname(cache_path), exist_ok=True)
+        self.cache = sqlite3.connect(cache_path)
+        self.cache.executescript(SCHEMA)
+        if "prefixlen" not in [row[1] for row in self.cache.execute("PRAGMA table_info(prefixes)")]:
+            # A cache from before prefix lengths were stored: nested prefixes could not be ordered
+            with self.cache:
+                self.cache.execute("DROP TABLE prefixes")
+            self.cache.executescript(SCHEMA)
+        self.requests = 0
+
+    def cached(self, ip: str):
+        """(country, asn, org) of the most specific unexpired cached prefix covering ip, or None."""
+        try:
+            address = ipaddress.ip_address(ip)
+        except ValueError:
+            return None
+        version, key = _key(address)
+        # Covering prefixes are nested: the latest start, then the longest prefix, is the most specific
+        return self.cache.execute("SELECT country, asn, holder FROM prefixes WHERE version = ? AND start <= ? "
+                                  "AND end >= ? AND fetched >= ? ORDER BY start DESC, prefixlen DESC LIMIT 1",
+                                  (version, key, key, time.time() - self.ttl)).fetchone()
+
+    def store(self, prefix: str, result: tuple):
+        network = ipaddress.ip_network(prefix)
+        version, start = _key(network.network_address)
+        _, end = _key(network.broadcast_address)
+        with self.cache:
+            self.cache.execute("INSERT OR REPLACE INTO prefixes VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                               (prefix, version, start, end, network.prefixlen, *result, time.time()))
+
+    async def _fetch(self, session, semaphore, ip: str):
+        """Look one IP up, with retries; returns its result, or None when it keeps failing."""
+        import aiohttp
+        params = {"resource": ip}
+        if self.sourceapp:
+            params["sourceapp"] = self.sourceapp
+        for attempt in range(self.retries + 1):
+            try:
+                async with semaphore:
+                    # An answer received while this lookup waited may already cover it
+                    hit = self.cached(ip)
+                    if hit is not None:
+                        return hit
+                    self.requests += 1
+                    async with session.get(self.base_url + PREFIX_OVERVIEW, params=params) as response:
+                        if response.status == 429 or response.status >= 500:
+                            retry_after = response.headers.get("Retry-After")
+                            raise _Retry(response.status, float(retry_after) if retry_after and retry_after.isdigit() else None)
+                        if response.status >= 400:
+                            logger.warning(f"RIPEstat {ip}: HTTP {response.status}, not retried")
+                            return None
+                        data = await response.json(content_type=None)
+                prefix, result = parse_prefix_overview(ip, data)
+                self.store(prefix, result)
+                return result
+            except (_Retry, aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                if attempt == self.retries:
+                    logger.warning(f"RIPEstat {ip}: giving up after {attempt + 1} attempts ({e!r})")
+                    return None
+                delay = getattr(e, "retry_after", None) or self.backoff * 2 ** attempt * (0.5 + random.random())
+                await asyncio.sleep(delay)
+
+    async def lookup_async(self, ips) -> dict:
+        """Async form of lookup()."""
+        import aiohttp
+        results, pending = {}, []
+        for ip in set(ips):
+            hit = self.cached(ip)
+            if hit is not None:
+                results[ip] = hit
+            else:
+                try:
+                    ipaddress.ip_address(ip)
+                except ValueError:
+                    continue
+                pending.append(ip)
+        if not pending:
+            return results
+
+        groups = {}
+        for ip in pending:
+            address = ipaddress.ip_address(ip)
+            groups.setdefault(ipaddress.ip_network(f"{ip}/{PROBE_PREFIXLEN[address.version]}", strict=False), []).append(ip)
+        # The semaphore admits lookups in this order
+        ordered = [members[0] for members in groups.values()] + [ip for members in groups.values() for ip in members[1:]]
+        semaphore = asyncio.Semaphore(self.concurrency)
+        connector = aiohttp.TCPConnector(limit=self.concurrency)
+        timeout = aiohttp.ClientTimeout(total=self.timeout)
+        async with aiohttp.ClientSession(connector=connector, timeout=timeout) as session:
+            answers = await asyncio.gather(*(self._fetch(session, semaphore, ip) for ip in ordered))
+        for ip, answer in zip(ordered, answers):
+            if answer is not None:
+                results[ip] = answer
+        return results
+
+    def lookup(self, ips) -> dict:
+        """
+        Look a batch of IPs up, from the cache first.
+
+        Args:
+            ips (iterable): IP addresses.
+
+        Returns:
+            dict: ip -> (country, asn, org) for every IP that could be looked up.
+        """
+        ips = list(ips)
+        before = self.requests
+        results = asyncio.run(self.lookup_async(ips))
+        logger.info(f"RIPEstat: {len(results)}/{len(set(ips))} IPs resolved with {self.requests - before} requests")
+        return results
+
+    def close(self):
+        self.cache.close()
@@ -0,0 +1,130 @@
+import os
+import json
+import time
+import logging
+from src.parsers.dns_tls_extractor import extract_sld
+from src.utils import parse_pcap_name
+
+logger = logging.getLogger(__name__)
+
+# Period key of each level, from the capture's UTC timestamp: YYYY-MM-DDTHH,
+# YYYY-MM-DD, YYYY-MM. A coarser key is a prefix of the finer keys it covers.
+LEVELS = ("hourly", "daily", "monthly")
+HOUR_FORMAT = "%Y-%m-%dT%H"
+KEY_LENGTH = {"daily": 10, "monthly": 7}
+
+
+class Rollup:
+    """Destinations seen in one period: domains, SLDs, IPs, the IP -> domain map (later captures win) and the contacted domains."""
+
+    __slots__ = ("domains", "slds", "ips", "ip_domain_map", "contacted")
+
+    def __init__(self):
+        self.domains = set()
+        self.slds = set()
+        self.ips = set()
+        self.ip_domain_map = {}
+        self.contacted = set()
+
+    def add_pcap(self, domain_result, ips):
+        """Fold one PCAP's extract_domains and extract_ips results in."""
+        domain_list, ip_domain_map = domain_result[0], domain_result[1]
+        self.domains.update(domain_list)
+        self.slds.update(extract_sld(domain) for domain in domain_list)
+        self.ips.update(ips)
+        self.ip_domain_map.update(ip_domain_map)
+
+    def merge(self, other: "Rollup"):
+        """Fold a later period in."""
+        self.domains |= other.domains
+        self.slds |= other.slds
+        self.ips |= other.ips
+        self.ip_domain_map.update(other.ip_domain_map)
+        return self
+
+    def translate(self, earlier_map: dict):
+        """
+        Set the contacted domains: the period's IPs translated with its own
+        mapping first, then with the mapping of the month's earlier periods
+        (for DNS answers cached from before the period). Later periods are
+        never consulted.
+        """
+        self.contacted = set()
+        for ip in self.ips:
+            domain = self.ip_domain_map.get(ip) or earlier_map.get(ip)
+            if domain:
+                self.contacted.add(domain)
+
+    def to_dict(self) -> dict:
+        """Serializable form."""
+        return {
+            "domains": sorted(self.domains),
+            "slds": sorted(self.slds),
+            "ips": sorted(self.ips),
+            "contacted_domains": sorted(self.contacted),
+        }
+
+
+def build_rollups(pcap_files: list, results: list) -> dict:
+    """
+    Build hourly, daily and monthly rollups of one device-month in one pass over its results.
+
+    Hourly rollups fold the PCAPs whose file name timestamp falls in the
+    hour; each daily rollup merges that day's hourly rollups and the monthly
+    rollup merges the daily ones, in time order. PCAPs without a parsable
+    name are skipped. Each period's IPs are translated with its own mapping,
+    then with the running mapping of the periods before it.
+
+    Args:
+        pcap_files (list): PCAP paths.
+        results (list): (extract_domains result, extract_ips result) per PCAP, None if it failed.
+
+    Returns:
+        dict: level -> {period: Rollup}.
+    """
+    hourly = {}
+    timed = []
+    for pcap_file, result in zip(pcap_files, results):
+        parsed = parse_pcap_name(pcap_file)
+        if parsed is None or result is None:
+            continue
+        timed.append((parsed[0], result))
+    for ts, (domain_result, ips) in sorted(timed, key=lambda t: t[0]):
+        hour = time.strftime(HOUR_FORMAT, time.gmtime(ts))
+        hourly.setdefault(hour, Rollup()).add_pcap(domain_result, ips)
+
+    rollups = {"hourly": hourly}
+    for finer, level in zip(LEVELS, LEVELS[1:]):
+        coarser = {}
+        for period in sorted(rollups[finer]):
+            coarser.setdefault(period[:KEY_LENGTH[level]], Rollup()).merge(rollups[finer][period])
+        rollups[level] = coarser
+    for level in LEVELS:
+        earlier_map = {}
+        for period in sorted(rollups[level]):
+            rollup = rollups[level][period]
+            rollup.translate(earlier_map)
+            earlier_map.update(rollup.ip_domain_map)
+    return rollups
+
+
+def save_rollups(output_dir: str, device_rollups: dict):
+    """
+    Write <output_dir>/rollups/{hourly,daily,monthly}.json.
+
+    Each file maps device -> period -> {domains, slds, ips, contacted_domains}.
+
+    Args:
+        output_dir (str): Month output directory.
+        device_rollups (dict): device -> result of build_rollups.
+    """
+    rollup_dir = os.path.join(output_dir, "rollups")
+    os.makedirs(rollup_dir, exist_ok=True)
+    for level in LEVELS:
+        data = {}
+        for device, rollups in device_rollups.items():
+            data[device] = {period: rollup.to_dict() for period, rollup in sorted(rollups[level].items())}
+        with open(os.path.join(rollup_dir, f"{level}.json"), 'w') as f:
+            json.dump(data, f, indent=4)
+    periods = {level: sum(len(rollups[level]) for rollups in device_rollups.values()) for level in LEVELS}
+    logger.info(f"Rollups written to {rollup_dir}: {periods['hourly']} hours, {periods['daily']} days, {periods['monthly']} months")
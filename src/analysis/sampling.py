@@ -0,0 +1,126 @@
+import os
+import json
+import math
+import time
+import random
+import logging
+from collections import Counter, defaultdict
+from src.utils import parse_pcap_name
+
+logger = logging.getLogger(__name__)
+
+
+def stratified_sample(pcap_files: list, fraction: float, rng: random.Random) -> list:
+    """
+    Pick a fraction of a month's PCAPs spread across its days and hours.
+
+    The capture timestamp in the file name puts each PCAP in a day. Each day
+    gets a share of the sample proportional to its number of PCAPs (largest
+    remainder), and within a day PCAPs are taken at evenly spaced positions
+    from a random offset, so different days cover different hours.
+
+    Args:
+        pcap_files (list): PCAP paths.
+        fraction (float): Fraction of PCAPs to keep (0 < fraction <= 1).
+        rng (random.Random): Random source.
+
+    Returns:
+        list: Sampled PCAP paths, in their original order.
+    """
+    days = defaultdict(list)
+    for pcap_file in pcap_files:
+        parsed = parse_pcap_name(pcap_file)
+        day = time.strftime("%Y-%m-%d", time.gmtime(parsed[0])) if parsed else None
+        days[day].append((parsed[0] if parsed else 0, pcap_file))
+    target = min(len(pcap_files), max(1, math.ceil(fraction * len(pcap_files))))
+
+    quotas = {day: target * len(files) / len(pcap_files) for day, files in days.items()}
+    allocated = {day: int(quota) for day, quota in quotas.items()}
+    remainders = sorted(days, key=lambda day: (quotas[day] - allocated[day], rng.random()), reverse=True)
+    for day in remainders[:target - sum(allocated.values())]:
+        allocated[day] += 1
+
+    sampled = set()
+    for day, files in days.items():
+        quota = allocated[day]
+        if not quota:
+            continue
+        files.sort()
+        offset = rng.random()
+        for j in range(quota):
+            sampled.add(files[int((offset + j) * len(files) / quota)][1])
+    return [pcap_file for pcap_file in pcap_files if pcap_file in sampled]
+
+
+def chao2(incidences: list) -> dict:
+    """
+    Incidence-based richness estimate (Chao2) from per-PCAP observation sets.
+
+    Args:
+        incidences (list): One set of observed items (domains or IPs) per sampled PCAP.
+
+    Returns:
+        dict: observed, singletons (Q1), doubletons (Q2), estimated total,
+              estimated missed and estimated sample coverage.
+    """
+    m = len(incidences)
+    counts = Counter(item for items in incidences for item in set(items))
+    observed = len(counts)
+    q1 = sum(1 for c in counts.values() if c == 1)
+    q2 = sum(1 for c in counts.values() if c == 2)
+    factor = (m - 1) / m if m else 0
+    if q2 > 0:
+        estimate = observed + factor * q1 * q1 / (2 * q2)
+    else:
+        estimate = observed + factor * q1 * (q1 - 1) / 2
+    total_incidences = sum(counts.values())
+    if total_incidences and (factor * q1 + 2 * q2):
+        coverage = 1 - q1 / total_incidences * (factor * q1 / (factor * q1 + 2 * q2))
+    else:
+        coverage = 1.0
+    return {
+        "observed": observed,
+        "singletons": q1,
+        "doubletons": q2,
+        "estimated_total": round(estimate, 1),
+        "estimated_missed": round(estimate - observed, 1),
+        "sample_coverage": round(coverage, 4),
+    }
+
+
+def save_discovery_estimate(output_dir: str, domain_sets: list, ip_sets: list, total_pcaps: int,
+                            fraction: float, seed):
+    """
+    Write <output_dir>/discovery_estimate.json for a sampled month.
+
+    Contains the Chao2 estimates for domains and IPs and the discovery curve
+    (distinct domains and IPs after each sampled PCAP, in capture order).
+
+    Args:
+        output_dir (str): Month output directory.
+        domain_sets (list): Domains seen in each sampled PCAP, in capture order.
+        ip_sets (list): IPs seen in each sampled PCAP, in capture order.
+        total_pcaps (int): PCAPs in the month before sampling.
+        fraction (float): Sampling fraction.
+        seed: Sampling seed.
+    """
+    curve, domains, ips = [], set(), set()
+    for i, (domain_set, ip_set) in enumerate(zip(domain_sets, ip_sets), 1):
+        domains.update(domain_set)
+        ips.update(ip_set)
+        curve.append([i, len(domains), len(ips)])
+    estimate = {
+        "pcaps_total": total_pcaps,
+        "pcaps_sampled": len(domain_sets),
+        "fraction": fraction,
+        "seed": seed,
+        "domains": chao2(domain_sets),
+        "ips": chao2(ip_sets),
+        "curve": curve,
+    }
+    os.makedirs(output_dir, exist_ok=True)
+    with open(os.path.join(output_dir, "discovery_estimate.json"), 'w') as f:
+        json.dump(estimate, f, indent=4)
+    logger.info(f"{output_dir}: sampled {len(domain_sets)}/{total_pcaps} PCAPs, "
+                f"{estimate['domains']['observed']} domains (~{estimate['domains']['estimated_missed']} missed), "
+                f"{estimate['ips']['observed']} IPs (~{estimate['ips']['estimated_missed']} missed)")
@@ -0,0 +1,254 @@
+import os
+import re
+import json
+import time
+import random
+import logging
+import concurrent.futures
+from collections import defaultdict
+from src.analysis.catalog import catalog_months
+from src.analysis.extract_domain import merge_domain_results, save_domain_results
+from src.analysis.ip_to_domain import save_ip_results
+from src.analysis.sampling import stratified_sample, save_discovery_estimate
+from src.analysis.destination_index import index_month
+from src.analysis.rollups import build_rollups, save_rollups
+from src.analysis.planner import record_throughput, dir_size
+from src.parsers.dns_tls_extractor import extract_domains
+from src.parsers.ip_extractor import extract_ips
+from src.parsers.tshark import get_extract_profile
+from src.utils import read_pcap_list
+from src.profiling import profiled
+
+logger = logging.getLogger(__name__)
+
+MONTHS = ["Jan", "Feb", "Mar", "Apr", "May", "Jun",
+          "Jul", "Aug", "Sep", "Oct", "Nov", "Dec"]
+
+# Per-month input lists written by run_longitudinal.sh: inputs/<device>_longitudinal/YYYY-MM.txt
+LIST_NAME_RE = re.compile(r"^(\d{4})-(\d{2})\.txt$")
+# Sampled runs write here, inside the month's output dir, so they never replace its full outputs
+SAMPLE_DIR = "sample"
+# Written to a month's output dir when some of its PCAPs failed (removed once a run completes it)
+INCOMPLETE_FILE = "incomplete.json"
+
+
+class MonthJob:
+    """All PCAPs of one device-month and the per-PCAP results collected so far."""
+
+    def __init__(self, name: str, month: str, output_dir: str, device_pcap: dict, sampling: dict = None):
+        self.name = name
+        # YYYY-MM; not derived from output_dir, which is a sample/ subfolder for sampled runs
+        self.month = month
+        self.output_dir = output_dir
+        self.device_pcap = device_pcap
+        # {"fraction", "seed", "total_pcaps"} when only a sample of the month is processed
+        self.sampling = sampling
+        # results[device][i] holds the result for device_pcap[device][i]
+        self.results = {device: [None] * len(files) for device, files in device_pcap.items()}
+        self.remaining = sum(len(files) for files in device_pcap.values())
+        # PCAPs whose extraction failed; the month's outputs then miss their destinations
+        self.failed = []
+
+
+def month_output_dir(base_dir: str, device: str, year: str, month_num: str) -> str:
+    """analysis_longitudinal/<device>/<year>/<Mon_Year>, as in run_longitudinal.sh."""
+    month_name = MONTHS[int(month_num) - 1]
+    return os.path.join(base_dir, device, year, f"{month_name}_{year}")
+
+
+def jobs_from_input_lists(list_files: list, base_dir: str) -> list[MonthJob]:
+    """
+    Build one job per input list inputs/<device>_longitudinal/YYYY-MM.txt.
+
+    Args:
+        list_files (list): Paths of per-month input lists.
+        base_dir (str): Base directory for longitudinal analysis outputs.
+
+    Returns:
+        list: Month jobs with at least one readable PCAP.
+    """
+    jobs = []
+    for list_file in list_files:
+        match = LIST_NAME_RE.match(os.path.basename(list_file))
+        if not match:
+            logger.warning(f"{list_file}: not a YYYY-MM.txt input list, skipping")
+            continue
+        device = os.path.basename(os.path.dirname(os.path.abspath(list_file)))
+        if device.endswith("_longitudinal"):
+            device = device[:-len("_longitudinal")]
+        year, month_num = match.groups()
+        device_pcap = read_pcap_list(list_file)
+        if not device_pcap:
+            logger.info(f"[{device}] No PCAPs for {year}-{month_num}, skipping")
+            continue
+        jobs.append(MonthJob(f"{device} {year}-{month_num}", f"{year}-{month_num}",
+                             month_output_dir(base_dir, device, year, month_num), device_pcap))
+    return jobs
+
+
+def jobs_from_catalog(db_path: str, devices: list, years: list, base_dir: str) -> list[MonthJob]:
+    """
+    Build one job per device-month found in the PCAP catalog.
+
+    Args:
+        db_path (str): Catalog database built by the `catalog` command.
+        devices (list): Device folder names.
+        years (list): Years to include (strings).
+        base_dir (str): Base directory for longitudinal analysis outputs.
+
+    Returns:
+        list: Month jobs.
+    """
+    jobs = []
+    for device in devices:
+        for month, rows in sorted(catalog_months(db_path, device, years).items()):
+            year, month_num = month.split("-")
+            device_pcap = defaultdict(list)
+            for path, _, dataset_device, *_ in rows:
+                device_pcap[dataset_device].append(path)
+            jobs.append(MonthJob(f"{device} {month}", month,
+                                 month_output_dir(base_dir, device, year, month_num), device_pcap))
+    return jobs
+
+
+def sample_jobs(jobs: list[MonthJob], fraction: float, seed=None) -> list[MonthJob]:
+    """
+    Replace each month's PCAPs by a stratified sample of them.
+
+    Sampled months write their outputs to <month output dir>/sample.
+
+    Args:
+        jobs (list): Month jobs.
+        fraction (float): Fraction of each device-month's PCAPs to keep.
+        seed: Seed making the sample reproducible (each month gets its own stream);
+            a random seed is drawn and recorded in discovery_estimate.json if None.
+
+    Returns:
+        list: Sampled month jobs.
+    """
+    if seed is None:
+        seed = str(random.randrange(1 << 32))
+    sampled_jobs = []
+    for job in jobs:
+        rng = random.Random(f"{seed}:{job.name}")
+        device_pcap = {device: stratified_sample(files, fraction, rng) for device, files in job.device_pcap.items()}
+        sampling = {"fraction": fraction, "seed": seed,
+                    "total_pcaps": sum(len(files) for files in job.device_pcap.values())}
+        sampled_jobs.append(MonthJob(job.name, job.month, os.path.join(job.output_dir, SAMPLE_DIR),
+                                     device_pcap, sampling))
+    return sampled_jobs
+
+
+def extract_pcap(pcap_file: str):
+    """Run both extraction passes (domains and IPs) over one PCAP."""
+    return extract_domains(pcap_file), extract_ips(pcap_file)
+
+
+def assemble_month(job: MonthJob, rollups: bool = False, passive_dns=None):
+    """
+    Write the domains and map_ips outputs of a completed month (translating with passive_dns as a fallback), and optionally its time rollups.
+
+    A month some of whose PCAPs failed is still written, but marked with
+    INCOMPLETE_FILE listing them.
+    """
+    domain_results, ip_results = {}, {}
+    for device, results in job.results.items():
+        results = [r for r in results if r is not None]
+        domain_results[device] = merge_domain_results(domains for domains, _ in results)
+        ips = set()
+        for _, ips_cur in results:
+            ips.update(ips_cur)
+        ip_results[device] = ips
+    save_domain_results(domain_results, job.output_dir)
+    save_ip_results(ip_results, job.output_dir, passive_dns, job.month)
+    if rollups:
+        device_rollups = {device: build_rollups(job.device_pcap[device], results)
+                          for device, results in job.results.items()}
+        save_rollups(job.output_dir, device_rollups)
+    if job.sampling:
+        results = [r for device_results in job.results.values() for r in device_results if r is not None]
+        save_discovery_estimate(job.output_dir, [domains[0] for domains, _ in results], [ips for _, ips in results],
+                                job.sampling["total_pcaps"], job.sampling["fraction"], job.sampling["seed"])
+    marker = os.path.join(job.output_dir, INCOMPLETE_FILE)
+    if job.failed:
+        total = sum(len(files) for files in job.device_pcap.values())
+        logger.warning(f"[{job.name}] {len(job.failed)} of {total} PCAPs failed, outputs are incomplete "
+                       f"(see {marker})")
+        with open(marker, 'w') as f:
+            json.dump({"failed_pcaps": job.failed, "total_pcaps": total}, f, indent=4)
+    elif os.path.exists(marker):
+        os.remove(marker)
+    logger.info(f"[{job.name}] outputs written to {job.output_dir}")
+
+
+def run_schedule(jobs: list[MonthJob], workers: int = None, index_db: str = None, rollups: bool = False,
+                 passive_dns=None):
+    """
+    Extract every PCAP of every job on one worker pool, largest file first.
+
+    Work is not split by month, so workers stay busy across month boundaries;
+    a month is assembled as soon as its last PCAP completes. Results within
+    a device are merged in input order, so the outputs are the same as
+    running `domains` and `map_ips` on each month's list. The run's
+    throughput is added to this host's history for `plan`.
+
+    Args:
+        jobs (list): Month jobs to run.
+        workers (int): Worker threads (default: number of CPUs).
+        index_db (str): Destination index to update with each assembled month.
+        rollups (bool): Also write hourly, daily and monthly destination sets of each month.
+        passive_dns (PassiveDns): Index translating the IPs a month's own DNS/TLS data misses.
+    """
+    workers = workers or os.cpu_count()
+    tasks = []
+    for job in jobs:
+        for device, files in job.device_pcap.items():
+            for i, pcap_file in enumerate(files):
+                try:
+                    size = os.path.getsize(pcap_file)
+                except OSError:
+                    size = 0
+                tasks.append((size, job, device, i, pcap_file))
+    tasks.sort(key=lambda t: t[0], reverse=True)
+    total_bytes = sum(t[0] for t in tasks)
+    logger.info(f"Scheduling {len(tasks)} PCAPs ({total_bytes / 1e9:.2f} GB) from {len(jobs)} months on {workers} workers")
+
+    done = 0
+    start, started_at = time.perf_counter(), time.time()
+    # Completion time of every extraction, taken in the worker: the main
+    # loop may reach a finished future only after assembling earlier months
+    finished = []
+    assemble_s = 0.0
+    task = profiled(extract_pcap, "extraction")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(task, pcap_file): (job, device, i, pcap_file)
+                   for _, job, device, i, pcap_file in tasks}
+        for future in futures:
+            future.add_done_callback(lambda _: finished.append(time.perf_counter()))
+        for future in concurrent.futures.as_completed(futures):
+            # Drop our reference so finished months can be freed
+            job, device, i, pcap_file = futures.pop(future)
+            try:
+                job.results[device][i] = future.result()
+            except Exception as e:
+                logger.error(f"Error processing {pcap_file}: {e}")
+                job.failed.append(pcap_file)
+            job.remaining -= 1
+            done += 1
+            if job.remaining == 0:
+                logger.info(f"[{job.name}] last PCAP done ({done}/{len(tasks)} overall), assembling month")
+                assemble_start = time.perf_counter()
+                try:
+                    assemble_month(job, rollups, passive_dns)
+                    # Partial outputs (a sampled month, or one with failed PCAPs) are not indexed
+                    if index_db and not job.sampling and not job.failed:
+                        index_month(index_db, job.output_dir)
+                except Exception as e:
+                    logger.error(f"Error assembling {job.name}: {e}")
+                assemble_s += time.perf_counter() - assemble_start
+                job.results = None
+
+    extraction_s = max(finished) - start if finished else 0.0
+    # Only what this run wrote: month dirs also hold party outputs, rollups and earlier runs
+    record_throughput("schedule", [t[0] for t in tasks], workers, {"extraction": extraction_s, "assemble": assemble_s},
+                      sum(dir_size(job.output_dir, started_at) for job in jobs), get_extract_profile())
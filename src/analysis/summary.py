@@ -0,0 +1,87 @@
+import os
+import json
+import logging
+import concurrent.futures
+from src.analysis.scheduler import MonthJob, extract_pcap
+from src.analysis.sketches import DestinationSummary
+from src.parsers.dns_tls_extractor import extract_sld
+from src.profiling import profile_stage, profiled
+
+logger = logging.getLogger(__name__)
+
+SKETCH_FILE = "destination_sketch.json"
+REPORT_FILE = "destination_summary.json"
+
+
+def save_summary(summary: DestinationSummary, sketch_file: str, top: int = 20):
+    """Write a summary's sketches and, next to them, its readable report."""
+    if os.path.dirname(sketch_file):
+        os.makedirs(os.path.dirname(sketch_file), exist_ok=True)
+    with open(sketch_file, 'w') as f:
+        json.dump(summary.to_dict(), f)
+    report_file = os.path.join(os.path.dirname(sketch_file), REPORT_FILE)
+    with open(report_file, 'w') as f:
+        json.dump(summary.report(top), f, indent=4)
+
+
+def run_summary(jobs: list[MonthJob], workers: int = None, precision: int = 12, k: int = 100, top: int = 20):
+    """
+    Summarize every job's PCAPs into fixed-memory sketches instead of exact sets.
+
+    Each PCAP's destinations are folded into its month's DestinationSummary
+    as soon as it is extracted and then dropped, so memory does not grow
+    with traffic volume. A month's summary is written to
+    <output_dir>/summary/destination_sketch.json (mergeable) and
+    destination_summary.json (distinct counts and top destinations) when its
+    last PCAP is done.
+
+    Args:
+        jobs (list): Month jobs, as built for `schedule`.
+        workers (int): Worker threads (default: number of CPUs).
+        precision (int): HyperLogLog precision (2**precision registers).
+        k (int): Items kept by each Space-Saving summary.
+        top (int): Top destinations listed in the report.
+    """
+    summaries = {id(job): DestinationSummary(precision, k) for job in jobs}
+    task = profiled(extract_pcap, "extraction")
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count()) as executor:
+        futures = {executor.submit(task, pcap_file): job
+                   for job in jobs for files in job.device_pcap.values() for pcap_file in files}
+        for future in concurrent.futures.as_completed(futures):
+            job = futures.pop(future)
+            try:
+                (domains, *_), ips = future.result()
+                summaries[id(job)].add_pcap(ips, domains, {extract_sld(domain) for domain in domains})
+            except Exception as e:
+                logger.error(f"Error summarizing a PCAP of {job.name}: {e}")
+            job.remaining -= 1
+            if job.remaining == 0:
+                summary = summaries.pop(id(job))
+                with profile_stage("save"):
+                    save_summary(summary, os.path.join(job.output_dir, "summary", SKETCH_FILE), top)
+                report = summary.report(0)
+                logger.info(f"[{job.name}] {report['pcaps']} PCAPs: ~{report['distinct_ips']} IPs, "
+                            f"~{report['distinct_domains']} domains, ~{report['distinct_slds']} SLDs")
+
+
+def merge_summaries(sketch_files: list, output_file: str, top: int = 20):
+    """
+    Merge sketches of several files, months or devices into one.
+
+    Args:
+        sketch_files (list): destination_sketch.json files.
+        output_file (str): Merged sketch path (the report is written next to it).
+        top (int): Top destinations listed in the report.
+    """
+    merged = None
+    for sketch_file in sketch_files:
+        with open(sketch_file, 'r') as f:
+            summary = DestinationSummary.from_dict(json.load(f))
+        merged = summary if merged is None else merged.merge(summary)
+    if merged is None:
+        logger.error("No sketches to merge")
+        return
+    save_summary(merged, output_file, top)
+    report = merged.report(0)
+    logger.info(f"Merged {len(sketch_files)} sketches ({report['pcaps']} PCAPs): ~{report['distinct_ips']} IPs, "
+                f"~{report['distinct_domains']} domains, ~{report['distinct_slds']} SLDs -> {output_file}")
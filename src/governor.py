@@ -0,0 +1,196 @@
+import os
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+# Share of the available memory extraction may plan to use
+MEMORY_HEADROOM = 0.8
+# Prior for a pipeline that has not been measured yet: tshark keeps
+# per-frame state, so its RSS grows with the capture it reads
+MIN_PIPELINE_MB = 100.0
+PRIOR_MB_PER_MB = 2.0
+# Smaller captures say little about how memory grows with size
+LEARN_MIN_MB = 32
+# How often running pipelines are measured (and throttled tasks look again)
+POLL_SECONDS = 0.5
+
+try:
+    _PAGE_MB = os.sysconf("SC_PAGE_SIZE") / (1 << 20)
+except (ValueError, OSError, AttributeError):
+    _PAGE_MB = 4096 / (1 << 20)
+
+
+def available_memory_mb() -> float:
+    """MemAvailable from /proc/meminfo, or the physical memory where it is not available."""
+    try:
+        with open("/proc/meminfo", 'r') as f:
+            for line in f:
+                if line.startswith("MemAvailable:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES") / (1 << 20)
+    except (ValueError, OSError, AttributeError):
+        return 0.0
+
+
+def process_rss_mb(pid: int) -> float:
+    """Current RSS of a process from /proc/<pid>/statm, 0 once it has exited (or without /proc)."""
+    try:
+        with open(f"/proc/{pid}/statm", 'r') as f:
+            return int(f.read().split()[1]) * _PAGE_MB
+    except (OSError, ValueError, IndexError):
+        return 0.0
+
+
+class PipelineTask:
+    """One admitted extraction pipeline (decompressor, prefilter, tshark) and its memory."""
+
+    def __init__(self, label: str, size_mb: float, estimate_mb: float):
+        self.label = label
+        self.size_mb = size_mb
+        self.estimate_mb = estimate_mb
+        self.pids = []
+        self.rss_mb = 0.0
+        self.peak_mb = 0.0
+
+    def measure(self) -> float:
+        """Sample the RSS of the pipeline's processes."""
+        self.rss_mb = sum(process_rss_mb(pid) for pid in self.pids)
+        self.peak_mb = max(self.peak_mb, self.rss_mb)
+        return self.rss_mb
+
+
+class MemoryGovernor:
+    """
+    Admit tshark pipelines only while their memory fits.
+
+    A new pipeline is estimated from its capture size (a prior until
+    pipelines have been measured, then the largest RSS per MB seen). It is
+    admitted when, on top of the running pipelines (each counted at the
+    larger of its estimate and its measured RSS), it stays within
+    max_mb, and when it plus the growth the running pipelines still have
+    ahead fit in the share `headroom` of the memory available on the host.
+    One pipeline always runs, however large, so work never stalls.
+
+    While pipelines run, a monitor thread samples their RSS every
+    POLL_SECONDS: once a process has hit the end of its output it may
+    already be a zombie with no memory to read, so its peak has to be
+    caught while it works.
+
+    A pipeline released as idle (a pooled sharkd session, which keeps its
+    last capture's state) still counts toward max_mb at its measured RSS
+    until it is discarded.
+    """
+
+    def __init__(self, max_mb: float = None, headroom: float = MEMORY_HEADROOM):
+        self.max_mb = max_mb
+        self.headroom = headroom
+        self.mb_per_mb = None
+        self.active = []
+        self.idle = []
+        self.throttled = 0
+        self.throttled_s = 0.0
+        self._condition = threading.Condition()
+        self._monitor = None
+
+    def estimate_mb(self, size_mb: float) -> float:
+        """Expected peak RSS of a pipeline reading size_mb MB of capture."""
+        ratio = PRIOR_MB_PER_MB if self.mb_per_mb is None else self.mb_per_mb
+        return MIN_PIPELINE_MB + ratio * size_mb
+
+    def _sample(self):
+        """Measure the running pipelines until none is left."""
+        with self._condition:
+            while self.active:
+                for task in self.active:
+                    task.measure()
+                self._condition.wait(POLL_SECONDS)
+            self._monitor = None
+
+    def _blocked(self, estimate_mb: float):
+        """Why a pipeline of estimate_mb cannot start now, or None if it can."""
+        if not self.active:
+            return None
+        for task in self.active:
+            task.measure()
+        for task in self.idle:
+            task.measure()
+        committed = (sum(max(task.estimate_mb, task.rss_mb) for task in self.active)
+                     + sum(task.rss_mb for task in self.idle))
+        if self.max_mb and committed + estimate_mb > self.max_mb:
+            return f"{committed:.0f} of {self.max_mb:.0f} MB committed"
+        growth = sum(max(0.0, task.estimate_mb - task.rss_mb) for task in self.active)
+        available = available_memory_mb()
+        if available and estimate_mb + growth > available * self.headroom:
+            return f"{available:.0f} MB available, {growth:.0f} MB reserved for running pipelines"
+        return None
+
+    def admit(self, label: str, size_bytes: int) -> PipelineTask:
+        """Block until a pipeline reading size_bytes of capture fits, then register it."""
+        size_mb = size_bytes / (1 << 20)
+        with self._condition:
+            task = PipelineTask(label, size_mb, self.estimate_mb(size_mb))
+            reason = self._blocked(task.estimate_mb)
+            if reason is not None:
+                logger.info(f"Throttling {label}: needs ~{task.estimate_mb:.0f} MB, {reason} "
+                            f"({len(self.active)} pipelines running)")
+                start = time.perf_counter()
+                while reason is not None:
+                    self._condition.wait(POLL_SECONDS)
+                    reason = self._blocked(task.estimate_mb)
+                waited = time.perf_counter() - start
+                self.throttled += 1
+                self.throttled_s += waited
+                logger.info(f"Admitted {label} after {waited:.1f}s")
+            if self.max_mb and task.estimate_mb > self.max_mb:
+                logger.warning(f"{label}: expected to need ~{task.estimate_mb:.0f} MB, more than the "
+                               f"{self.max_mb:.0f} MB limit; running it alone")
+            self.active.append(task)
+            if self._monitor is None:
+                self._monitor = threading.Thread(target=self._sample, name="governor-monitor", daemon=True)
+                self._monitor.start()
+        return task
+
+    def release(self, task: PipelineTask, idle: bool = False):
+        """Unregister a finished pipeline, learning from its peak RSS; an idle one stays counted until discard()."""
+        with self._condition:
+            self.active.remove(task)
+            if task.size_mb >= LEARN_MIN_MB and task.peak_mb > 0:
+                ratio = max(0.0, task.peak_mb - MIN_PIPELINE_MB) / task.size_mb
+                self.mb_per_mb = ratio if self.mb_per_mb is None else max(self.mb_per_mb, ratio)
+            if idle:
+                self.idle.append(task)
+            self._condition.notify_all()
+
+    def discard(self, task: PipelineTask):
+        """Stop counting an idle pipeline (its process was reused or has exited)."""
+        with self._condition:
+            if task in self.idle:
+                self.idle.remove(task)
+                self._condition.notify_all()
+
+
+_governor = MemoryGovernor()
+
+
+def set_memory_limit(max_mb: float = None, headroom: float = MEMORY_HEADROOM):
+    """
+    Configure the extraction memory governor of this process.
+
+    Args:
+        max_mb (float): Memory the running tshark pipelines may use together, in MB (default: no fixed limit).
+        headroom (float): Share of the host's available memory they may plan to use.
+    """
+    global _governor
+    if max_mb is not None and max_mb <= 0:
+        raise ValueError(f"Memory limit must be positive, got {max_mb}")
+    _governor = MemoryGovernor(max_mb, headroom)
+
+
+def get_governor() -> MemoryGovernor:
+    """The extraction memory governor of this process."""
+    return _governor
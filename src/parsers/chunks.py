@@ -0,0 +1,128 @@
+import os
+import mmap
+import struct
+import logging
+import concurrent.futures
+from src.parsers.tshark import compression_suffix
+
+logger = logging.getLogger(__name__)
+
+# Classic pcap: a 24-byte global header, then records of a 16-byte header
+# (ts_sec, ts_frac, incl_len, orig_len) and incl_len bytes of packet data.
+# The magic gives the byte order (and micro/nanosecond timestamps).
+PCAP_HEADER_SIZE = 24
+RECORD_HEADER_SIZE = 16
+PCAP_MAGICS = {
+    b"\xd4\xc3\xb2\xa1": "<", b"\x4d\x3c\xb2\xa1": "<",
+    b"\xa1\xb2\xc3\xd4": ">", b"\xa1\xb2\x3c\x4d": ">",
+}
+
+# Intra-file parallelism, off unless set_chunking is called. One pool is
+# shared by every PCAP, so concurrent files don't multiply the tshark runs.
+_chunk_bytes = None
+_chunk_pool = None
+
+
+def set_chunking(chunk_mb: int, workers: int = None):
+    """
+    Split captures larger than two chunks of chunk_mb MB and extract the chunks in parallel, for this process.
+
+    Args:
+        chunk_mb (int): Chunk size in MB.
+        workers (int): tshark runs over chunks at once, across all files (default: number of CPUs).
+    """
+    global _chunk_bytes, _chunk_pool
+    if chunk_mb <= 0:
+        raise ValueError(f"Chunk size must be positive, got {chunk_mb}")
+    _chunk_bytes = chunk_mb << 20
+    _chunk_pool = concurrent.futures.ThreadPoolExecutor(max_workers=workers or os.cpu_count(),
+                                                        thread_name_prefix="chunk")
+
+
+def split_pcap(pcap_file: str, chunk_bytes: int):
+    """
+    Cut a classic pcap file into byte ranges of whole records, about chunk_bytes each.
+
+    Only the record headers are read (through mmap), to step from one
+    record to the next. Compressed and pcapng captures cannot be cut this
+    way and return None.
+
+    Args:
+        pcap_file (str): Capture file path.
+        chunk_bytes (int): Target chunk size in bytes.
+
+    Returns:
+        list: (start, end) byte offsets of each chunk, in file order, or None.
+    """
+    if compression_suffix(pcap_file) is not None:
+        return None
+    size = os.path.getsize(pcap_file)
+    with open(pcap_file, 'rb') as f:
+        byte_order = PCAP_MAGICS.get(f.read(4))
+        if byte_order is None or size <= PCAP_HEADER_SIZE:
+            return None
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as data:
+            incl_len = struct.Struct(byte_order + "8xI4x").unpack_from
+            chunks = []
+            start = offset = PCAP_HEADER_SIZE
+            target = start + chunk_bytes
+            while offset + RECORD_HEADER_SIZE <= size:
+                if offset >= target:
+                    chunks.append((start, offset))
+                    start, target = offset, offset + chunk_bytes
+                offset += RECORD_HEADER_SIZE + incl_len(data, offset)[0]
+    # A truncated last record stays in the last chunk, as tshark would read it from the whole file
+    chunks.append((start, size))
+    return chunks
+
+
+class _ChunkReader:
+    """File object reading a capture's global header followed by one chunk of its records."""
+
+    def __init__(self, pcap_file: str, chunk: tuple):
+        self.file = open(pcap_file, 'rb')
+        self.header = self.file.read(PCAP_HEADER_SIZE)
+        self.file.seek(chunk[0])
+        self.remaining = chunk[1] - chunk[0]
+
+    def read(self, size: int = -1) -> bytes:
+        if self.header:
+            data, self.header = self.header, b""
+            return data
+        if size < 0 or size > self.remaining:
+            size = self.remaining
+        data = self.file.read(size)
+        self.remaining -= len(data)
+        return data
+
+    def close(self):
+        self.file.close()
+
+
+def open_chunk(pcap_file: str, chunk: tuple):
+    """Open one chunk of split_pcap as a standalone pcap stream (for stream_tshark's source)."""
+    return _ChunkReader(pcap_file, chunk)
+
+
+def map_chunks(pcap_file: str, extract):
+    """
+    Run extract(pcap_file, chunk=...) over the chunks of a large capture in parallel.
+
+    Args:
+        pcap_file (str): Capture file path.
+        extract (callable): Extraction function taking a chunk keyword argument.
+
+    Returns:
+        list: extract's results in file (capture) order, or None when
+            chunking is off, the file is smaller than two chunks, or it
+            cannot be split (see split_pcap).
+    """
+    if _chunk_bytes is None or os.path.getsize(pcap_file) < 2 * _chunk_bytes:
+        return None
+    chunks = split_pcap(pcap_file, _chunk_bytes)
+    if chunks is None:
+        logger.debug(f"{pcap_file}: not a classic pcap file, extracted without chunking")
+        return None
+    logger.debug(f"{pcap_file}: extracting {len(chunks)} chunks in parallel")
+    futures = [_chunk_pool.submit(extract, pcap_file, chunk=chunk) for chunk in chunks]
+    return [future.result() for future in futures]
@@ -1,70 +1,146 @@
-from src.utils import *
+import logging
+from src.utils import ipv6_ip_block
+from src.parsers.records import dns_answers, tls_observations, SniObservation
+from src.parsers.chunks import map_chunks
 logger = logging.getLogger(__name__)
 
+# tldextract (and its public-suffix list) is loaded on the first SLD lookup,
+# not at import time, so subcommands that never split domains don't pay for it
+_tld_extract = None
+
 def extract_sld(domain):
+    global _tld_extract
+    if _tld_extract is None:
+        import tldextract
+        _tld_extract = tldextract.extract
     # no_fetch_extract = tldextract.TLDExtract(suffix_list_urls=("https://raw.github.com/mozilla/gecko-dev/master/netwerk/dns/effective_tld_names.dat"))
     # no_cache_extract = tldextract.TLDExtract(cache_dir=False)
-    ext = tldextract.extract(domain)
+    ext = _tld_extract(domain)
     # ext = no_cache_extract(domain)
     # if ext.suffix is None:
     #     return None
     return f"{ext.domain}.{ext.suffix}"
 
-def extract_domains(pcap_file:str)->tuple[set[str], set[str], dict[str, str], dict[str, str]]:
-    # unique_slds = set()
+# cryptography is only imported when a capture contains a certificate; None once found missing
+_x509 = None
+
+def certificate_info(der: bytes):
+    """
+    Read the subject organization, issuer and SAN DNS names of a DER certificate.
+
+    Returns:
+        dict: {"organization", "issuer", "san"}, or None if the certificate
+        cannot be parsed or the cryptography package is not installed.
+    """
+    global _x509
+    if _x509 is None:
+        try:
+            from cryptography import x509
+            _x509 = x509
+        except ImportError:
+            logger.warning("cryptography is not installed: TLS certificates are not parsed")
+            _x509 = False
+    if not _x509:
+        return None
+    try:
+        cert = _x509.load_der_x509_certificate(der)
+        orgs = cert.subject.get_attributes_for_oid(_x509.NameOID.ORGANIZATION_NAME)
+        issuer_orgs = cert.issuer.get_attributes_for_oid(_x509.NameOID.ORGANIZATION_NAME)
+        try:
+            san = cert.extensions.get_extension_for_class(_x509.SubjectAlternativeName).value.get_values_for_type(_x509.DNSName)
+        except _x509.ExtensionNotFound:
+            san = []
+    except Exception as e:
+        logger.debug(f"Unreadable certificate: {e}")
+        return None
+    return {
+        "organization": orgs[0].value if orgs else None,
+        "issuer": issuer_orgs[0].value if issuer_orgs else cert.issuer.rfc4514_string(),
+        "san": [name.lower() for name in san],
+    }
+
+def _extract_domain_parts(pcap_file:str, consumers=(), chunk=None)->tuple[set[str], dict[str, str], dict[str, str], dict[str, dict]]:
+    """Domains, DNS IP -> domain map, TLS IP -> domain map and certificate info of a capture (or one chunk of it)."""
     domain_list = set()
-    ip_domain_map = {}
-    # sld_ip_map = {}
-    
+    dns_map, sni_map = {}, {}
+    cert_info = {"domains": {}, "ips": {}}
+
     # Extract domain names from DNS queries
-    dns_output = os.popen(f"tshark -r {pcap_file} -Y \"dns.flags.response==1 && not mdns\" -T fields -e dns.qry.name -e dns.qry.type -e dns.a -e dns.aaaa").read()
-    hosts = dns_output.splitlines()
-    for line in hosts:
-        line = line.split("\t")
-        if len(line) < 4:
-            continue
+    for answer in dns_answers(pcap_file, chunk):
+        for consumer in consumers:
+            consumer(answer)
+        domain = answer.domain
         # Local traffic filtering
-        if line[0].startswith('192.168.') or line[0].startswith(ipv6_ip_block) or '.arpa' in line[0] or '.local' in line[0] or 'moniotr' in line[0] or line[0] == 'local':
+        if domain.startswith('192.168.') or domain.startswith(ipv6_ip_block) or '.arpa' in domain or '.local' in domain or 'moniotr' in domain or domain == 'local':
             continue
-        domain = line[0].lower()
-        dns_type = line[1]
-        ips = line[3].split(",") if dns_type == '28' else line[2].split(",")
-        if domain and domain[-1] == '.':
-            domain = domain[:-1]
-        # sld = extract_sld(domain)
-        # if not sld:
-        #     continue
-            
         domain_list.add(domain)
-        # unique_slds.add(sld)
-        for ip in ips:
-            if len(ip) == 0:
-                # logger.debug(f"Empty IP for domain: {domain}")
+        for ip in answer.ips:
+            dns_map[ip] = domain
+
+    # Extract domain names (and server certificates) from TLS handshake
+    stream_sni, parsed = {}, {}
+    for record in tls_observations(pcap_file, chunk):
+        for consumer in consumers:
+            consumer(record)
+        if isinstance(record, SniObservation):
+            if record.dst_ip.startswith('192.168.') or 'in-addr.arpa' in record.dst_ip or '.local' in record.dst_ip:
                 continue
-            ip_domain_map[ip] = domain
-            # sld_ip_map[ip] = sld
-    
-    # Extract domain names from TLS handshake
-    tls_output = os.popen(f"tshark -r {pcap_file} -Y \"tls.handshake.extensions_server_name\" -T fields -e tls.handshake.extensions_server_name -e ip.dst").read()
-    tls_hosts = tls_output.splitlines()
-    for line in tls_hosts:
-        line = line.split("\t")
-        if len(line) < 2:
+            domain_list.add(record.server_name)
+            sni_map[record.dst_ip] = record.server_name
+            stream_sni[record.stream] = record.server_name
             continue
-        if line[1].startswith('192.168.') or 'in-addr.arpa' in line[1] or '.local' in line[1]:
+        if record.server_ip.startswith('192.168.'):
             continue
-        domain = line[0].lower()
-        if domain and domain[-1] == '.':
-            domain = domain[:-1]
-        ip = line[1]
-        
-        # sld = extract_sld(domain)
-        # unique_slds.add(sld)
-        domain_list.add(domain)
-        # for ip in ips:
-        ip_domain_map[ip] = domain
-            # sld_ip_map[ip] = sld
-        
-        
-    
-    return domain_list, ip_domain_map
+        # Devices reconnect to the same servers all the time: parse each certificate once
+        if record.der not in parsed:
+            parsed[record.der] = certificate_info(record.der)
+        info = parsed[record.der]
+        if info is None:
+            continue
+        if record.server_ip:
+            cert_info["ips"][record.server_ip] = info
+        if record.stream in stream_sni:
+            cert_info["domains"][stream_sni[record.stream]] = info
+
+    return domain_list, dns_map, sni_map, cert_info
+
+def extract_domains(pcap_file:str, consumers=())->tuple[set[str], dict[str, str], dict[str, dict]]:
+    """
+    Extract the domains contacted in a PCAP, the IP each one resolved to,
+    and the server certificates seen for them.
+
+    Built on the dns_answers and tls_observations record streams: DNS
+    responses are read first, then TLS server names, which override the DNS
+    mapping for the same IP. Certificates sent in clear text (TLS 1.2 and
+    older) are attributed to the SNI of their connection and to the server IP.
+
+    With chunking on (see chunks.set_chunking), a large capture is extracted
+    chunk by chunk in parallel. The DNS and TLS maps of the chunks are each
+    merged in capture order before TLS overrides DNS, so the IP -> domain
+    map is the one a single pass gives (only a handshake cut by a chunk
+    boundary can lose its certificate's SNI).
+
+    Args:
+        pcap_file (str): Capture file path.
+        consumers (iterable): Callables receiving every DnsAnswer, SniObservation
+            and ServerCertificate of the pass (before local-traffic filtering).
+            Records are only delivered in order without chunking, so passing
+            consumers disables it.
+
+    Returns:
+        tuple: Set of domains, IP -> domain map, and certificate info
+            {"domains": {sni: info}, "ips": {ip: info}} (see certificate_info).
+    """
+    parts = None if consumers else map_chunks(pcap_file, _extract_domain_parts)
+    if parts is None:
+        parts = [_extract_domain_parts(pcap_file, consumers)]
+    domain_list, ip_domain_map, sni_map = set(), {}, {}
+    cert_info = {"domains": {}, "ips": {}}
+    for domain_list_cur, dns_map_cur, sni_map_cur, cert_info_cur in parts:
+        domain_list.update(domain_list_cur)
+        ip_domain_map.update(dns_map_cur)
+        sni_map.update(sni_map_cur)
+        cert_info["domains"].update(cert_info_cur["domains"])
+        cert_info["ips"].update(cert_info_cur["ips"])
+    ip_domain_map.update(sni_map)
+    return domain_list, ip_domain_map, cert_info
@@ -1,29 +1,40 @@
-from src.utils import *
+import logging
+from src.utils import is_valid_ip, is_local_address
+from src.parsers.records import ip_endpoints
+from src.parsers.chunks import map_chunks
 logger = logging.getLogger(__name__)
 
-def extract_ips(in_pcap):
-    """
-    Extract all unique IP addresses from a PCAP file.
-    """
+def _extract_chunk_ips(in_pcap, consumers=(), chunk=None):
     all_ips = set()
 
-    # Use tshark to extract all IP addresses from the IP layer
-    ip_lines = str(os.popen(f"tshark -r {in_pcap} -Y \"ip\" -T fields -e ip.src -e ip.dst").read()).splitlines()
-
-    for line in ip_lines:
-        line = line.split("\t")
-        if len(line) < 2:
-            continue
-        src_ip = line[0]
-        dst_ip = line[1]
-        if not is_valid_ip(src_ip) or not is_valid_ip(dst_ip):
+    # Stream the IP layer source/destination of every packet
+    for endpoint in ip_endpoints(in_pcap, chunk):
+        for consumer in consumers:
+            consumer(endpoint)
+        if not is_valid_ip(endpoint.src) or not is_valid_ip(endpoint.dst):
             continue
-        if not is_local_address(src_ip):
-            all_ips.add(src_ip)
-        if not is_local_address(dst_ip):
-            all_ips.add(dst_ip)
+        if not is_local_address(endpoint.src):
+            all_ips.add(endpoint.src)
+        if not is_local_address(endpoint.dst):
+            all_ips.add(endpoint.dst)
     return all_ips
 
+def extract_ips(in_pcap, consumers=()):
+    """
+    Extract all unique IP addresses from a PCAP file.
+
+    With chunking on (see chunks.set_chunking), a large capture is read
+    chunk by chunk in parallel and the chunks' IPs are united.
+
+    Args:
+        in_pcap (str): Capture file path.
+        consumers (iterable): Callables receiving every IpEndpoint of the pass (disables chunking).
+    """
+    parts = None if consumers else map_chunks(in_pcap, _extract_chunk_ips)
+    if parts is None:
+        return _extract_chunk_ips(in_pcap, consumers)
+    return set().union(*parts)
+
 def process_pcap_ips(device_name: str, pcap_files: list) -> set:
     """
     Extract all IPs from PCAP files for a single device.
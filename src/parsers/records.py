@@ -0,0 +1,154 @@
+import time
+from typing import NamedTuple
+from src.parsers.tshark import stream_tshark
+from src.parsers.chunks import open_chunk
+from src.profiling import record_pcap_timing
+
+# Fast extraction profile: only DNS and TLS (HTTPS, MQTT over TLS) packets, dissected with dns/tls only
+DNS_TLS_PREFILTER = "udp port 53 or tcp port 53 or tcp port 443 or tcp port 8883"
+DNS_TLS_PROTOCOLS = ["ip", "ipv6", "udp", "tcp", "dns", "tls"]
+DNS_TLS_PREFERENCES = ["tcp.analyze_sequence_numbers:FALSE", "tcp.calculate_timestamps:FALSE",
+                       "tls.desegment_ssl_application_data:FALSE"]
+
+# Fast extraction profile: IPv4 headers only, no transport dissection or reassembly
+IP_PREFILTER = "ip"
+IP_PROTOCOLS = ["ip"]
+IP_PREFERENCES = ["ip.defragment:FALSE"]
+
+
+class DnsAnswer(NamedTuple):
+    """A DNS response: queried name (lowercase, no trailing dot), query type and answer addresses."""
+    ts: float
+    domain: str
+    qtype: str
+    ips: tuple
+
+
+class SniObservation(NamedTuple):
+    """A TLS ClientHello server name and the destination IPv4 address ('' over IPv6)."""
+    ts: float
+    stream: str
+    server_name: str
+    dst_ip: str
+
+
+class ServerCertificate(NamedTuple):
+    """The leaf certificate (DER) a server sent in clear text (TLS 1.2 and older), and the server's IPv4 address."""
+    ts: float
+    stream: str
+    server_ip: str
+    der: bytes
+
+
+class IpEndpoint(NamedTuple):
+    """The source and destination of an IPv4 packet."""
+    ts: float
+    src: str
+    dst: str
+
+
+def _timestamp(field: str) -> float:
+    try:
+        return float(field)
+    except ValueError:
+        return 0.0
+
+
+def _normalize_domain(name: str) -> str:
+    domain = name.lower()
+    if domain and domain[-1] == '.':
+        domain = domain[:-1]
+    return domain
+
+
+def _timed_lines(pcap_file: str, pass_name: str, lines):
+    """Pass lines through, recording time spent waiting on tshark vs processing records."""
+    start = time.perf_counter()
+    waited = 0.0
+    lines = iter(lines)
+    while True:
+        before = time.perf_counter()
+        line = next(lines, None)
+        waited += time.perf_counter() - before
+        if line is None:
+            break
+        yield line
+    record_pcap_timing(pcap_file, pass_name, waited, time.perf_counter() - start - waited)
+
+
+def _chunk_source(pcap_file: str, chunk: tuple):
+    """(stream_tshark source, timing label) of a whole capture or of one chunk of it."""
+    if chunk is None:
+        return None, pcap_file
+    return open_chunk(pcap_file, chunk), f"{pcap_file}@{chunk[0]}"
+
+
+def dns_answers(pcap_file: str, chunk: tuple = None):
+    """
+    Yield a DnsAnswer for every DNS response (mDNS excluded) in a capture.
+
+    Only the addresses matching the query type are kept: AAAA answers for
+    type 28 queries, A answers otherwise. With a chunk (see chunks.split_pcap)
+    only that byte range of the capture is read.
+    """
+    source, label = _chunk_source(pcap_file, chunk)
+    lines = stream_tshark(pcap_file, ["-Y", "dns.flags.response==1 && not mdns", "-T", "fields", "-e", "frame.time_epoch",
+                                      "-e", "dns.qry.name", "-e", "dns.qry.type", "-e", "dns.a", "-e", "dns.aaaa"],
+                          DNS_TLS_PREFILTER, DNS_TLS_PROTOCOLS, DNS_TLS_PREFERENCES, source)
+    for line in _timed_lines(label, "dns", lines):
+        line = line.split("\t")
+        if len(line) < 5:
+            continue
+        ips = line[4] if line[2] == '28' else line[3]
+        yield DnsAnswer(_timestamp(line[0]), _normalize_domain(line[1]), line[2],
+                        tuple(ip for ip in ips.split(",") if ip))
+
+
+def tls_observations(pcap_file: str, chunk: tuple = None):
+    """
+    Yield the TLS handshake records of a capture in one pass.
+
+    A SniObservation for every ClientHello carrying a server name, and a
+    ServerCertificate for every Certificate message in clear text. Both
+    carry the TCP stream index, so a certificate can be matched to the SNI
+    of its connection (stream indexes restart in every chunk).
+    """
+    source, label = _chunk_source(pcap_file, chunk)
+    lines = stream_tshark(pcap_file, ["-Y", "tls.handshake.extensions_server_name || tls.handshake.certificate",
+                                      "-T", "fields", "-e", "frame.time_epoch", "-e", "tcp.stream",
+                                      "-e", "tls.handshake.extensions_server_name", "-e", "ip.dst",
+                                      "-e", "ip.src", "-e", "tls.handshake.certificate"],
+                          DNS_TLS_PREFILTER, DNS_TLS_PROTOCOLS, DNS_TLS_PREFERENCES, source)
+    for line in _timed_lines(label, "tls", lines):
+        line = line.split("\t")
+        if len(line) < 6:
+            continue
+        if line[2]:
+            yield SniObservation(_timestamp(line[0]), line[1], _normalize_domain(line[2]), line[3])
+        if line[5]:
+            # The chain is comma separated, the server's own certificate first; older tshark prints bytes as aa:bb:..
+            leaf = line[5].split(",")[0].replace(":", "")
+            try:
+                der = bytes.fromhex(leaf)
+            except ValueError:
+                continue
+            yield ServerCertificate(_timestamp(line[0]), line[1], line[4], der)
+
+
+def sni_observations(pcap_file: str, chunk: tuple = None):
+    """Yield a SniObservation for every TLS handshake carrying a server name."""
+    for record in tls_observations(pcap_file, chunk):
+        if isinstance(record, SniObservation):
+            yield record
+
+
+def ip_endpoints(pcap_file: str, chunk: tuple = None):
+    """Yield an IpEndpoint for every IPv4 packet in a capture (or one chunk of it)."""
+    source, label = _chunk_source(pcap_file, chunk)
+    lines = stream_tshark(pcap_file, ["-Y", "ip", "-T", "fields", "-e", "frame.time_epoch", "-e", "ip.src", "-e", "ip.dst"],
+                          IP_PREFILTER, IP_PROTOCOLS, IP_PREFERENCES, source)
+    for line in _timed_lines(label, "ip", lines):
+        line = line.split("\t")
+        if len(line) < 3:
+            continue
+        yield IpEndpoint(_timestamp(line[0]), line[1], line[2])
@@ -0,0 +1,261 @@
+import os
+import json
+import queue
+import atexit
+import logging
+import threading
+from src.governor import get_governor
+
+logger = logging.getLogger(__name__)
+
+# Matching frames fetched per request, so a large capture never makes one huge reply
+FRAMES_PAGE = 20000
+# Columns are cut to a display length; these fields are read in full from
+# the frame's protocol tree instead (only for the frames that carry them)
+FULL_VALUE_FIELDS = ("tls.handshake.certificate",)
+# Columns show these fields by name ("AAAA") where tshark -T fields prints
+# the value (28): each name is mapped back through the protocol tree once per session
+RAW_VALUE_FIELDS = ("dns.qry.type",)
+# Captures loaded into one session before it is replaced by a fresh one,
+# which bounds what a session can hold on to between loads
+MAX_LOADS = 200
+
+
+class SharkdError(Exception):
+    """sharkd answered a request with an error, or the session died."""
+
+
+class SharkdSession:
+    """
+    One long-lived `sharkd -` process, spoken to in JSON-RPC over its stdin/stdout.
+
+    Dissectors and plugins are loaded once when the process starts; every
+    capture is then loaded into the same process. Needs Wireshark 3.6 or
+    later (JSON-RPC sharkd).
+    """
+
+    def __init__(self):
+        import subprocess
+        self.process = subprocess.Popen(["sharkd", "-"], stdin=subprocess.PIPE, stdout=subprocess.PIPE,
+                                        stderr=subprocess.DEVNULL)
+        self.pid = self.process.pid
+        self.loads = 0
+        # (field, shown name) -> value, for RAW_VALUE_FIELDS
+        self.raw_values = {}
+        # Governor task of the last pass while the session sits idle in the pool,
+        # holding that capture's state
+        self.idle_task = None
+        self._next_id = 0
+
+    def call(self, method: str, params: dict = None):
+        """Send one request and return its result."""
+        self._next_id += 1
+        request = {"jsonrpc": "2.0", "id": self._next_id, "method": method}
+        if params:
+            request["params"] = params
+        try:
+            self.process.stdin.write(json.dumps(request).encode() + b"\n")
+            self.process.stdin.flush()
+            line = self.process.stdout.readline()
+        except (BrokenPipeError, OSError) as e:
+            raise SharkdError(f"sharkd session {self.pid} died: {e}")
+        if not line:
+            raise SharkdError(f"sharkd session {self.pid} exited")
+        reply = json.loads(line)
+        if "error" in reply:
+            raise SharkdError(f"{method}: {reply['error'].get('message', reply['error'])}")
+        return reply.get("result")
+
+    def close(self):
+        if self.idle_task is not None:
+            get_governor().discard(self.idle_task)
+            self.idle_task = None
+        try:
+            self.process.stdin.close()
+            self.process.wait(timeout=5)
+        except Exception:
+            self.process.kill()
+
+
+class SharkdPool:
+    """
+    At most `size` sharkd sessions, started on first use and reused by every extraction pass.
+
+    Args:
+        size (int): Sessions (and so captures dissected) at once (default: number of CPUs).
+    """
+
+    def __init__(self, size: int = None):
+        self.size = size or os.cpu_count()
+        self._idle = queue.LifoQueue()
+        self._slots = threading.Semaphore(self.size)
+        self.started = 0
+
+    def acquire(self) -> SharkdSession:
+        self._slots.acquire()
+        try:
+            return self._idle.get_nowait()
+        except queue.Empty:
+            pass
+        try:
+            session = SharkdSession()
+        except BaseException:
+            self._slots.release()
+            raise
+        self.started += 1
+        logger.debug(f"Started sharkd session {session.pid} ({self.started} so far)")
+        return session
+
+    def release(self, session: SharkdSession, broken: bool = False):
+        if broken or session.loads >= MAX_LOADS:
+            session.close()
+        else:
+            self._idle.put(session)
+        self._slots.release()
+
+    def close(self):
+        while True:
+            try:
+                self._idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+
+def fields_request(options: list):
+    """
+    (display filter, fields) of tshark options of the form [-Y filter] -T fields -e f1 -e f2 ...
+
+    Returns None for any other form, which sharkd does not serve.
+    """
+    display_filter, fields, i = "", [], 0
+    while i < len(options):
+        option = options[i]
+        if option in ("-Y", "-e") and i + 1 < len(options):
+            if option == "-Y":
+                display_filter = options[i + 1]
+            else:
+                fields.append(options[i + 1])
+            i += 2
+        elif option == "-T" and options[i + 1:i + 2] == ["fields"]:
+            i += 2
+        else:
+            return None
+    return (display_filter, fields) if fields else None
+
+
+def _tree_values(nodes: list, field: str, found: list = None) -> list:
+    """Values of a field in a sharkd protocol tree, in tree order, read from the nodes' filter expressions."""
+    found = [] if found is None else found
+    prefix = f"{field} == "
+    for node in nodes:
+        expression = node.get("f", "")
+        if expression.startswith(prefix):
+            found.append(expression[len(prefix):])
+        _tree_values(node.get("n", []), field, found)
+    return found
+
+
+def stream_fields(pool: SharkdPool, pcap_file: str, display_filter: str, fields: list):
+    """
+    Load a capture into a pooled sharkd session and yield its fields as tshark -T fields lines.
+
+    Multiple occurrences of a field are comma separated, as tshark prints
+    them; for the FULL_VALUE_FIELDS only the first occurrence is given, and
+    RAW_VALUE_FIELDS are given by value, as tshark prints them.
+    Admission goes through the memory governor like a tshark pipeline, with
+    the session's process standing for the pipeline; as the pooled session
+    keeps the capture's state, its memory stays counted until it is reused
+    or closed.
+    """
+    session = pool.acquire()
+    if session.idle_task is not None:
+        # This pass's task counts the session from here on
+        get_governor().discard(session.idle_task)
+        session.idle_task = None
+    task = None
+    broken = False
+    loaded = True
+    try:
+        task = get_governor().admit(pcap_file, os.path.getsize(pcap_file))
+        task.pids.append(session.pid)
+        session.loads += 1
+        try:
+            session.call("load", {"file": os.path.abspath(pcap_file)})
+        except SharkdError as e:
+            # A session whose load failed may still hold the previous capture:
+            # retry in a fresh one, whose frames can only come from this capture
+            logger.debug(f"{pcap_file}: {e}, retrying in a new sharkd session")
+            # Until a new session replaces it, the closed one must not go back to the pool
+            broken = True
+            session.close()
+            session = SharkdSession()
+            broken = False
+            task.pids = [session.pid]
+            session.loads += 1
+            try:
+                session.call("load", {"file": os.path.abspath(pcap_file)})
+            except SharkdError as e:
+                # Like tshark on a capture cut short: keep what was read before the error
+                logger.warning(f"{pcap_file}: {e}")
+                loaded = False
+        # Custom columns are given as field:occurrence, 0 for every occurrence (comma separated, as tshark)
+        columns = {f"column{i}": f"{field}:0" for i, field in enumerate(fields)}
+        full = [i for i, field in enumerate(fields) if field in FULL_VALUE_FIELDS]
+        raw = [i for i, field in enumerate(fields) if field in RAW_VALUE_FIELDS]
+        skip = 0
+        while True:
+            params = dict(columns, skip=skip, limit=FRAMES_PAGE)
+            if display_filter:
+                params["filter"] = display_filter
+            try:
+                frames = session.call("frames", params) or []
+            except SharkdError:
+                if loaded:
+                    raise
+                # Nothing was read: no output, as from tshark
+                broken = True
+                return
+            for frame in frames:
+                values = list(frame["c"])
+                tree = None
+                for i in full:
+                    if values[i]:
+                        if tree is None:
+                            tree = session.call("frame", {"frame": frame["num"], "proto": True}).get("tree", [])
+                        values[i] = next(iter(_tree_values(tree, fields[i])), "")
+                for i in raw:
+                    names = values[i].split(",") if values[i] else []
+                    if any((fields[i], name) not in session.raw_values for name in names):
+                        if tree is None:
+                            tree = session.call("frame", {"frame": frame["num"], "proto": True}).get("tree", [])
+                        tree_values = _tree_values(tree, fields[i])
+                        if len(tree_values) == len(names):
+                            session.raw_values.update(((fields[i], name), value) for name, value in zip(names, tree_values))
+                    values[i] = ",".join(session.raw_values.get((fields[i], name), name) for name in names)
+                yield "\t".join(values)
+            if len(frames) < FRAMES_PAGE:
+                break
+            skip += FRAMES_PAGE
+    except SharkdError:
+        broken = True
+        raise
+    finally:
+        if task is not None:
+            # The session outlives the pass, so this reading is live (it keeps the capture's state)
+            task.measure()
+            get_governor().release(task, idle=not broken)
+            if not broken:
+                session.idle_task = task
+        pool.release(session, broken)
+
+
+_pool = None
+
+
+def get_pool(size: int = None) -> SharkdPool:
+    """The sharkd pool of this process, started with `size` sessions on first use."""
+    global _pool
+    if _pool is None:
+        _pool = SharkdPool(size)
+        atexit.register(_pool.close)
+    return _pool
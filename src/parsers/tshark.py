@@ -0,0 +1,293 @@
+import os
+import shutil
+import logging
+import threading
+from src.governor import get_governor
+
+logger = logging.getLogger(__name__)
+
+# External decompressors, tried first: they run as their own process next to
+# tshark, so decompression never competes with the Python parser for the GIL
+DECOMPRESSORS = {
+    ".gz": [["pigz", "-dc"], ["gzip", "-dc"]],
+    ".zst": [["zstd", "-dc", "-q"]],
+    ".xz": [["xz", "-dc"]],
+}
+# Typical compression ratios of captures: tshark's memory follows the
+# decompressed size, which the governor estimates from the size on disk
+COMPRESSION_RATIOS = {".gz": 3.0, ".zst": 3.5, ".xz": 4.0}
+
+# Extraction profiles. "full" dissects every packet with every protocol, as
+# tshark does by default. "fast" first drops irrelevant packets with a BPF
+# prefilter (tcpdump), then dissects the rest with only the protocols the
+# fields need, no name resolution and no analysis/reassembly we don't read.
+EXTRACT_PROFILES = ("full", "fast")
+_extract_profile = "full"
+
+# Extraction backends. "tshark" starts a tshark pipeline per pass; "sharkd"
+# loads the capture into a pooled, long-lived sharkd session, so dissector
+# start-up is paid once per session instead of once per pass.
+EXTRACT_BACKENDS = ("tshark", "sharkd")
+_extract_backend = "tshark"
+
+# Link layers every fast pass needs to reach the ip/ipv6 dissectors
+LINK_PROTOCOLS = ["frame", "eth", "ethertype", "vlan", "sll", "null", "loop"]
+
+
+def set_extract_profile(profile: str):
+    """Select the tshark extraction profile ('full' or 'fast') for this process."""
+    global _extract_profile
+    if profile not in EXTRACT_PROFILES:
+        raise ValueError(f"Unknown extraction profile {profile}, expected one of {EXTRACT_PROFILES}")
+    if profile == "fast" and shutil.which("tcpdump") is None:
+        logger.warning("tcpdump not found: the fast profile will run without BPF prefiltering")
+    _extract_profile = profile
+
+
+def get_extract_profile() -> str:
+    """The tshark extraction profile of this process."""
+    return _extract_profile
+
+
+def set_extract_backend(backend: str, workers: int = None):
+    """
+    Select the extraction backend ('tshark' or 'sharkd') for this process.
+
+    Args:
+        backend (str): Backend name.
+        workers (int): sharkd sessions at once (default: number of CPUs).
+    """
+    global _extract_backend
+    if backend not in EXTRACT_BACKENDS:
+        raise ValueError(f"Unknown extraction backend {backend}, expected one of {EXTRACT_BACKENDS}")
+    if backend == "sharkd":
+        if shutil.which("sharkd") is None:
+            raise RuntimeError("sharkd not found: install Wireshark 3.6 or later, or use the tshark backend")
+        from src.parsers.sharkd import get_pool
+        get_pool(workers)
+    _extract_backend = backend
+
+
+def _sharkd_request(pcap_file: str, options: list, source):
+    """(filter, fields) when the sharkd backend serves this pass, None when it runs through tshark."""
+    if _extract_backend != "sharkd" or source is not None or compression_suffix(pcap_file) is not None:
+        return None
+    from src.parsers.sharkd import fields_request
+    return fields_request(options)
+
+
+def compression_suffix(pcap_file: str):
+    """Return '.gz', '.zst' or '.xz' for a compressed capture, None otherwise."""
+    for suffix in DECOMPRESSORS:
+        if pcap_file.endswith(suffix):
+            return suffix
+    return None
+
+
+def _python_decompressor(pcap_file: str, suffix: str):
+    """Open a compressed capture as a decompressing file object."""
+    if suffix == ".gz":
+        import gzip
+        return gzip.open(pcap_file, 'rb')
+    if suffix == ".xz":
+        import lzma
+        return lzma.open(pcap_file, 'rb')
+    try:
+        import zstandard
+    except ImportError:
+        raise RuntimeError(f"{pcap_file}: install the zstd binary or the zstandard package to read .zst captures")
+    return zstandard.ZstdDecompressor().stream_reader(open(pcap_file, 'rb'), closefd=True)
+
+
+def _feed(source, sink, errors: list):
+    """
+    Copy a decompressed stream into the first process of the pipeline.
+
+    A read error (e.g. a truncated or corrupt compressed capture) is added
+    to `errors`, for _finish_pipeline to raise: tshark only sees the end of
+    its input.
+    """
+    try:
+        shutil.copyfileobj(source, sink, 1 << 20)
+    except BrokenPipeError:
+        pass
+    except Exception as e:
+        errors.append(e)
+    finally:
+        source.close()
+        try:
+            sink.close()
+        except BrokenPipeError:
+            pass
+
+
+def tshark_command(options: list, protocols: list = None, preferences: list = None) -> list:
+    """Build the tshark options for the active profile (the input is added by run_tshark)."""
+    if _extract_profile != "fast":
+        return options
+    command = ["-n"]
+    if protocols:
+        command.append("--disable-all-protocols")
+        for protocol in LINK_PROTOCOLS + protocols:
+            command += ["--enable-protocol", protocol]
+    for preference in preferences or []:
+        command += ["-o", preference]
+    return command + options
+
+
+def _spawn_pipeline(pcap_file: str, options: list, prefilter: str, protocols: list, preferences: list, source, task):
+    """Start the decompressor/prefilter/tshark processes for one capture; returns (processes, feeder thread)."""
+    import subprocess
+    # Each command reads the capture from the path given in its input slot
+    commands = []
+    feeder_source = source
+    suffix = compression_suffix(pcap_file) if source is None else None
+    if suffix is not None:
+        command = next((c for c in DECOMPRESSORS[suffix] if shutil.which(c[0])), None)
+        if command is not None:
+            commands.append(command + [None])
+        else:
+            feeder_source = _python_decompressor(pcap_file, suffix)
+    if _extract_profile == "fast" and prefilter and shutil.which("tcpdump"):
+        commands.append(["tcpdump", "-r", None, "-w", "-", "-U", prefilter])
+    commands.append(["tshark", "-r", None] + tshark_command(options, protocols, preferences))
+
+    processes = []
+    stdin = subprocess.PIPE if feeder_source is not None else None
+    for i, command in enumerate(commands):
+        source = pcap_file if i == 0 and feeder_source is None else "-"
+        command = [source if arg is None else arg for arg in command]
+        stderr = subprocess.DEVNULL if command[0] == "tcpdump" else None
+        process = subprocess.Popen(command, stdin=stdin, stdout=subprocess.PIPE, stderr=stderr)
+        task.pids.append(process.pid)
+        if processes:
+            # The next process holds the only read end, so an early exit reaches the writer as SIGPIPE
+            processes[-1].stdout.close()
+        processes.append(process)
+        stdin = process.stdout
+
+    feeder = None
+    if feeder_source is not None:
+        errors = []
+        feeder = threading.Thread(target=_feed, args=(feeder_source, processes[0].stdin, errors), daemon=True)
+        feeder.errors = errors
+        feeder.start()
+    return processes, feeder
+
+
+def _start_pipeline(pcap_file: str, options: list, prefilter: str = None, protocols: list = None, preferences: list = None,
+                    source=None):
+    """
+    Start the pipeline for one capture once the memory governor admits it.
+
+    Returns:
+        tuple: Processes, feeder thread and governor task (see _finish_pipeline).
+    """
+    # A chunk reader knows how much of the capture it feeds
+    size = getattr(source, "remaining", None)
+    if size is None:
+        size = os.path.getsize(pcap_file)
+        suffix = compression_suffix(pcap_file)
+        if suffix is not None:
+            size = int(size * COMPRESSION_RATIOS[suffix])
+    task = get_governor().admit(pcap_file, size)
+    try:
+        processes, feeder = _spawn_pipeline(pcap_file, options, prefilter, protocols, preferences, source, task)
+    except BaseException:
+        get_governor().release(task)
+        raise
+    return processes, feeder, task
+
+
+def _finish_pipeline(processes: list, feeder: threading.Thread, task, check: bool = True):
+    """
+    Wait for a pipeline and release its governor task.
+
+    With `check`, a failed decompression (in the feeder thread or in an
+    external decompressor) is raised, since tshark's output then silently
+    stops where the capture became unreadable.
+    """
+    processes[-1].stdout.close()
+    for process in processes:
+        process.wait()
+    if feeder is not None:
+        feeder.join()
+    get_governor().release(task)
+    if not check:
+        return
+    if feeder is not None and feeder.errors:
+        raise feeder.errors[0]
+    decompressor = processes[0].args[0]
+    if len(processes) > 1 and processes[0].returncode > 0 and \
+            any(command[0] == decompressor for commands in DECOMPRESSORS.values() for command in commands):
+        raise RuntimeError(f"{task.label}: {decompressor} exited with status {processes[0].returncode}")
+
+
+def run_tshark(pcap_file: str, options: list, prefilter: str = None, protocols: list = None, preferences: list = None,
+               source=None) -> str:
+    """
+    Run tshark over one capture and return its text output.
+
+    Plain .pcap/.pcapng files are read directly. Compressed captures
+    (.pcap.gz, .pcap.zst, .pcap.xz and their pcapng variants) are
+    decompressed as a stream into the pipeline, without temporary files.
+    With the fast profile the capture is also piped through a tcpdump BPF
+    prefilter and tshark only enables the listed protocols.
+
+    With the sharkd backend, field passes over plain captures are served by
+    a pooled sharkd session instead (prefilter, protocols and preferences
+    do not apply); chunks and compressed captures still go through tshark.
+
+    Args:
+        pcap_file (str): Capture file path.
+        options (list): tshark options after -r, e.g. ["-Y", "ip", "-T", "fields", "-e", "ip.src"].
+        prefilter (str): BPF filter keeping every packet the pass can use (fast profile only).
+        protocols (list): Dissectors the pass needs on top of LINK_PROTOCOLS (fast profile only).
+        preferences (list): tshark -o preferences (fast profile only).
+        source (file): Read the capture from this file object instead of pcap_file (e.g. one chunk of it, see chunks.open_chunk).
+
+    Returns:
+        str: tshark's stdout.
+    """
+    request = _sharkd_request(pcap_file, options, source)
+    if request is not None:
+        return "".join(line + "\n" for line in stream_tshark(pcap_file, options))
+    processes, feeder, task = _start_pipeline(pcap_file, options, prefilter, protocols, preferences, source)
+    finished = False
+    try:
+        output = processes[-1].stdout.read()
+        finished = True
+    finally:
+        if not finished:
+            for process in processes:
+                process.kill()
+        _finish_pipeline(processes, feeder, task, finished)
+    return output.decode(errors="replace")
+
+
+def stream_tshark(pcap_file: str, options: list, prefilter: str = None, protocols: list = None, preferences: list = None,
+                  source=None):
+    """
+    Like run_tshark, but yield tshark's output line by line as it is produced.
+
+    Closing the generator early stops the pipeline.
+
+    Yields:
+        str: One output line, without the line terminator.
+    """
+    request = _sharkd_request(pcap_file, options, source)
+    if request is not None:
+        from src.parsers.sharkd import get_pool, stream_fields
+        yield from stream_fields(get_pool(), pcap_file, *request)
+        return
+    processes, feeder, task = _start_pipeline(pcap_file, options, prefilter, protocols, preferences, source)
+    finished = False
+    try:
+        for line in processes[-1].stdout:
+            yield line.decode(errors="replace").rstrip("\r\n")
+        finished = True
+    finally:
+        if not finished:
+            for process in processes:
+                process.kill()
+        _finish_pipeline(processes, feeder, task, finished)
@@ -0,0 +1,196 @@
+import os
+import sys
+import time
+import logging
+import threading
+import contextlib
+from collections import Counter, defaultdict
+
+logger = logging.getLogger(__name__)
+
+# Active profiler for this process; None when --profile was not given
+_profiler = None
+
+
+class StageProfiler:
+    """
+    Profile the pipeline stage by stage.
+
+    Every stage (extraction, merge, translation, classification, save) gets a
+    cProfile run and a stack sampler. Stages that are entered more than once
+    (e.g. one classification per month in party.py) are accumulated, and one
+    <stage>.pstats and one <stage>.collapsed file is written per stage when
+    the profiler is closed. Per-PCAP tshark wait and parse times are written
+    to pcap_times.csv.
+    """
+
+    def __init__(self, output_dir: str, interval: float = 0.005):
+        import cProfile
+        import pstats
+        self._cProfile = cProfile
+        self._pstats = pstats
+        self.output_dir = output_dir
+        self.interval = interval
+        self.stats = {}
+        self.stacks = defaultdict(Counter)
+        self.pcap_times = []
+        self.current_stage = None
+        # Stage of each worker thread running a profiled() function
+        self.thread_stages = {}
+        self._lock = threading.Lock()
+        self._sampler = None
+        self._sampling = threading.Event()
+        os.makedirs(output_dir, exist_ok=True)
+
+    def _add_stats(self, stage: str, profile):
+        with self._lock:
+            if stage in self.stats:
+                self.stats[stage].add(profile)
+            else:
+                self.stats[stage] = self._pstats.Stats(profile)
+
+    def _sample(self):
+        own_id = threading.get_ident()
+        names = {}
+        while self._sampling.is_set():
+            stage = self.current_stage
+            if stage is not None or self.thread_stages:
+                for thread in threading.enumerate():
+                    names[thread.ident] = thread.name
+                for thread_id, frame in sys._current_frames().items():
+                    thread_stage = self.thread_stages.get(thread_id, stage)
+                    if thread_id == own_id or thread_stage is None:
+                        continue
+                    stack = []
+                    while frame is not None:
+                        code = frame.f_code
+                        stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                        frame = frame.f_back
+                    stack.append(names.get(thread_id, str(thread_id)))
+                    self.stacks[thread_stage][";".join(reversed(stack))] += 1
+            time.sleep(self.interval)
+
+    def _start_sampler(self):
+        with self._lock:
+            if self._sampler is None:
+                self._sampling.set()
+                self._sampler = threading.Thread(target=self._sample, name="stage-sampler", daemon=True)
+                self._sampler.start()
+
+    def _enable(self, profile) -> bool:
+        """
+        Start a cProfile run, False if another one already covers this thread.
+
+        From Python 3.12 cProfile runs on sys.monitoring, which allows one
+        active profiler per process and sees every thread: a second enable()
+        raises ValueError while the first one keeps profiling.
+        """
+        try:
+            profile.enable()
+        except ValueError:
+            return False
+        return True
+
+    @contextlib.contextmanager
+    def stage(self, name: str):
+        """Profile the body of the with-block as pipeline stage `name`."""
+        previous = self.current_stage
+        self.current_stage = name
+        self._start_sampler()
+        profile = self._cProfile.Profile()
+        start = time.perf_counter()
+        enabled = self._enable(profile)
+        try:
+            yield
+        finally:
+            if enabled:
+                profile.disable()
+                self._add_stats(name, profile)
+            self.current_stage = previous
+            logger.info(f"[profile] stage {name} took {time.perf_counter() - start:.2f}s")
+
+    def wrap(self, func, stage: str = None):
+        """
+        Profile `func` when it runs in a worker thread.
+
+        cProfile only sees the thread that enabled it, so work submitted to a
+        ThreadPoolExecutor is profiled separately and merged into `stage`, by
+        default the stage that was active when the function was wrapped.
+        """
+        stage = stage or self.current_stage
+        if stage is None:
+            raise ValueError(f"profiled({func.__name__}) outside any profile_stage needs a stage name")
+
+        def wrapper(*args, **kwargs):
+            thread_id = threading.get_ident()
+            self.thread_stages[thread_id] = stage
+            self._start_sampler()
+            profile = self._cProfile.Profile()
+            enabled = self._enable(profile)
+            try:
+                return func(*args, **kwargs)
+            finally:
+                if enabled:
+                    profile.disable()
+                    self._add_stats(stage, profile)
+                self.thread_stages.pop(thread_id, None)
+        return wrapper
+
+    def record_pcap(self, pcap_file: str, tshark_pass: str, wait: float, parse: float):
+        with self._lock:
+            self.pcap_times.append([pcap_file, tshark_pass, f"{wait:.6f}", f"{parse:.6f}"])
+
+    def close(self):
+        """Stop sampling and write one profile file per stage."""
+        self._sampling.clear()
+        if self._sampler is not None:
+            self._sampler.join()
+            self._sampler = None
+        for stage, stats in self.stats.items():
+            stats.dump_stats(os.path.join(self.output_dir, f"{stage}.pstats"))
+        for stage, stacks in self.stacks.items():
+            with open(os.path.join(self.output_dir, f"{stage}.collapsed"), 'w') as f:
+                for stack, count in stacks.most_common():
+                    f.write(f"{stack} {count}\n")
+        if self.pcap_times:
+            import csv
+            with open(os.path.join(self.output_dir, "pcap_times.csv"), 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(["PCAP", "Pass", "Tshark Wait (s)", "Parse (s)"])
+                writer.writerows(self.pcap_times)
+        logger.info(f"[profile] stage profiles written to {self.output_dir}")
+
+
+def enable_profiling(output_dir: str) -> StageProfiler:
+    """Turn on stage profiling for the rest of this process."""
+    global _profiler
+    _profiler = StageProfiler(output_dir)
+    return _profiler
+
+
+def finish_profiling():
+    """Write the stage profiles, if profiling was enabled."""
+    global _profiler
+    if _profiler is not None:
+        _profiler.close()
+        _profiler = None
+
+
+def profile_stage(name: str):
+    """Context manager marking a pipeline stage; a no-op unless profiling is on."""
+    if _profiler is None:
+        return contextlib.nullcontext()
+    return _profiler.stage(name)
+
+
+def profiled(func, stage: str = None):
+    """Wrap a function submitted to a worker thread so the active stage (or `stage`) profiles it."""
+    if _profiler is None:
+        return func
+    return _profiler.wrap(func, stage)
+
+
+def record_pcap_timing(pcap_file: str, tshark_pass: str, wait: float, parse: float):
+    """Record time spent waiting on tshark vs. parsing its output for one PCAP."""
+    if _profiler is not None:
+        _profiler.record_pcap(pcap_file, tshark_pass, wait, parse)
@@ -1,19 +1,20 @@
 import logging
 import os
+import re
 import sys
-import json
-import subprocess
-import tldextract
-from collections import defaultdict
-import csv
-import multiprocessing
-import concurrent
-import pickle
+import calendar
 import ipaddress
+from collections import defaultdict
 
 ipv6_ip_block = '2001:470:8863:1aba'
 dataset_root_path = '/net/data/iot-longitudinal/datasets' # cfg['dataset_root_path']
 
+# Captures accepted as input: pcap/pcapng, optionally gzip/zstd/xz compressed
+capture_suffixes = tuple(ext + comp for ext in ('.pcap', '.pcapng') for comp in ('', '.gz', '.zst', '.xz'))
+
+# Capture file names: YYYY-MM-DD_HH.MM.SS_<deviceIP>.pcap (or one of the capture_suffixes)
+pcap_name_re = re.compile(r'^(\d{4})-(\d{2})-(\d{2})_(\d{2})\.(\d{2})\.(\d{2})_(.+)\.pcap(?:ng)?(?:\.gz|\.zst|\.xz)?$')
+
 def output_file_generator(out_dir:str, basename:str, device:str, file:str) -> str:
     tmp_dir = os.path.join(out_dir, basename)
     if not os.path.exists(tmp_dir):
@@ -89,6 +90,53 @@ def get_device_name(full_path, dataset_root_path):
 
     raise ValueError(f"Unexpected path structure: {new_full_path}")
 
+def parse_pcap_name(file_name:str):
+    """
+    Parse a capture file name of the form YYYY-MM-DD_HH.MM.SS_<deviceIP>.pcap
+    (also .pcapng and compressed variants).
+
+    Args:
+        file_name (str): File name or path.
+
+    Returns:
+        tuple: (timestamp as UTC epoch seconds, device IP), or None if the name does not match.
+    """
+    match = pcap_name_re.match(os.path.basename(file_name))
+    if not match:
+        return None
+    year, month, day, hour, minute, second = (int(x) for x in match.groups()[:6])
+    try:
+        ts = calendar.timegm((year, month, day, hour, minute, second))
+    except ValueError:
+        return None
+    return ts, match.group(7)
+
+def read_pcap_list(input_file:str) -> dict[str, list[str]]:
+    """
+    Read an input list of PCAP paths and group the readable ones by device.
+
+    Args:
+        input_file (str): File with one PCAP path per line ('#' lines are skipped).
+
+    Returns:
+        dict: Device name -> PCAP paths, in input order.
+    """
+    device_pcap = defaultdict(list)
+    logger = logging.getLogger(__name__)
+    with open(input_file, 'r') as f:
+        for line in f:
+            line = line.strip()
+            if line.startswith("#") or not line.endswith(capture_suffixes):
+                continue
+            if not os.access(line, os.R_OK):
+                logger.error(f"{line}: No read permission")
+                continue
+
+            # Extract the device name from the pcap file name
+            device_name = get_device_name(line, dataset_root_path)
+            device_pcap[device_name].append(line)
+    return device_pcap
+
 
 
 # def is_local(ip_src, ip_dst):